@@ -0,0 +1,119 @@
+"""Move finished games out of the collection live games are looked up in.
+
+Games that reached ``GAME_OVER`` and have not been written for ``after``
+seconds (their ``updated_at``, stamped by ``game_cache``) are copied to a
+cold collection and deleted from the hot one, ``batch`` at a time, every
+``interval`` seconds.  The hot collection and its indexes then only grow
+with the games being played.  ``GameCache`` still loads an archived game
+from the cold collection and moves it back to the hot one, so finished
+games stay readable and their writes land.
+
+A game is only deleted at the version it was copied at, and never while
+``live()`` (the ids the cache holds) has it: a game written again since it
+was copied stays in the hot collection, and the next pass copies it over
+again.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Callable, Collection, Dict, Optional
+
+from pymongo import DeleteOne
+from pymongo.errors import BulkWriteError
+
+from engine import GamePhase
+from game_cache import utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class GameArchive:
+    """Finished games moved from ``collection`` to ``archive_collection``"""
+
+    def __init__(self, collection, archive_collection, after: float = 86400.0, interval: float = 3600.0,
+                 batch: int = 1000):
+        self.collection = collection
+        self.archive_collection = archive_collection
+        self.after = after
+        self.interval = interval
+        self.batch = batch
+        self.clock: Callable = utcnow
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self.archived = 0
+        self.passes = 0
+
+    async def archive(self, live: Callable[[], Collection[str]] = frozenset) -> int:
+        """Move the finished games idle for ``after`` seconds, return how many moved"""
+        query = {"current_phase": GamePhase.GAME_OVER.value,
+                 "updated_at": {"$lt": self.clock() - timedelta(seconds=self.after)}}
+        moved = 0
+        # Finished games the cache still holds, left for a later pass
+        skipped = []
+        while True:
+            if skipped:
+                query["id"] = {"$nin": skipped}
+            docs = await self.collection.find(query).sort("updated_at", 1).limit(self.batch).to_list(self.batch)
+            cached = live()
+            idle = []
+            for doc in docs:
+                if doc["id"] in cached:
+                    skipped.append(doc["id"])
+                else:
+                    idle.append(doc)
+            if idle:
+                await self._copy(idle)
+                result = await self.collection.bulk_write(
+                    [DeleteOne({"_id": doc["_id"], "version": doc.get("version", 0)}) for doc in idle],
+                    ordered=False)
+                moved += result.deleted_count
+                if result.deleted_count < len(idle):
+                    # Written again since: copied over again on the next pass
+                    break
+            if len(docs) < self.batch:
+                break
+        self.archived += moved
+        self.passes += 1
+        return moved
+
+    def start(self, live: Callable[[], Collection[str]] = frozenset):
+        """Archive every ``interval`` seconds in the background"""
+        if self._task is None:
+            # Made on the loop it runs on, which differs between test clients
+            self._stop = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._archive_forever(live))
+
+    async def close(self):
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"archived": self.archived, "passes": self.passes}
+
+    async def _copy(self, docs):
+        try:
+            await self.archive_collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Copied by an earlier pass that did not get to delete them
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            for error in e.details["writeErrors"]:
+                doc = error["op"]
+                await self.archive_collection.replace_one({"id": doc["id"]}, doc)
+
+    async def _archive_forever(self, live):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stop.is_set():
+                break
+            try:
+                moved = await self.archive(live)
+                if moved:
+                    logger.info("Archived %d finished games", moved)
+            except Exception:
+                logger.exception("Game archival failed, retrying")
@@ -0,0 +1,899 @@
+"""Compact in-memory game state for engine work.
+
+The Pydantic models in ``engine`` are the API schema: every card is a model
+with a uuid string and a description, and parsing or dumping a game walks a
+few hundred of them.  ``CompactGame`` keeps the same game in flat slots and
+arrays instead.  Cards are small ints indexing a per-game card table, piles
+and hands are ``array('H')`` of those indexes and per-rider fields are one
+array per field, so the models only exist when a game crosses the API
+boundary (``from_document``/``to_document`` and ``from_state``/``to_state``).
+
+The turn functions record what they change, so ``take_update`` can send Mongo
+only the rider fields and piles that moved plus ``$push`` for new log lines
+instead of rewriting the whole document.
+
+The game log is kept out of line: the document holds the last ``LOG_TAIL``
+lines and ``log_count``, and ``take_update`` hands back the new lines as
+entries for the log collection, numbered by ``seq``.  Lines stay in memory
+until ``trim_log`` is told they are in the collection.
+
+The turn functions below follow ``FlammeRougeEngine`` step for step, with the
+same RNG draws and the same log lines, so both produce the same game from the
+same seed.
+"""
+import random
+from array import array
+from typing import Collection, List, Optional, Sequence, Set, Tuple
+
+from engine import (
+    CardType, GamePhase, GameState, MAX_CARD_VALUE, RiderType, TERRAINS, TerrainType, Track, TrackOccupancy,
+    WeatherType, get_layout,
+)
+from rng import GameRandom
+import metrics
+
+CARD_TYPES = (CardType.SPRINTEUR, CardType.ROULEUR, CardType.FATIGUE)
+SPRINTEUR, ROULEUR, FATIGUE = range(3)
+CARD_CODES = {card_type.value: code for code, card_type in enumerate(CARD_TYPES)}
+# Log text of each type, as the engine formats a Card in an f-string
+CARD_LABELS = tuple(format(card_type) for card_type in CARD_TYPES)
+DESCRIPTIONS = (
+    tuple(f"Sprinteur {value}" for value in range(256)),
+    tuple(f"Rouleur {value}" for value in range(256)),
+    ("Fatigue",) * 256,
+)
+
+# Piles of a team, in document order
+PILES = ("sprinteur_deck", "rouleur_deck", "fatigue_deck", "sprinteur_discard", "rouleur_discard")
+SPRINTEUR_DECK, ROULEUR_DECK, FATIGUE_DECK, SPRINTEUR_DISCARD, ROULEUR_DISCARD = range(5)
+
+TERRAIN_CODES = {terrain.value: code for code, terrain in enumerate(TERRAINS)}
+MOUNTAIN = TERRAIN_CODES[TerrainType.MOUNTAIN]
+
+NO_CARD = -1
+
+# Log lines kept in the game document, the full log lives in its own collection
+LOG_TAIL = 20
+
+_PHASE_HELP = "Seconds spent in each phase of a turn"
+AI_TIME = metrics.histogram("flamme_rouge_phase_seconds", _PHASE_HELP, phase="ai")
+MOVEMENT_TIME = metrics.histogram("flamme_rouge_phase_seconds", _PHASE_HELP, phase="movement")
+SLIPSTREAM_TIME = metrics.histogram("flamme_rouge_phase_seconds", _PHASE_HELP, phase="slipstream")
+FATIGUE_TIME = metrics.histogram("flamme_rouge_phase_seconds", _PHASE_HELP, phase="fatigue")
+
+class CompactGame:
+    """A game as flat arrays, riders numbered team by team"""
+
+    __slots__ = (
+        "id", "layout", "terrain", "length", "tables", "rng", "weather", "current_turn", "current_phase",
+        "active_team_index", "finished_riders", "game_log", "log_turns", "log_base", "version", "revision",
+        "card_ids", "card_types", "card_values",
+        "team_ids", "team_tokens", "team_names", "team_riders", "piles",
+        "rider_ids", "rider_names", "rider_colors", "rider_team", "ai",
+        "position", "lane", "hands", "played", "fatigue_count", "finished", "finish_position",
+        "rider_changes", "pile_changes", "log_saved", "log_stored", "finishers_saved", "rng_saved", "full_write",
+    )
+
+    def __init__(self):
+        self.card_ids: List[str] = []
+        self.card_types = bytearray()
+        self.card_values = bytearray()
+        self.team_ids: List[str] = []
+        self.team_tokens: List[Optional[str]] = []
+        self.team_names: List[str] = []
+        self.team_riders: List[range] = []
+        self.piles: List[List[array]] = []
+        self.rider_ids: List[str] = []
+        self.rider_names: List[str] = []
+        self.rider_colors: List[str] = []
+        self.rider_team = array("H")
+        self.ai = bytearray()
+        self.position = array("H")
+        self.lane = bytearray()
+        self.hands: List[array] = []
+        self.played = array("h")
+        self.fatigue_count = array("H")
+        self.finished = bytearray()
+        self.finish_position = array("H")  # 0 until the rider is ranked
+        # Changes since the last take_update: (rider, field) and (team, pile)
+        self.rider_changes: Set[Tuple[int, str]] = set()
+        self.pile_changes: Set[Tuple[int, int]] = set()
+        self.log_saved = 0
+        # Lines before this seq are in the log collection, see ``trim_log``
+        self.log_stored = 0
+        self.finishers_saved = 0
+        self.full_write = False
+
+    @property
+    def rider_count(self) -> int:
+        return len(self.rider_ids)
+
+# API boundary
+def _add_cards(game: CompactGame, groups: List[List[dict]]) -> List[array]:
+    """Append groups of cards to the card table and return the indexes of each group"""
+    cards = [c for group in groups for c in group]
+    start = len(game.card_ids)
+    game.card_ids.extend([c["id"] for c in cards])
+    game.card_types.extend([CARD_CODES[c["type"]] for c in cards])
+    game.card_values.extend([c["value"] for c in cards])
+    indexes = []
+    for group in groups:
+        indexes.append(array("H", range(start, start + len(group))))
+        start += len(group)
+    return indexes
+
+def from_document(doc: dict) -> CompactGame:
+    """Build a compact game from a stored document or ``GameState.dict()``"""
+    game = CompactGame()
+    game.id = doc["id"]
+    track = doc["track"]
+    if track.get("tiles"):
+        # Stored before games referred to their track: rewrite it as a reference
+        game.layout = get_layout(Track(**track).id)
+        game.full_write = True
+    else:
+        game.layout = get_layout(track["id"])
+        if game.layout is None:
+            raise ValueError(f"Unknown track {track['id']}")
+    game.terrain = game.layout.terrain
+    game.length = game.layout.length
+    game.tables = game.layout.tables
+    game.weather = WeatherType(doc["weather"])
+    game.current_turn = doc["current_turn"]
+    game.current_phase = GamePhase(doc["current_phase"])
+    game.active_team_index = doc["active_team_index"]
+    game.version = doc.get("version", 0)
+    # Actions ever applied, see ``etag``
+    game.revision = doc.get("revision", 0)
+    # Games from before per-game generators get one seeded by their id
+    game.rng = GameRandom.loads(doc["rng_state"]) if doc.get("rng_state") else GameRandom(game.id)
+    game.rng_saved = doc.get("rng_state")
+    game.finished_riders = list(doc["finished_riders"])
+    game.game_log = list(doc["game_log"])
+    game.log_turns = array("H", bytes(2 * len(game.game_log)))
+    game.finishers_saved = len(game.finished_riders)
+    if doc.get("log_count", 0) >= len(game.game_log):
+        game.log_base = doc["log_count"] - len(game.game_log)
+        game.log_saved = len(game.game_log)
+        game.log_stored = doc["log_count"]
+    else:
+        # A log that was never moved out (older documents, FlammeRougeEngine):
+        # its lines still go to the log collection
+        game.log_base = 0
+        game.log_saved = 0
+        game.log_stored = 0
+
+    card_ids = game.card_ids
+    for t, team in enumerate(doc["teams"]):
+        game.team_ids.append(team["id"])
+        # Teams from before tokens have none, only spectators see those games
+        game.team_tokens.append(team.get("token"))
+        game.team_names.append(team["name"])
+        team_cards = len(card_ids)
+        riders = team["riders"]
+        indexes = _add_cards(game, [team[pile] for pile in PILES] + [rider["hand"] for rider in riders])
+        game.piles.append(indexes[:len(PILES)])
+        game.hands.extend(indexes[len(PILES):])
+        first = game.rider_count
+        for rider in riders:
+            game.rider_ids.append(rider["id"])
+            game.rider_names.append(rider["name"])
+            game.rider_colors.append(rider["color"])
+            game.rider_team.append(t)
+            game.ai.append(rider["rider_type"] == RiderType.AI_BOT)
+            game.position.append(rider["position"]["track_position"])
+            game.lane.append(rider["position"]["lane"])
+            played = rider["played_card"]
+            if played is None:
+                game.played.append(NO_CARD)
+            else:
+                # A played card is also on its team's discard pile, unless it is fatigue
+                try:
+                    game.played.append(card_ids.index(played["id"], team_cards))
+                except ValueError:
+                    game.played.append(_add_cards(game, [[played]])[0][0])
+            game.fatigue_count.append(rider["fatigue_count"])
+            game.finished.append(rider["finished"])
+            game.finish_position.append(rider["finish_position"] or 0)
+        game.team_riders.append(range(first, game.rider_count))
+    return game
+
+# The keys of ``to_document``
+DOCUMENT_FIELDS = (
+    "id", "teams", "track", "current_turn", "current_phase", "active_team_index", "weather",
+    "finished_riders", "game_log", "log_count", "version", "revision", "rng_state",
+)
+
+# Keys of ``to_document`` stored as it dumps them whatever the age of the
+# document, which MongoDB can project without loading the game
+STORED_FIELDS = frozenset((
+    "id", "teams", "current_turn", "current_phase", "active_team_index", "weather", "finished_riders", "version",
+    "revision",
+))
+
+def to_document(game: CompactGame, fields: Optional[Collection[str]] = None) -> dict:
+    """Dump a compact game with the layout of ``GameState.dict()``
+
+    A card that sits in several places (played and discarded) is the same
+    dict in both, treat the result as read-only.  Only the keys in ``fields``
+    are dumped if given, teams (most of the work) only if asked for.
+    """
+    if fields is None:
+        return {"id": game.id, "teams": _teams_document(game), **_game_fields(game)}
+    document = {key: value for key, value in _game_fields(game).items() if key in fields}
+    if "teams" in fields:
+        document["teams"] = _teams_document(game)
+    return document
+
+def _game_fields(game: CompactGame) -> dict:
+    return {
+        "id": game.id,
+        "track": game.layout.reference(),
+        "current_turn": game.current_turn,
+        "current_phase": game.current_phase.value,
+        "active_team_index": game.active_team_index,
+        "weather": game.weather.value,
+        "finished_riders": list(game.finished_riders),
+        "game_log": game.game_log[-LOG_TAIL:],
+        "log_count": game.log_base + len(game.game_log),
+        "version": game.version,
+        "revision": game.revision,
+        "rng_state": game.rng.dumps(),
+    }
+
+def _teams_document(game: CompactGame) -> List[dict]:
+    type_names = [card_type.value for card_type in CARD_TYPES]
+    cards = [{"id": card_id, "type": type_names[code], "value": value,
+              "description": DESCRIPTIONS[code][value]}
+             for card_id, code, value in zip(game.card_ids, game.card_types, game.card_values)]
+    teams = []
+    for t, riders in enumerate(game.team_riders):
+        team_id = game.team_ids[t]
+        team = {"id": team_id, "name": game.team_names[t], "token": game.team_tokens[t], "riders": [
+            {
+                "id": game.rider_ids[r],
+                "name": game.rider_names[r],
+                "color": game.rider_colors[r],
+                "team_id": team_id,
+                "rider_type": (RiderType.AI_BOT if game.ai[r] else RiderType.HUMAN).value,
+                "position": {"track_position": game.position[r], "lane": game.lane[r]},
+                "hand": [cards[c] for c in game.hands[r]],
+                "played_card": None if game.played[r] == NO_CARD else cards[game.played[r]],
+                "fatigue_count": game.fatigue_count[r],
+                "finished": bool(game.finished[r]),
+                "finish_position": game.finish_position[r] or None,
+            }
+            for r in riders
+        ]}
+        for name, pile in zip(PILES, game.piles[t]):
+            team[name] = [cards[c] for c in pile]
+        teams.append(team)
+    return teams
+
+# Views: the game as the players of one team may see it, what the API
+# answers with.  Hands are theirs only, decks and discard piles are counts,
+# cards played by the other teams stay hidden until every card is down, and
+# the generator state (which foretells the draws) is only stored.  A
+# spectator (no team) sees no hand at all.
+VIEW_FIELDS = tuple(field for field in DOCUMENT_FIELDS if field != "rng_state")
+_RIDER_VIEW_FIELDS = ("id", "name", "color", "team_id", "rider_type", "position", "fatigue_count", "finished",
+                      "finish_position")
+
+def to_view(game: CompactGame, team_id: Optional[str], fields: Optional[Collection[str]] = None) -> dict:
+    """``to_document`` as the players of ``team_id`` see it, only ``fields`` if given"""
+    document = {key: value for key, value in _game_fields(game).items()
+                if key in VIEW_FIELDS and (fields is None or key in fields)}
+    if fields is not None and "teams" not in fields:
+        return document
+    type_names = [card_type.value for card_type in CARD_TYPES]
+    card_ids, card_types, card_values = game.card_ids, game.card_types, game.card_values
+
+    def card(c):
+        code, value = card_types[c], card_values[c]
+        return {"id": card_ids[c], "type": type_names[code], "value": value, "description": DESCRIPTIONS[code][value]}
+
+    hidden = game.current_phase == GamePhase.CARD_SELECTION
+    teams = []
+    for t, riders in enumerate(game.team_riders):
+        own = game.team_ids[t] == team_id
+        team = {"id": game.team_ids[t], "name": game.team_names[t], "riders": [
+            {
+                "id": game.rider_ids[r],
+                "name": game.rider_names[r],
+                "color": game.rider_colors[r],
+                "team_id": game.team_ids[t],
+                "rider_type": (RiderType.AI_BOT if game.ai[r] else RiderType.HUMAN).value,
+                "position": {"track_position": game.position[r], "lane": game.lane[r]},
+                "hand": [card(c) for c in game.hands[r]] if own else None,
+                "hand_count": len(game.hands[r]),
+                "played_card": None if game.played[r] == NO_CARD or (hidden and not own) else card(game.played[r]),
+                "card_selected": game.played[r] != NO_CARD,
+                "fatigue_count": game.fatigue_count[r],
+                "finished": bool(game.finished[r]),
+                "finish_position": game.finish_position[r] or None,
+            }
+            for r in riders
+        ]}
+        for name, pile in zip(PILES, game.piles[t]):
+            team[f"{name}_count"] = len(pile)
+        teams.append(team)
+    document["teams"] = teams
+    return document
+
+def view_patch(game: CompactGame, team_id: Optional[str], ops: List[dict]) -> List[dict]:
+    """Operations of ``apply_action`` on ``to_document`` as operations on ``to_view``
+
+    Cards are judged by the phase the game is in now, so translate the
+    operations of an action before the game takes another.
+    """
+    hidden = game.current_phase == GamePhase.CARD_SELECTION
+    view = []
+    for op in ops:
+        path = op["path"]
+        if not path.startswith("/teams/"):
+            view.append(op)
+            if path == "/current_phase":
+                # The cards of the other teams show (or hide) with the phase
+                for t, riders in enumerate(game.team_riders):
+                    if game.team_ids[t] == team_id:
+                        continue
+                    for i, r in enumerate(riders):
+                        view.append({"op": "replace", "path": f"/teams/{t}/riders/{i}/played_card",
+                                     "value": None if hidden else _rider_field(game, r, "played_card")})
+            continue
+        parts = path.split("/")
+        own = game.team_ids[int(parts[2])] == team_id
+        if parts[3] != "riders":
+            view.append({"op": "replace", "path": f"{path}_count", "value": len(op["value"])})
+        elif parts[5] == "hand":
+            if own:
+                view.append(op)
+            view.append({"op": "replace", "path": f"{path}_count", "value": len(op["value"])})
+        elif parts[5] == "played_card":
+            view.append({"op": "replace", "path": path, "value": op["value"] if own or not hidden else None})
+            view.append({"op": "replace", "path": path.replace("played_card", "card_selected"),
+                         "value": op["value"] is not None})
+        else:
+            view.append(op)
+    return view
+
+def view_pipeline(game_id: str, token: Optional[str], fields: Optional[Collection[str]] = None) -> List[dict]:
+    """Aggregation building ``to_view`` from the stored document in MongoDB
+
+    For the players of the team whose token is ``token``, a spectator if None.  The result also
+    has ``version`` and ``revision``, and ``viewer``: whether ``token`` is a team's (never for a
+    spectator).  Its ``track`` may be a layout that is not registered (a document from before
+    tracks were references), see ``get_layout``.
+    """
+    if token is None:
+        # Teams from before tokens have none either
+        own = viewer = {"$literal": False}
+    else:
+        token = {"$literal": token}
+        own = {"$eq": ["$$team.token", token]}
+        viewer = {"$in": [token, "$teams.token"]}
+    rider = {key: f"$$rider.{key}" for key in _RIDER_VIEW_FIELDS}
+    rider.update({
+        "hand": {"$cond": [own, "$$rider.hand", None]},
+        "hand_count": {"$size": "$$rider.hand"},
+        "played_card": {"$cond": [
+            {"$or": [own, {"$ne": ["$current_phase", GamePhase.CARD_SELECTION.value]}]}, "$$rider.played_card", None]},
+        "card_selected": {"$ne": [{"$ifNull": ["$$rider.played_card", None]}, None]},
+    })
+    team = {"id": "$$team.id", "name": "$$team.name",
+            "riders": {"$map": {"input": "$$team.riders", "as": "rider", "in": rider}}}
+    team.update({f"{name}_count": {"$size": f"$$team.{name}"} for name in PILES})
+    projection = {
+        "teams": {"$map": {"input": "$teams", "as": "team", "in": team}},
+        "track": {"id": "$track.id", "name": "$track.name", "length": "$track.length"},
+        "game_log": {"$slice": ["$game_log", -LOG_TAIL]},
+        # Documents whose log was never moved out hold all of it
+        "log_count": {"$ifNull": ["$log_count", {"$size": "$game_log"}]},
+    }
+    projection = {
+        field: projection.get(field, 1) for field in VIEW_FIELDS if fields is None or field in fields
+    }
+    projection.update({"_id": 0, "version": 1, "revision": 1, "viewer": viewer})
+    return [{"$match": {"id": game_id}}, {"$project": projection}]
+
+def etag(revision: int) -> str:
+    """Weak ETag of a game: its revision, stored with it and bumped by every action"""
+    return f'W/"{revision}"'
+
+def _rider_field(game: CompactGame, rider: int, field: str):
+    if field == "hand":
+        return [_card_document(game, c) for c in game.hands[rider]]
+    if field == "played_card":
+        played = game.played[rider]
+        return None if played == NO_CARD else _card_document(game, played)
+    if field == "position":
+        return {"track_position": game.position[rider], "lane": game.lane[rider]}
+    if field == "fatigue_count":
+        return game.fatigue_count[rider]
+    if field == "finished":
+        return bool(game.finished[rider])
+    if field == "finish_position":
+        return game.finish_position[rider] or None
+    raise KeyError(field)
+
+def _card_document(game: CompactGame, card: int) -> dict:
+    code, value = game.card_types[card], game.card_values[card]
+    return {"id": game.card_ids[card], "type": CARD_TYPES[code].value, "value": value,
+            "description": DESCRIPTIONS[code][value]}
+
+def take_update(game: CompactGame) -> Tuple[dict, List[dict]]:
+    """Mongo update for everything changed since the last call, which it forgets
+
+    Rider fields and piles that changed are ``$set`` by path and new log lines
+    and finishers are ``$push``ed.  After ``mark_unsaved`` (a write that may or
+    may not have landed) the next update rewrites the whole document instead,
+    which is safe to apply twice.  Either way ``version`` is set one past
+    ``game.version``; apply it with ``version_filter`` and bump
+    ``game.version`` once it is stored.
+
+    Also returns the new log entries, to insert once the update is stored
+    and then pass to ``trim_log``.
+    """
+    finishers = game.finished_riders[game.finishers_saved:]
+    log = game.game_log[game.log_saved:]
+    entries = log_entries(game, game.log_base + game.log_saved - 1)
+    game.finishers_saved = len(game.finished_riders)
+    game.log_saved = len(game.game_log)
+    rider_changes, game.rider_changes = game.rider_changes, set()
+    pile_changes, game.pile_changes = game.pile_changes, set()
+    if game.full_write:
+        game.full_write = False
+        changes = to_document(game)
+        game.rng_saved = changes["rng_state"]
+        changes["version"] = game.version + 1
+        return {"$set": changes}, entries
+
+    changes = {
+        "current_turn": game.current_turn,
+        "current_phase": game.current_phase.value,
+        "active_team_index": game.active_team_index,
+        "weather": game.weather.value,
+        "log_count": game.log_base + len(game.game_log),
+        "version": game.version + 1,
+        "revision": game.revision,
+    }
+    rng_state = game.rng.dumps()
+    if rng_state != game.rng_saved:
+        changes["rng_state"] = game.rng_saved = rng_state
+    for r, field in rider_changes:
+        t = game.rider_team[r]
+        changes[f"teams.{t}.riders.{r - game.team_riders[t].start}.{field}"] = _rider_field(game, r, field)
+    for t, pile in pile_changes:
+        changes[f"teams.{t}.{PILES[pile]}"] = [_card_document(game, c) for c in game.piles[t][pile]]
+    update = {"$set": changes}
+    pushes = {}
+    if finishers:
+        pushes["finished_riders"] = {"$each": finishers}
+    if log:
+        pushes["game_log"] = {"$each": log, "$slice": -LOG_TAIL}
+    if pushes:
+        update["$push"] = pushes
+    return update, entries
+
+def trim_log(game: CompactGame, seq: int):
+    """The log collection has every line up to ``seq``: forget those that fell out of the tail
+
+    Only once the insert is confirmed, until then ``log_entries`` reads the
+    lines from memory.
+    """
+    game.log_stored = max(game.log_stored, seq + 1)
+    drop = min(len(game.game_log) - LOG_TAIL, game.log_saved, game.log_stored - game.log_base)
+    if drop > 0:
+        del game.game_log[:drop]
+        del game.log_turns[:drop]
+        game.log_base += drop
+        game.log_saved -= drop
+
+def add_log(game: CompactGame, line: str):
+    game.game_log.append(line)
+    game.log_turns.append(game.current_turn)
+
+def log_entries(game: CompactGame, since: int = -1) -> List[dict]:
+    """Log entries after ``since`` that are still in memory"""
+    start = max(since + 1 - game.log_base, 0)
+    return [{"game_id": game.id, "seq": game.log_base + i, "turn": game.log_turns[i], "line": game.game_log[i]}
+            for i in range(start, len(game.game_log))]
+
+def version_filter(game: CompactGame) -> dict:
+    """Matches the stored game only if nobody wrote it since we read it"""
+    # Games stored before versioning have no version field
+    version = game.version if game.version else {"$in": [0, None]}
+    return {"id": game.id, "version": version}
+
+def mark_unsaved(game: CompactGame):
+    """The last update failed or was interrupted, rewrite the game next time"""
+    game.full_write = True
+
+def from_state(game_state: GameState) -> CompactGame:
+    return from_document(game_state.dict())
+
+def to_state(game: CompactGame) -> GameState:
+    return GameState(**to_document(game))
+
+# Rules, mirroring FlammeRougeEngine
+def find_rider(game: CompactGame, rider_id: str) -> Optional[int]:
+    try:
+        return game.rider_ids.index(rider_id)
+    except ValueError:
+        return None
+
+def find_card(game: CompactGame, rider: int, card_id: str) -> Optional[int]:
+    """Card index of ``card_id`` if it is in the rider's hand"""
+    card_ids = game.card_ids
+    for card in game.hands[rider]:
+        if card_ids[card] == card_id:
+            return card
+    return None
+
+def card_label(game: CompactGame, card: int) -> str:
+    """``"<type> <value>"`` exactly as the engine formats a Card in the log"""
+    return f"{CARD_LABELS[game.card_types[card]]} {game.card_values[card]}"
+
+def draw_cards(game: CompactGame, rider: int, rng=random):
+    """Draw 2 sprinteur + 2 rouleur cards, reshuffling a discard pile when a deck runs out"""
+    team = game.rider_team[rider]
+    piles = game.piles[team]
+    hand = game.hands[rider] = array("H")
+    game.rider_changes.add((rider, "hand"))
+    for deck, discard in ((SPRINTEUR_DECK, SPRINTEUR_DISCARD), (ROULEUR_DECK, ROULEUR_DISCARD)):
+        for _ in range(2):
+            if piles[deck]:
+                hand.append(piles[deck].pop())
+                game.pile_changes.add((team, deck))
+            elif piles[discard]:
+                reshuffled = array("H", piles[discard])
+                rng.shuffle(reshuffled)
+                piles[deck] = reshuffled
+                piles[discard] = array("H")
+                hand.append(reshuffled.pop())
+                game.pile_changes.add((team, deck))
+                game.pile_changes.add((team, discard))
+
+def ai_select_card(game: CompactGame, rider: int) -> Optional[int]:
+    hand = game.hands[rider]
+    if not hand:
+        return None
+    values = game.card_values
+    position = game.position[rider]
+
+    if game.length - position > 15:
+        return max(hand, key=values.__getitem__)
+    if position < game.length and game.terrain[position] == MOUNTAIN:
+        for card in hand:
+            if 3 <= values[card] <= 5:
+                return card
+        return min(hand, key=values.__getitem__)
+    return sorted(hand, key=values.__getitem__)[len(hand) // 2]
+
+def play_card(game: CompactGame, rider: int, card: int):
+    """Move a card from the rider's hand to played and onto the team discard"""
+    hand = game.hands[rider]
+    del hand[hand.index(card)]
+    game.played[rider] = card
+    game.rider_changes.add((rider, "hand"))
+    game.rider_changes.add((rider, "played_card"))
+    code = game.card_types[card]
+    discard = SPRINTEUR_DISCARD if code == SPRINTEUR else ROULEUR_DISCARD if code == ROULEUR else None
+    if discard is not None:
+        team = game.rider_team[rider]
+        game.piles[team][discard].append(card)
+        game.pile_changes.add((team, discard))
+
+def all_cards_selected(game: CompactGame) -> bool:
+    played, hands, finished = game.played, game.hands, game.finished
+    return all(played[r] != NO_CARD or not hands[r]
+               for r in range(game.rider_count) if not finished[r])
+
+def ai_choices(game: CompactGame, bot=None) -> List[Tuple[int, int]]:
+    """(rider, card) for every AI rider yet to play, chosen by ``bot`` (``mcts.MCTSBot``) if given"""
+    with AI_TIME.time():
+        choices = bot.select_cards(game) if bot is not None else {}
+        picks = []
+        for r in range(game.rider_count):
+            if game.ai[r] and game.played[r] == NO_CARD and not game.finished[r]:
+                card = choices.get(r)
+                if card is None:
+                    card = ai_select_card(game, r)
+                if card is not None:
+                    picks.append((r, card))
+    return picks
+
+def play_ai_card(game: CompactGame, rider: int, card: int):
+    play_card(game, rider, card)
+    add_log(game, f"{game.rider_names[rider]} (AI) played {card_label(game, card)}")
+
+def select_ai_cards(game: CompactGame, bot=None):
+    """Play a card for every AI rider"""
+    for r, card in ai_choices(game, bot):
+        play_ai_card(game, r, card)
+
+def _occupancy(game: CompactGame, riders: List[int]) -> TrackOccupancy:
+    occupancy = TrackOccupancy(game.tables.lanes, game.length)
+    for r in riders:
+        occupancy.add(game.position[r], game.lane[r])
+    return occupancy
+
+def _move(game: CompactGame, occupancy: TrackOccupancy, rider: int, position: int, lane: int):
+    occupancy.remove(game.position[rider], game.lane[rider])
+    game.position[rider] = position
+    game.lane[rider] = lane
+    game.rider_changes.add((rider, "position"))
+    if position < occupancy.finish:
+        occupancy.add(position, lane)
+
+def resolve_movement(game: CompactGame, rng=random):
+    finished, played, values = game.finished, game.played, game.card_values
+    riders = [r for r in range(game.rider_count) if not finished[r]]
+    riders.sort(key=lambda r: (values[played[r]] if played[r] != NO_CARD else 0, rng.random()),
+                reverse=True)
+    occupancy = _occupancy(game, riders)
+    finish = game.length - 1
+    movement = game.tables.movement_row(game.weather)
+    stride = MAX_CARD_VALUE + 1
+
+    for r in riders:
+        if played[r] == NO_CARD:
+            continue
+        name = game.rider_names[r]
+        current = game.position[r]
+        target = min(current + movement[current * stride + values[played[r]]], finish)
+        blocked = occupancy.first_blocked(current, target)
+        if blocked is not None:
+            target = blocked - 1
+            add_log(game, f"{name} blocked at position {blocked}")
+
+        available_lanes = occupancy.free_lanes(target)
+        if available_lanes:
+            _move(game, occupancy, r, target, rng.choice(available_lanes))
+            add_log(game, f"{name} moves to position {target}, lane {game.lane[r]}")
+        else:
+            add_log(game, f"{name} cannot move, no available lanes")
+
+        if game.position[r] >= finish:
+            finished[r] = True
+            game.rider_changes.add((r, "finished"))
+            add_log(game, f"{name} finished the race!")
+
+    game.current_phase = GamePhase.SLIPSTREAM
+
+def resolve_slipstream(game: CompactGame, rng=random):
+    riders = [r for r in range(game.rider_count) if not game.finished[r]]
+    occupancy = _occupancy(game, riders)
+
+    for r in riders:
+        position = game.position[r]
+        if occupancy.rider_ahead(position) and occupancy.is_free(position + 1):
+            available_lanes = occupancy.free_lanes(position + 1)
+            if available_lanes:
+                _move(game, occupancy, r, position + 1, rng.choice(available_lanes))
+                add_log(game, f"{game.rider_names[r]} slipstreams forward")
+
+    game.current_phase = GamePhase.FATIGUE
+
+def resolve_fatigue(game: CompactGame, rng=random):
+    finished = game.finished
+    riders = [r for r in range(game.rider_count) if not finished[r]]
+    occupancy = _occupancy(game, riders)
+
+    for r in riders:
+        team = game.rider_team[r]
+        fatigue_deck = game.piles[team][FATIGUE_DECK]
+        if not occupancy.rider_ahead(game.position[r]) and fatigue_deck:
+            # The fatigue card joins the hand that draw_cards is about to replace
+            game.hands[r].append(fatigue_deck.pop())
+            game.fatigue_count[r] += 1
+            game.pile_changes.add((team, FATIGUE_DECK))
+            game.rider_changes.add((r, "fatigue_count"))
+            add_log(game, f"{game.rider_names[r]} receives fatigue card")
+        game.played[r] = NO_CARD
+        game.rider_changes.add((r, "played_card"))
+        draw_cards(game, r, rng)
+
+    finishers = [r for r in range(game.rider_count) if finished[r]]
+    if finishers:
+        game.current_phase = GamePhase.GAME_OVER
+        for i, r in enumerate(finishers):
+            if not game.finish_position[r]:
+                game.finish_position[r] = i + 1
+                game.rider_changes.add((r, "finish_position"))
+                game.finished_riders.append(game.rider_ids[r])
+    else:
+        game.current_phase = GamePhase.CARD_SELECTION
+        game.current_turn += 1
+
+def process_turn(game: CompactGame, rng=None, bot=None):
+    """Let the AI pick its cards, then run movement, slipstream and fatigue
+
+    Draws from the game's own generator unless given ``rng``.
+
+    Without a ``bot`` the AI is the engine's heuristic, and the turn is the
+    one ``FlammeRougeEngine.process_turn`` plays.
+    """
+    if rng is None:
+        rng = game.rng
+    select_ai_cards(game, bot)
+
+    if game.current_phase == GamePhase.CARD_SELECTION and all_cards_selected(game):
+        game.current_phase = GamePhase.MOVEMENT
+
+    if game.current_phase == GamePhase.MOVEMENT:
+        with MOVEMENT_TIME.time():
+            resolve_movement(game, rng)
+
+    if game.current_phase == GamePhase.SLIPSTREAM:
+        with SLIPSTREAM_TIME.time():
+            resolve_slipstream(game, rng)
+
+    if game.current_phase == GamePhase.FATIGUE:
+        with FATIGUE_TIME.time():
+            resolve_fatigue(game, rng)
+
+# Actions: what the API does to a game, replayed on a fresh copy of it when
+# another writer got there first
+class ActionRejected(Exception):
+    """An action that does not apply to the game as it is"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def select_card(game: CompactGame, rider_id: str, card_id: str):
+    """A rider plays a card from its hand"""
+    if game.current_phase != GamePhase.CARD_SELECTION:
+        raise ActionRejected(400, "Not in card selection phase")
+
+    rider = find_rider(game, rider_id)
+    if rider is None:
+        raise ActionRejected(404, "Rider not found")
+    if game.played[rider] != NO_CARD:
+        raise ActionRejected(409, "Card already selected")
+
+    card = find_card(game, rider, card_id)
+    if card is None:
+        raise ActionRejected(404, "Card not found in hand")
+
+    play_card(game, rider, card)
+    add_log(game, f"{game.rider_names[rider]} played {card_label(game, card)}")
+
+    # Check if all riders have selected cards
+    if all_cards_selected(game):
+        game.current_phase = GamePhase.MOVEMENT
+
+def select_card_action(rider_id: str, card_id: str) -> tuple:
+    return ("select_card", rider_id, card_id)
+
+def select_cards(game: CompactGame, turn: int, selections: Sequence[Sequence[str]]):
+    """Several riders play a card each, all of them or none"""
+    if game.current_phase != GamePhase.CARD_SELECTION:
+        raise ActionRejected(400, "Not in card selection phase")
+    if game.current_turn != turn:
+        raise ActionRejected(409, "Turn already processed")
+    plays = []
+    for rider_id, card_id in selections:
+        rider = find_rider(game, rider_id)
+        if rider is None:
+            raise ActionRejected(404, "Rider not found")
+        if game.played[rider] != NO_CARD or any(r == rider for r, _ in plays):
+            raise ActionRejected(409, "Card already selected")
+        card = find_card(game, rider, card_id)
+        if card is None:
+            raise ActionRejected(404, "Card not found in hand")
+        plays.append((rider, card))
+    for rider, card in plays:
+        play_card(game, rider, card)
+        add_log(game, f"{game.rider_names[rider]} played {card_label(game, card)}")
+
+    if all_cards_selected(game):
+        game.current_phase = GamePhase.MOVEMENT
+
+def select_cards_action(game: CompactGame, selections: Sequence[Sequence[str]]) -> tuple:
+    """Selections for this turn only, unlike ``select_card_action`` which any turn takes"""
+    return ("select_cards", game.current_turn, tuple((rider_id, card_id) for rider_id, card_id in selections))
+
+def ai_cards_action(game: CompactGame, bot=None) -> Optional[tuple]:
+    """The AI's cards for this turn, None if no AI rider has to play
+
+    Chosen when the action is built, so that replaying it needs no search
+    and plays the same cards.
+    """
+    if game.current_phase != GamePhase.CARD_SELECTION:
+        return None
+    picks = tuple((game.rider_ids[r], game.card_ids[card]) for r, card in ai_choices(game, bot))
+    return ("ai_cards", game.current_turn, picks) if picks else None
+
+def play_ai_cards(game: CompactGame, turn: int, picks: Sequence[Sequence[str]]):
+    """Play the cards of an ``ai_cards`` action, all of them or none"""
+    if game.current_phase != GamePhase.CARD_SELECTION or game.current_turn != turn:
+        raise ActionRejected(409, "Turn already processed")
+    plays = []
+    for rider_id, card_id in picks:
+        rider = find_rider(game, rider_id)
+        if rider is None:
+            raise ActionRejected(404, "Rider not found")
+        if game.played[rider] != NO_CARD:
+            raise ActionRejected(409, "Card already selected")
+        card = find_card(game, rider, card_id)
+        if card is None:
+            raise ActionRejected(404, "Card not found in hand")
+        plays.append((rider, card))
+    for rider, card in plays:
+        play_ai_card(game, rider, card)
+
+def process_turn_action(game: CompactGame) -> tuple:
+    """Processing the current turn, which only applies once per turn"""
+    return ("process_turn", game.current_turn, game.current_phase == GamePhase.GAME_OVER)
+
+def apply_action(game: CompactGame, action: tuple, bot=None) -> List[dict]:
+    """Apply an action built by ``*_action``, raise ActionRejected if it does not apply
+
+    Selections by different riders commute; a second selection for the same
+    rider or a second processing of the same turn is rejected, so replaying
+    an action that already landed is harmless.
+
+    Returns what the action changed as JSON Patch operations on
+    ``to_document`` (the generator state left out), for ``view_patch``.
+    """
+    # Record this action's changes apart, then merge them into the pending ones
+    rider_changes, game.rider_changes = game.rider_changes, set()
+    pile_changes, game.pile_changes = game.pile_changes, set()
+    before = (game.current_turn, game.current_phase, game.active_team_index, game.weather,
+              len(game.finished_riders), len(game.game_log))
+    try:
+        kind = action[0]
+        if kind == "select_card":
+            select_card(game, action[1], action[2])
+        elif kind == "select_cards":
+            select_cards(game, action[1], action[2])
+        elif kind == "ai_cards":
+            play_ai_cards(game, action[1], action[2])
+        elif kind == "process_turn":
+            if game.current_turn != action[1] or (game.current_phase == GamePhase.GAME_OVER) != action[2]:
+                raise ActionRejected(409, "Turn already processed")
+            process_turn(game, game.rng, bot)
+        else:
+            raise ValueError(f"Unknown action {kind!r}")
+        game.revision += 1
+    finally:
+        changed_riders, changed_piles = game.rider_changes, game.pile_changes
+        game.rider_changes = rider_changes | changed_riders
+        game.pile_changes = pile_changes | changed_piles
+    return _patch(game, before, changed_riders, changed_piles)
+
+def _patch(game: CompactGame, before: tuple, rider_changes: Set[Tuple[int, str]],
+           pile_changes: Set[Tuple[int, int]]) -> List[dict]:
+    """JSON Patch operations from the state ``before`` an action to now
+
+    Log lines are appended to ``game_log``: a client following the patches
+    keeps the whole log unless it trims it itself.
+    """
+    turn, phase, active_team, weather, finishers, log = before
+    ops = []
+    for r, field in sorted(rider_changes):
+        t = game.rider_team[r]
+        ops.append({"op": "replace", "path": f"/teams/{t}/riders/{r - game.team_riders[t].start}/{field}",
+                    "value": _rider_field(game, r, field)})
+    for t, pile in sorted(pile_changes):
+        ops.append({"op": "replace", "path": f"/teams/{t}/{PILES[pile]}",
+                    "value": [_card_document(game, c) for c in game.piles[t][pile]]})
+    if game.current_turn != turn:
+        ops.append({"op": "replace", "path": "/current_turn", "value": game.current_turn})
+    if game.current_phase != phase:
+        ops.append({"op": "replace", "path": "/current_phase", "value": game.current_phase.value})
+    if game.active_team_index != active_team:
+        ops.append({"op": "replace", "path": "/active_team_index", "value": game.active_team_index})
+    if game.weather != weather:
+        ops.append({"op": "replace", "path": "/weather", "value": game.weather.value})
+    ops.append({"op": "replace", "path": "/revision", "value": game.revision})
+    for rider_id in game.finished_riders[finishers:]:
+        ops.append({"op": "add", "path": "/finished_riders/-", "value": rider_id})
+    if len(game.game_log) > log:
+        for line in game.game_log[log:]:
+            ops.append({"op": "add", "path": "/game_log/-", "value": line})
+        ops.append({"op": "replace", "path": "/log_count", "value": game.log_base + len(game.game_log)})
+    return ops
@@ -0,0 +1,746 @@
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Dict, Optional, Sequence, Tuple
+import hashlib
+import json
+import secrets
+import uuid
+import random
+from enum import Enum
+
+from rng import GameRandom
+
+# Game Models
+class CardType(str, Enum):
+    SPRINTEUR = "sprinteur"
+    ROULEUR = "rouleur"
+    FATIGUE = "fatigue"
+
+class TerrainType(str, Enum):
+    NORMAL = "normal"
+    COBBLESTONE = "cobblestone"
+    MOUNTAIN = "mountain"
+    DOWNHILL = "downhill"
+    FINISH = "finish"
+    START = "start"
+
+class WeatherType(str, Enum):
+    NONE = "none"
+    HEADWIND = "headwind"
+    TAILWIND = "tailwind"
+    CROSSWIND = "crosswind"
+
+class RiderType(str, Enum):
+    HUMAN = "human"
+    AI_BOT = "ai_bot"
+
+class GamePhase(str, Enum):
+    CARD_SELECTION = "card_selection"
+    MOVEMENT = "movement"
+    SLIPSTREAM = "slipstream"
+    FATIGUE = "fatigue"
+    GAME_OVER = "game_over"
+
+class Card(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    type: CardType
+    value: int
+    description: Optional[str] = None
+
+class TrackTile(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    position: int  # Track position (0-based)
+    terrain: TerrainType = TerrainType.NORMAL
+    lanes: int = 2  # Usually 2, can be 1 for narrow sections
+    weather: WeatherType = WeatherType.NONE
+
+class Position(BaseModel):
+    track_position: int
+    lane: int  # 0 or 1 for left/right lane
+
+class Rider(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    color: str
+    team_id: str
+    rider_type: RiderType
+    position: Position
+    hand: List[Card] = []
+    played_card: Optional[Card] = None
+    fatigue_count: int = 0
+    finished: bool = False
+    finish_position: Optional[int] = None
+
+class Team(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    # Secret of the team's players, the viewer the API shows its hands to; never in a view
+    token: Optional[str] = Field(default_factory=lambda: secrets.token_urlsafe(16))
+    riders: List[Rider] = []
+    sprinteur_deck: List[Card] = []
+    rouleur_deck: List[Card] = []
+    fatigue_deck: List[Card] = []
+    sprinteur_discard: List[Card] = []
+    rouleur_discard: List[Card] = []
+
+class Track(BaseModel):
+    """A track, stored and served as a reference to its ``TrackLayout``
+
+    ``id`` is the layout's content hash.  Tiles are left out of dumps and
+    filled back in from the layout when a reference is parsed; a track given
+    with tiles and some other id is registered and takes its layout's id.
+    """
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    tiles: List[TrackTile] = Field(default=[], exclude=True)
+    length: int
+
+    @model_validator(mode="after")
+    def _resolve_layout(self):
+        if not self.tiles:
+            layout = get_layout(self.id)
+            if layout is None:
+                raise ValueError(f"Unknown track {self.id}")
+            self.tiles = list(layout.tiles)
+        elif self.id not in _layouts:
+            self.id = layout_of(self.name, self.tiles).id
+        return self
+
+class GameState(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    teams: List[Team] = []
+    track: Track
+    current_turn: int = 1
+    current_phase: GamePhase = GamePhase.CARD_SELECTION
+    active_team_index: int = 0
+    weather: WeatherType = WeatherType.NONE
+    finished_riders: List[str] = []  # Rider IDs in order of finish
+    game_log: List[str] = []  # Latest lines, the full log is stored apart
+    log_count: int = 0  # Lines logged since the start, including older ones
+    version: int = 0  # Bumped by every write, for optimistic concurrency
+    revision: int = 0  # Bumped by every action, for ETags
+    rng_state: Optional[str] = None  # The game's own GameRandom, see game_rng
+
+# Deck compositions shared by the API engine and the headless simulator
+SPRINTEUR_VALUES = [2,2,2,3,3,3,4,4,5,9]
+ROULEUR_VALUES = [3,3,3,4,4,4,5,5,6,7]
+FATIGUE_VALUE = 2
+FATIGUE_DECK_SIZE = 20
+
+def movement_for(value: int, terrain: TerrainType, weather: WeatherType) -> int:
+    """Movement rule on plain values, shared by calculate_movement and the simulator"""
+    base_movement = value
+
+    # Terrain effects
+    if terrain == TerrainType.MOUNTAIN:
+        # Mountains: reduce movement for high values
+        if base_movement >= 5:
+            base_movement = max(base_movement - 2, 1)
+    elif terrain == TerrainType.DOWNHILL:
+        # Downhills: bonus movement
+        base_movement += 1
+    elif terrain == TerrainType.COBBLESTONE:
+        # Cobblestones: slightly reduce movement
+        base_movement = max(base_movement - 1, 1)
+
+    # Weather effects
+    if weather == WeatherType.HEADWIND:
+        base_movement = max(base_movement - 1, 1)
+    elif weather == WeatherType.TAILWIND:
+        base_movement += 1
+    elif weather == WeatherType.CROSSWIND:
+        # Crosswind: randomize lanes more
+        pass
+
+    return base_movement
+
+def tile_weather(tile: WeatherType, weather: WeatherType) -> WeatherType:
+    """The weather on a tile: its own, the race's where the track sets none"""
+    return weather if tile == WeatherType.NONE else tile
+
+TERRAINS = tuple(TerrainType)
+WEATHERS = tuple(WeatherType)
+# Card values the movement tables cover
+MAX_CARD_VALUE = 15
+
+class TrackTables:
+    """Static lookups for one track layout, shared by every game raced on it
+
+    ``movement`` holds the movement of a card of every value from every
+    position under every weather of the race, flat by ``movement_row(weather)``
+    then ``position * (MAX_CARD_VALUE + 1) + value``, so a turn never branches
+    on terrain or weather.  A tile with weather of its own moves riders by it
+    whatever the race's (``tile_weather``).  ``lanes``, ``terrain`` and
+    ``weather`` (codes into ``TERRAINS`` and ``WEATHERS``) have one entry per
+    position and a sentinel past the finish: no lanes, normal terrain, no
+    weather.  ``id`` hashes the content, the same in every process, which is
+    also where a pickled copy comes back from (``track_tables``).
+    """
+    __slots__ = ("id", "length", "finish", "lanes", "terrain", "weather", "max_lanes", "movement", "_rows", "_key")
+
+    def __init__(self, lanes: bytes, terrain: bytes, weather: bytes, length: int):
+        self._key = (bytes(lanes), bytes(terrain), bytes(weather), length)
+        # One byte per position each, the concatenation is unambiguous
+        self.id = f"tables-{hashlib.sha256(b''.join(self._key[:3])).hexdigest()[:16]}"
+        self.length = length
+        self.finish = length - 1
+        self.lanes = bytes(lanes) + b"\0"
+        self.terrain = bytes(terrain) + bytes([TERRAINS.index(TerrainType.NORMAL)])
+        self.weather = bytes(weather) + bytes([WEATHERS.index(WeatherType.NONE)])
+        self.max_lanes = max(lanes)
+        stride = (len(self.lanes)) * (MAX_CARD_VALUE + 1)
+        self.movement = bytes(
+            movement_for(value, TERRAINS[code], tile_weather(WEATHERS[tile], weather))
+            for weather in WEATHERS for code, tile in zip(self.terrain, self.weather)
+            for value in range(MAX_CARD_VALUE + 1)
+        )
+        self._rows = {weather: self.movement[i * stride:(i + 1) * stride] for i, weather in enumerate(WEATHERS)}
+
+    def movement_row(self, weather: WeatherType) -> bytes:
+        """Movement table of one race weather, by ``position * (MAX_CARD_VALUE + 1) + value``"""
+        return self._rows[weather]
+
+    def move(self, position: int, value: int, weather: WeatherType) -> int:
+        return self._rows[weather][position * (MAX_CARD_VALUE + 1) + value]
+
+    def __reduce__(self):
+        return track_tables, self._key
+
+_track_tables: Dict[tuple, TrackTables] = {}
+
+def track_tables(lanes: bytes, terrain: bytes, weather: bytes, length: int) -> TrackTables:
+    """The tables of a layout, built on first use
+
+    Cached by layout rather than track id: every new game copies the track
+    under a new id, and all of them share one set of tables.
+    """
+    key = (bytes(lanes), bytes(terrain), bytes(weather), length)
+    tables = _track_tables.get(key)
+    if tables is None:
+        tables = _track_tables[key] = TrackTables(*key)
+    return tables
+
+def tables_for(track: Track) -> TrackTables:
+    """``track_tables`` of a Track model"""
+    layout = _layouts.get(track.id)
+    if layout is not None:
+        return layout.tables
+    return track_tables(bytes(tile.lanes for tile in track.tiles),
+                        bytes(TERRAINS.index(tile.terrain) for tile in track.tiles),
+                        bytes(WEATHERS.index(tile.weather) for tile in track.tiles), track.length)
+
+class TrackLayout:
+    """A compiled track, immutable and addressed by a hash of its content
+
+    Games refer to a layout by ``id`` instead of embedding its tiles, and all
+    of them share its tiles and ``TrackTables``.  ``lanes``, ``terrain`` and
+    ``weather`` hold one byte per position, codes into ``TERRAINS`` and
+    ``WEATHERS`` for the last two.
+    """
+    __slots__ = ("id", "name", "length", "lanes", "terrain", "weather", "tiles", "tables")
+
+    def __init__(self, name: str, lanes: bytes, terrain: bytes, weather: bytes):
+        self.name = name
+        self.length = len(lanes)
+        self.lanes = bytes(lanes)
+        self.terrain = bytes(terrain)
+        self.weather = bytes(weather)
+        content = [name, [[TERRAINS[t].value, l, WEATHERS[w].value]
+                          for l, t, w in zip(self.lanes, self.terrain, self.weather)]]
+        digest = hashlib.sha256(json.dumps(content, separators=(",", ":")).encode()).hexdigest()
+        self.id = f"track-{digest[:16]}"
+        self.tiles: Tuple[TrackTile, ...] = tuple(
+            TrackTile(id=f"{self.id}-{position}", position=position, terrain=TERRAINS[t], lanes=l,
+                      weather=WEATHERS[w])
+            for position, (l, t, w) in enumerate(zip(self.lanes, self.terrain, self.weather))
+        )
+        self.tables = track_tables(self.lanes, self.terrain, self.weather, self.length)
+
+    def reference(self) -> dict:
+        """What a game document stores of its track"""
+        return {"id": self.id, "name": self.name, "length": self.length}
+
+    def track(self) -> Track:
+        return Track(id=self.id, name=self.name, tiles=list(self.tiles), length=self.length)
+
+# Every layout seen by this process, by id
+_layouts: Dict[str, TrackLayout] = {}
+
+def register_layout(layout: TrackLayout) -> TrackLayout:
+    """Add a layout to the registry, or return the one already there with its content"""
+    return _layouts.setdefault(layout.id, layout)
+
+def get_layout(track_id: str) -> Optional[TrackLayout]:
+    return _layouts.get(track_id)
+
+def layout_of(name: str, tiles: Sequence[TrackTile]) -> TrackLayout:
+    """The registered layout of a list of tiles, ordered by position"""
+    tiles = sorted(tiles, key=lambda tile: tile.position)
+    return register_layout(TrackLayout(
+        name,
+        bytes(tile.lanes for tile in tiles),
+        bytes(TERRAINS.index(tile.terrain) for tile in tiles),
+        bytes(WEATHERS.index(tile.weather) for tile in tiles),
+    ))
+
+class TrackOccupancy:
+    """Riders still racing per track position, kept up to date as they move.
+
+    ``masks[pos]`` is a bitmap of the occupied lanes and ``counts[pos]`` the
+    number of riders at ``pos`` (several riders can share a lane on the start
+    tiles, so lanes are counted too).  Only occupied positions are stored,
+    so building one is O(riders) whatever the track length.  It only needs
+    the lane count of each tile, so the compact game state shares it.
+    """
+
+    def __init__(self, lanes: Sequence[int], length: int):
+        self.lanes = lanes
+        self.finish = length - 1
+        self.counts: Dict[int, int] = {}
+        self.masks: Dict[int, int] = {}
+        self.lane_counts: Dict[Tuple[int, int], int] = {}
+
+    @classmethod
+    def from_riders(cls, track: Track, riders: List[Rider]) -> "TrackOccupancy":
+        occupancy = cls(tables_for(track).lanes, track.length)
+        for rider in riders:
+            if not rider.finished:
+                occupancy.add(rider.position.track_position, rider.position.lane)
+        return occupancy
+
+    def add(self, position: int, lane: int):
+        self.counts[position] = self.counts.get(position, 0) + 1
+        key = (position, lane)
+        self.lane_counts[key] = self.lane_counts.get(key, 0) + 1
+        self.masks[position] = self.masks.get(position, 0) | (1 << lane)
+
+    def remove(self, position: int, lane: int):
+        self.counts[position] -= 1
+        key = (position, lane)
+        self.lane_counts[key] -= 1
+        if not self.lane_counts[key]:
+            self.masks[position] &= ~(1 << lane)
+
+    def move(self, rider: Rider, position: int, lane: int):
+        """Move a rider, riders on the finish line leave the track"""
+        self.remove(rider.position.track_position, rider.position.lane)
+        rider.position.track_position = position
+        rider.position.lane = lane
+        if position < self.finish:
+            self.add(position, lane)
+
+    def riders_at(self, position: int) -> int:
+        return self.counts.get(position, 0)
+
+    def is_free(self, position: int) -> bool:
+        """Check if a tile still has room (fewer riders than lanes)"""
+        return self.counts.get(position, 0) < self.lanes[position]
+
+    def first_blocked(self, start: int, target: int) -> Optional[int]:
+        """First position in ``(start, target]`` with no room left, None if the way is clear
+
+        Only looks at the occupied positions, not at every tile on the way.
+        """
+        lanes = self.lanes
+        blocked = None
+        for position, count in self.counts.items():
+            if start < position <= target and count >= lanes[position] and (blocked is None or position < blocked):
+                blocked = position
+        return blocked
+
+    def free_lanes(self, position: int) -> List[int]:
+        mask = self.masks.get(position, 0)
+        return [lane for lane in range(self.lanes[position]) if not mask >> lane & 1]
+
+    def rider_ahead(self, position: int) -> bool:
+        """Check if someone is directly in front of ``position``"""
+        return self.counts.get(position + 1, 0) > 0
+
+# Game Logic Class
+class FlammeRougeEngine:
+    """Rules of the race.
+
+    Every method that needs randomness takes an ``rng`` argument.
+    ``process_turn`` draws from the game's own generator (``game_rng``) unless
+    given one; the helpers below it default to the global ``random`` module.
+    """
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def create_default_sprinteur_deck() -> List[Card]:
+        """Create standard Sprinteur deck: 2,2,2,3,3,3,4,4,5,9"""
+        deck = []
+        for value in SPRINTEUR_VALUES:
+            deck.append(Card(type=CardType.SPRINTEUR, value=value, description=f"Sprinteur {value}"))
+        return deck
+
+    @staticmethod
+    def create_default_rouleur_deck() -> List[Card]:
+        """Create standard Rouleur deck: 3,3,3,4,4,4,5,5,6,7"""
+        deck = []
+        for value in ROULEUR_VALUES:
+            deck.append(Card(type=CardType.ROULEUR, value=value, description=f"Rouleur {value}"))
+        return deck
+
+    @staticmethod
+    def create_fatigue_deck() -> List[Card]:
+        """Create fatigue deck: multiple 2-value fatigue cards"""
+        deck = []
+        for i in range(FATIGUE_DECK_SIZE):  # Plenty of fatigue cards
+            deck.append(Card(type=CardType.FATIGUE, value=FATIGUE_VALUE, description="Fatigue"))
+        return deck
+
+    @staticmethod
+    def create_sample_track() -> Track:
+        """Create 'The Peaks' inspired track"""
+        tiles = []
+        # Start area (positions 0-2)
+        for i in range(3):
+            tiles.append(TrackTile(position=i, terrain=TerrainType.START, lanes=2))
+
+        # Flat section (positions 3-8)
+        for i in range(3, 9):
+            tiles.append(TrackTile(position=i, terrain=TerrainType.NORMAL, lanes=2))
+
+        # Mountain climb (positions 9-15)
+        for i in range(9, 16):
+            tiles.append(TrackTile(position=i, terrain=TerrainType.MOUNTAIN, lanes=2))
+
+        # Downhill (positions 16-20)
+        for i in range(16, 21):
+            tiles.append(TrackTile(position=i, terrain=TerrainType.DOWNHILL, lanes=2))
+
+        # Final sprint with cobblestones (positions 21-25)
+        for i in range(21, 26):
+            terrain = TerrainType.COBBLESTONE if i in [23, 24] else TerrainType.NORMAL
+            tiles.append(TrackTile(position=i, terrain=terrain, lanes=2))
+
+        # Finish line (position 26)
+        tiles.append(TrackTile(position=26, terrain=TerrainType.FINISH, lanes=2))
+
+        return Track(name="The Peaks", tiles=tiles, length=27)
+
+    @staticmethod
+    def shuffle_deck(deck: List[Card], rng=random) -> List[Card]:
+        """Shuffle a deck of cards"""
+        shuffled = deck.copy()
+        rng.shuffle(shuffled)
+        return shuffled
+
+    @staticmethod
+    def draw_cards(team: Team, rider: Rider, count: int = 4, rng=random):
+        """Draw cards for a rider (2 sprinteur + 2 rouleur by default)"""
+        rider.hand = []
+
+        # Draw 2 sprinteur cards
+        for _ in range(2):
+            if team.sprinteur_deck:
+                card = team.sprinteur_deck.pop()
+                rider.hand.append(card)
+            elif team.sprinteur_discard:
+                # Reshuffle discard if deck empty
+                team.sprinteur_deck = FlammeRougeEngine.shuffle_deck(team.sprinteur_discard, rng)
+                team.sprinteur_discard = []
+                if team.sprinteur_deck:
+                    card = team.sprinteur_deck.pop()
+                    rider.hand.append(card)
+
+        # Draw 2 rouleur cards
+        for _ in range(2):
+            if team.rouleur_deck:
+                card = team.rouleur_deck.pop()
+                rider.hand.append(card)
+            elif team.rouleur_discard:
+                # Reshuffle discard if deck empty
+                team.rouleur_deck = FlammeRougeEngine.shuffle_deck(team.rouleur_discard, rng)
+                team.rouleur_discard = []
+                if team.rouleur_deck:
+                    card = team.rouleur_deck.pop()
+                    rider.hand.append(card)
+
+    @staticmethod
+    def calculate_movement(card: Card, track_tile: TrackTile, weather: WeatherType) -> int:
+        """Calculate actual movement considering terrain and weather, the tile's first"""
+        return movement_for(card.value, track_tile.terrain, tile_weather(track_tile.weather, weather))
+
+    @staticmethod
+    def get_riders_at_position(track_position: int, all_riders: List[Rider]) -> List[Rider]:
+        """Get all riders at a specific track position"""
+        return [r for r in all_riders if r.position.track_position == track_position and not r.finished]
+
+    @staticmethod
+    def check_slipstream(rider: Rider, all_riders: List[Rider],
+                         occupancy: Optional[TrackOccupancy] = None) -> bool:
+        """Check if rider is in slipstream (directly behind another rider)"""
+        if occupancy is not None:
+            return occupancy.rider_ahead(rider.position.track_position)
+        # Check if there's a rider directly in front
+        riders_in_front = [r for r in all_riders
+                          if r.position.track_position == rider.position.track_position + 1
+                          and not r.finished]
+        return len(riders_in_front) > 0
+
+    @staticmethod
+    def move_rider(rider: Rider, movement: int, track: Track, all_riders: List[Rider], rng=random,
+                   occupancy: Optional[TrackOccupancy] = None) -> List[str]:
+        """Move a rider and handle collisions/blocking
+
+        Pass the turn's ``occupancy`` to avoid rebuilding it from ``all_riders``
+        for every rider; it is updated in place.
+        """
+        if occupancy is None:
+            occupancy = TrackOccupancy.from_riders(track, all_riders)
+        log = []
+        current_pos = rider.position.track_position
+        target_pos = min(current_pos + movement, track.length - 1)
+
+        # Stop in front of the first position that is full
+        blocked = occupancy.first_blocked(current_pos, target_pos)
+        if blocked is not None:
+            target_pos = blocked - 1
+            log.append(f"{rider.name} blocked at position {blocked}")
+
+        # Find available lane at target position
+        available_lanes = occupancy.free_lanes(target_pos)
+
+        if available_lanes:
+            occupancy.move(rider, target_pos, rng.choice(available_lanes))
+            log.append(f"{rider.name} moves to position {target_pos}, lane {rider.position.lane}")
+        else:
+            log.append(f"{rider.name} cannot move, no available lanes")
+
+        # Check if finished
+        if rider.position.track_position >= track.length - 1:
+            rider.finished = True
+            log.append(f"{rider.name} finished the race!")
+
+        return log
+
+    @staticmethod
+    def ai_select_card(rider: Rider, track: Track, all_riders: List[Rider]) -> Card:
+        """Simple AI card selection logic"""
+        if not rider.hand:
+            return None
+
+        current_pos = rider.position.track_position
+        distance_to_finish = track.length - current_pos
+
+        # Simple strategy:
+        # - Use high cards when far from finish
+        # - Use medium cards in mountains
+        # - Use low cards when close to finish
+
+        if distance_to_finish > 15:
+            # Far from finish: prefer higher cards
+            best_card = max(rider.hand, key=lambda c: c.value)
+        elif current_pos < track.length and track.tiles[current_pos].terrain == TerrainType.MOUNTAIN:
+            # In mountains: prefer medium cards
+            medium_cards = [c for c in rider.hand if 3 <= c.value <= 5]
+            best_card = medium_cards[0] if medium_cards else min(rider.hand, key=lambda c: c.value)
+        else:
+            # Default: pick middle value card
+            sorted_hand = sorted(rider.hand, key=lambda c: c.value)
+            best_card = sorted_hand[len(sorted_hand) // 2]
+
+        return best_card
+
+    @staticmethod
+    def play_card(team: Team, rider: Rider, card: Card):
+        """Move a card from the rider's hand to played and onto the team discard"""
+        rider.hand.remove(card)
+        rider.played_card = card
+
+        # Add to appropriate discard pile
+        if card.type == CardType.SPRINTEUR:
+            team.sprinteur_discard.append(card)
+        elif card.type == CardType.ROULEUR:
+            team.rouleur_discard.append(card)
+
+    @staticmethod
+    def all_cards_selected(game_state: GameState) -> bool:
+        """Check if every rider still racing has played a card (or has none left to play)"""
+        return all(r.played_card is not None or not r.hand
+                   for team in game_state.teams for r in team.riders if not r.finished)
+
+    @staticmethod
+    def select_ai_cards(game_state: GameState):
+        """Auto-select cards for AI riders"""
+        engine = FlammeRougeEngine
+        for team in game_state.teams:
+            for rider in team.riders:
+                if rider.rider_type == RiderType.AI_BOT and not rider.played_card and not rider.finished:
+                    card = engine.ai_select_card(rider, game_state.track,
+                                               [r for t in game_state.teams for r in t.riders])
+                    if card:
+                        engine.play_card(team, rider, card)
+                        game_state.game_log.append(f"{rider.name} (AI) played {card.type} {card.value}")
+
+    @staticmethod
+    def resolve_movement(game_state: GameState, rng=random):
+        """Movement phase: riders move in initiative order"""
+        engine = FlammeRougeEngine
+        all_riders = [r for team in game_state.teams for r in team.riders if not r.finished]
+
+        # Sort by initiative (card value descending, then random)
+        def get_initiative(rider):
+            return (rider.played_card.value if rider.played_card else 0, rng.random())
+
+        all_riders.sort(key=get_initiative, reverse=True)
+        occupancy = TrackOccupancy.from_riders(game_state.track, all_riders)
+        tables = tables_for(game_state.track)
+
+        for rider in all_riders:
+            if rider.played_card:
+                movement = tables.move(rider.position.track_position, rider.played_card.value, game_state.weather)
+                log = engine.move_rider(rider, movement, game_state.track, all_riders, rng, occupancy)
+                game_state.game_log.extend(log)
+
+        game_state.current_phase = GamePhase.SLIPSTREAM
+
+    @staticmethod
+    def resolve_slipstream(game_state: GameState, rng=random):
+        """Slipstream phase: riders directly behind another rider close the gap"""
+        all_riders = [r for team in game_state.teams for r in team.riders if not r.finished]
+        occupancy = TrackOccupancy.from_riders(game_state.track, all_riders)
+
+        for rider in all_riders:
+            # Check slipstream and move forward if applicable
+            if occupancy.rider_ahead(rider.position.track_position):
+                # Move to slipstream position
+                target_pos = rider.position.track_position + 1
+
+                if occupancy.is_free(target_pos):
+                    available_lanes = occupancy.free_lanes(target_pos)
+
+                    if available_lanes:
+                        occupancy.move(rider, target_pos, rng.choice(available_lanes))
+                        game_state.game_log.append(f"{rider.name} slipstreams forward")
+
+        game_state.current_phase = GamePhase.FATIGUE
+
+    @staticmethod
+    def resolve_fatigue(game_state: GameState, rng=random):
+        """Fatigue phase: hand out fatigue, draw new hands and check for a winner"""
+        engine = FlammeRougeEngine
+        all_riders = [r for team in game_state.teams for r in team.riders if not r.finished]
+        occupancy = TrackOccupancy.from_riders(game_state.track, all_riders)
+
+        for team in game_state.teams:
+            for rider in team.riders:
+                if not rider.finished:
+                    # Check if rider gets fatigue (not in slipstream)
+                    in_slipstream = engine.check_slipstream(rider, all_riders, occupancy)
+
+                    if not in_slipstream and team.fatigue_deck:
+                        fatigue_card = team.fatigue_deck.pop()
+                        rider.hand.append(fatigue_card)
+                        rider.fatigue_count += 1
+                        game_state.game_log.append(f"{rider.name} receives fatigue card")
+
+                    # Clear played card
+                    rider.played_card = None
+
+                    # Draw new cards
+                    engine.draw_cards(team, rider, rng=rng)
+
+        # Check win condition
+        finished_riders = [r for team in game_state.teams for r in team.riders if r.finished]
+        if finished_riders:
+            game_state.current_phase = GamePhase.GAME_OVER
+            for i, rider in enumerate(finished_riders):
+                if rider.finish_position is None:
+                    rider.finish_position = i + 1
+                    game_state.finished_riders.append(rider.id)
+        else:
+            game_state.current_phase = GamePhase.CARD_SELECTION
+            game_state.current_turn += 1
+
+    @staticmethod
+    def process_turn(game_state: GameState, rng=None):
+        """Let the AI pick its cards, then run movement, slipstream and fatigue"""
+        engine = FlammeRougeEngine
+        own_rng = rng is None
+        if own_rng:
+            rng = game_rng(game_state)
+        engine.select_ai_cards(game_state)
+
+        # AI picks can complete the selection, start moving straight away
+        if game_state.current_phase == GamePhase.CARD_SELECTION and engine.all_cards_selected(game_state):
+            game_state.current_phase = GamePhase.MOVEMENT
+
+        if game_state.current_phase == GamePhase.MOVEMENT:
+            engine.resolve_movement(game_state, rng)
+
+        if game_state.current_phase == GamePhase.SLIPSTREAM:
+            engine.resolve_slipstream(game_state, rng)
+
+        if game_state.current_phase == GamePhase.FATIGUE:
+            engine.resolve_fatigue(game_state, rng)
+
+        if own_rng:
+            game_state.rng_state = rng.dumps()
+
+def game_rng(game_state: GameState) -> GameRandom:
+    """The game's generator as stored; games from before it get one seeded by their id"""
+    if game_state.rng_state:
+        return GameRandom.loads(game_state.rng_state)
+    return GameRandom(game_state.id)
+
+# Game Management Functions
+def create_new_game(team_names: List[str], track_name: str = "The Peaks", rng=None) -> GameState:
+    """Create a new game with specified teams
+
+    Decks are shuffled with ``rng``, by default a new ``GameRandom`` seeded
+    from the OS, which the game then keeps for its turns.  A game dealt by
+    any other generator gets one seeded by its id (``game_rng``).
+    """
+    if rng is None:
+        rng = GameRandom()
+    # Imported here, the track definitions build on this module
+    from tracks import track_by_name
+
+    engine = FlammeRougeEngine()
+
+    # Tiles are shared with every other game on the track
+    track = track_by_name(track_name).track()
+
+    # Create teams
+    teams = []
+    colors = ["red", "blue", "green", "yellow", "purple", "orange"]
+
+    for i, team_name in enumerate(team_names):
+        team = Team(name=team_name)
+
+        # Create riders for team (2 riders per team)
+        rider_names = [f"{team_name} Sprinteur", f"{team_name} Rouleur"]
+        for j, rider_name in enumerate(rider_names):
+            rider = Rider(
+                name=rider_name,
+                color=colors[i % len(colors)],
+                team_id=team.id,
+                rider_type=RiderType.HUMAN if i == 0 else RiderType.AI_BOT,  # First team human, others AI
+                position=Position(track_position=0, lane=j % 2)  # Start in different lanes
+            )
+            team.riders.append(rider)
+
+        # Create decks
+        team.sprinteur_deck = engine.shuffle_deck(engine.create_default_sprinteur_deck(), rng)
+        team.rouleur_deck = engine.shuffle_deck(engine.create_default_rouleur_deck(), rng)
+        team.fatigue_deck = engine.create_fatigue_deck()
+
+        # Draw initial hands
+        for rider in team.riders:
+            engine.draw_cards(team, rider, rng=rng)
+
+        teams.append(team)
+
+    game_state = GameState(
+        teams=teams,
+        track=track,
+        current_turn=1,
+        current_phase=GamePhase.CARD_SELECTION,
+    )
+    game_state.rng_state = (rng if isinstance(rng, GameRandom) else game_rng(game_state)).dumps()
+
+    return game_state
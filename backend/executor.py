@@ -0,0 +1,108 @@
+"""Run the slow part of game actions off the event loop.
+
+The AI's search (``mcts.MCTSBot``) takes its whole time budget, 30 ms by
+default, and a request that ran it on the event loop would hold up every
+other request of the worker for that long.  ``GameExecutor.run`` hands it
+to a worker thread instead; the loop goes on serving the other games, and
+the thread gives it the interpreter back every ``sys.getswitchinterval()``
+(5 ms) at worst.
+
+Work for one game is serialized: the requests that change a game hold it
+(``GameExecutor.game``) from the moment they read it to the moment they
+apply their action, so the search reads a game that nothing changes under
+it, and the changes themselves are still made on the event loop, where
+readers never see half of one.
+
+The queue is bounded: past ``max_pending`` jobs, or ``max_waiting`` requests
+in line for one game, ``Overloaded`` is raised straight away (a 503 for the
+client) rather than letting requests pile up behind the pool.
+
+A thread still shares the GIL with the loop, so with ``processes`` the
+pool is a process pool instead: the search runs on plain data
+(``mcts.plan_decisions``) in processes with a bot of their own, and only the
+decisions and the cards chosen cross over.  Threads otherwise, one by
+default: the bot's trees and the shared transposition table are not thread
+safe.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+import metrics
+
+
+class Overloaded(Exception):
+    """Too much work queued, try again later"""
+
+
+WORK_TIME = metrics.histogram("flamme_rouge_work_seconds", "Seconds game work took on the pool, queue included")
+
+
+class GameExecutor:
+    """A thread or process pool with per-game serialization and a bounded queue
+
+    With ``processes``, ``initializer(*initargs)`` sets up each process and
+    the work given to ``run`` must pickle.
+    """
+
+    def __init__(self, threads: int = 1, max_pending: int = 64, max_waiting: int = 16,
+                 processes: int = 0, initializer: Optional[Callable] = None, initargs: tuple = ()):
+        self.max_pending = max_pending
+        self.max_waiting = max_waiting
+        self.processes = processes
+        if processes:
+            # Spawned, not forked: the parent has an event loop and client threads
+            self._pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=initializer, initargs=initargs)
+        else:
+            self._pool = ThreadPoolExecutor(threads, thread_name_prefix="game-work")
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Requests holding or waiting for each game
+        self._holders: Dict[str, int] = {}
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def game(self, game_id: str):
+        """Hold a game while reading and changing it, one request at a time"""
+        holders = self._holders.get(game_id, 0)
+        if holders > self.max_waiting:
+            self.rejected += 1
+            raise Overloaded(f"Too many requests for game {game_id}")
+        lock = self._locks.get(game_id)
+        if lock is None:
+            lock = self._locks[game_id] = asyncio.Lock()
+        self._holders[game_id] = holders + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[game_id] -= 1
+            if not self._holders[game_id]:
+                del self._holders[game_id]
+                del self._locks[game_id]
+
+    async def run(self, fn: Callable, *args):
+        """``fn(*args)`` on the pool, raise Overloaded if the queue is full"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded("Work queue full")
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            WORK_TIME.observe(time.perf_counter() - start)
+            self.pending -= 1
+            self.completed += 1
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": self.pending, "completed": self.completed, "rejected": self.rejected,
+                "games": len(self._locks)}
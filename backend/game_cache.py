@@ -0,0 +1,446 @@
+"""Process-local cache of live games with write-behind to Mongo.
+
+Requests read and mutate the cached ``CompactGame`` directly and only mark it
+dirty; a background task writes the dirty games back every
+``flush_interval`` seconds, all at once, so a game that changes several times
+between two flushes is written once, with only the fields that changed
+(``compact.take_update``).  Games leave the cache when it holds more than
+``max_games`` (least recently used first) or when they have not been used
+for ``ttl`` seconds.  A dirty game that is evicted stays reachable
+until its write lands, so a reader never falls back to a stale document.
+
+Writes are conditional on the stored ``version`` the game was read at, so
+several processes can serve the same game without overwriting each other.
+When a write finds a newer version, the actions taken since the last write
+are replayed on the stored game (``compact.apply_action``): selections by
+different riders merge, and an action that no longer applies is dropped.
+
+New log lines go to ``log_collection`` (one document per line, keyed by game
+id and ``seq``) once the game write that carries them has landed, and leave
+memory once they are in it (``compact.trim_log``).
+
+With a ``history`` (``history.GameHistory``), the actions of each write that
+lands are also stored as events, with a snapshot every so many versions.
+
+Every write stamps the document's ``updated_at`` (UTC), the last activity
+that ``archive.GameArchive`` goes by.  Games it moved to the
+``archive_collection`` are still loaded from there when the main
+collection does not have them, and moved back to it on the way, where
+their writes go.
+
+``load_track`` is awaited with the id of an unknown track before a game on
+it is loaded: a custom track another process added.
+
+``on_rebase`` is called with the merged game that replaces a stale copy, for
+whoever holds on to games outside the cache (the WebSocket subscribers).
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Collection, Dict, List, Optional, Set
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import compact
+import metrics
+from compact import CompactGame
+from engine import get_layout
+
+logger = logging.getLogger(__name__)
+
+_DB_HELP = "Seconds spent in MongoDB calls of the game cache"
+DB_READ_TIME = metrics.histogram("flamme_rouge_db_seconds", _DB_HELP, call="read")
+DB_WRITE_TIME = metrics.histogram("flamme_rouge_db_seconds", _DB_HELP, call="write")
+DB_LOG_TIME = metrics.histogram("flamme_rouge_db_seconds", _DB_HELP, call="log")
+DB_HISTORY_TIME = metrics.histogram("flamme_rouge_db_seconds", _DB_HELP, call="history")
+
+class GameCache:
+    """LRU/TTL cache of ``CompactGame`` by id in front of a Motor collection
+
+    ``max_games`` is the memory cap: a four-team game takes about 25 KiB.
+    Without a ``log_collection`` only the tail of each game log is kept.
+    """
+
+    def __init__(self, collection, max_games: int = 10_000, ttl: float = 1800.0,
+                 flush_interval: float = 1.0, clock=time.monotonic, log_collection=None,
+                 on_rebase: Optional[Callable[[CompactGame], None]] = None, bot=None, history=None,
+                 load_track: Optional[Callable[[str], Awaitable[None]]] = None, archive_collection=None):
+        self.collection = collection
+        self.archive_collection = archive_collection
+        self.log_collection = log_collection
+        self.history = history
+        self.max_games = max_games
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.on_rebase = on_rebase
+        self.load_track = load_track
+        # AI used when a processed turn is replayed
+        self.bot = bot
+        self._games: "OrderedDict[str, CompactGame]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._dirty: Dict[str, CompactGame] = {}
+        self._flushing: Dict[str, CompactGame] = {}
+        # Actions applied since the last write, by game id
+        self._actions: Dict[str, List[tuple]] = {}
+        # Log entries of writes that failed, by game id, and of writes that
+        # landed when the log insert failed
+        self._entries: Dict[str, List[dict]] = {}
+        self._log_backlog: List[dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+        self.flushes = 0
+        self.conflicts = 0
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    async def get(self, game_id: str) -> Optional[CompactGame]:
+        """Cached game, loaded from Mongo on a miss; None if there is no such game"""
+        game = self._lookup(game_id)
+        if game is not None:
+            self.hits += 1
+            return game
+
+        self.misses += 1
+        with DB_READ_TIME.time():
+            doc = await self.collection.find_one({"id": game_id})
+            if doc is None and self.archive_collection is not None:
+                doc = await self.archive_collection.find_one({"id": game_id})
+                if doc is not None:
+                    doc = await self._unarchive(doc)
+        # Another request may have loaded the game while we were waiting
+        game = self._lookup(game_id)
+        if game is None:
+            if doc is None:
+                return None
+            track_id = doc["track"].get("id")
+            if self.load_track is not None and not doc["track"].get("tiles") and get_layout(track_id) is None:
+                await self.load_track(track_id)
+            game = self._lookup(game_id) or compact.from_document(doc)
+        self.add(game)
+        return game
+
+    async def exists(self, game_id: str) -> bool:
+        """Whether a game is cached or stored, archived or not, without loading it"""
+        if self._lookup(game_id) is not None:
+            return True
+        with DB_READ_TIME.time():
+            if await self.collection.find_one({"id": game_id}, {"_id": 1}) is not None:
+                return True
+            if self.archive_collection is None:
+                return False
+            return await self.archive_collection.find_one({"id": game_id}, {"_id": 1}) is not None
+
+    async def _unarchive(self, doc: dict) -> dict:
+        """Move an archived game back to the main collection, the one writes are conditional on"""
+        doc = dict(doc, updated_at=utcnow())
+        try:
+            await self.collection.insert_one(doc)
+        except DuplicateKeyError:
+            # Moved back by another process meanwhile, which may have written it since
+            doc = await self.collection.find_one({"id": doc["id"]}) or doc
+        await self.archive_collection.delete_one({"id": doc["id"]})
+        return doc
+
+    def peek(self, game_id: str) -> Optional[CompactGame]:
+        """Cached game without loading it or counting a hit or a miss"""
+        return self._lookup(game_id)
+
+    async def find_fields(self, game_id: str, fields: Collection[str]) -> Optional[dict]:
+        """Stored ``fields`` of a game, its ``version`` and ``revision``, projected by MongoDB
+
+        Only for games that ``peek`` does not find: the document of a cached
+        game may lag behind it.
+        """
+        projection = {"_id": 0, "version": 1, "revision": 1, **{field: 1 for field in fields}}
+        with DB_READ_TIME.time():
+            return await self.collection.find_one({"id": game_id}, projection)
+
+    async def find_view(self, game_id: str, token: Optional[str], fields: Optional[Collection[str]] = None
+                        ) -> Optional[dict]:
+        """``compact.to_view`` of a game built by MongoDB, see ``compact.view_pipeline``
+
+        Only for games that ``peek`` does not find, as ``find_fields``.
+        """
+        with DB_READ_TIME.time():
+            views = await self.collection.aggregate(compact.view_pipeline(game_id, token, fields)).to_list(1)
+        return views[0] if views else None
+
+    def add(self, game: CompactGame):
+        """Cache a game that is already stored (a new game or one just loaded)"""
+        self._games[game.id] = game
+        self._games.move_to_end(game.id)
+        self._last_used[game.id] = self.clock()
+        while len(self._games) > self.max_games:
+            self._evict(next(iter(self._games)))
+
+    def mark_dirty(self, game: CompactGame, action: Optional[tuple] = None):
+        """Schedule a game for the next write-behind batch
+
+        Pass the ``action`` that changed it so it can be replayed if the
+        write conflicts.
+        """
+        self._dirty[game.id] = game
+        if action is not None:
+            self._actions.setdefault(game.id, []).append(action)
+
+    def expire(self):
+        """Evict the games that have not been used for ``ttl`` seconds"""
+        deadline = self.clock() - self.ttl
+        while self._games:
+            game_id = next(iter(self._games))
+            if self._last_used[game_id] > deadline:
+                break
+            self._evict(game_id)
+
+    async def flush(self) -> int:
+        """Write every dirty game, return how many were written"""
+        if not self._dirty:
+            return 0
+        self._flushing, self._dirty = self._dirty, {}
+        batch = []
+        records = {}
+        now = utcnow()
+        for game_id, game in self._flushing.items():
+            query = compact.version_filter(game)
+            update, entries = compact.take_update(game)
+            update["$set"]["updated_at"] = now
+            entries = self._entries.pop(game_id, []) + entries
+            actions = self._actions.pop(game_id, [])
+            if self.history is not None:
+                # Taken now: the game may change again while the write is in flight
+                version = game.version + 1
+                records[game_id] = (self.history.events(game, version, actions),
+                                    self.history.snapshot(game, version))
+            batch.append((game, query, update, actions, entries))
+        try:
+            # One observation per batch: its writes run concurrently
+            with DB_WRITE_TIME.time():
+                results = await asyncio.gather(
+                    *(self.collection.update_one(query, update) for _, query, update, _, _ in batch),
+                    return_exceptions=True)
+        except BaseException:
+            # Cancelled mid-write
+            for game, _, _, actions, entries in batch:
+                self._retry(game, actions, entries)
+            raise
+        finally:
+            self._flushing = {}
+
+        written = 0
+        stale = []
+        errors = []
+        log = []
+        events, snapshots = [], []
+        for (game, _, _, actions, entries), result in zip(batch, results):
+            if isinstance(result, BaseException):
+                self._retry(game, actions, entries)
+                errors.append(result)
+            elif result.matched_count:
+                game.version += 1
+                written += 1
+                log.extend(entries)
+                if game.id in records:
+                    game_events, snapshot = records[game.id]
+                    events.extend(game_events)
+                    if snapshot is not None:
+                        snapshots.append(snapshot)
+            else:
+                stale.append((game, actions))
+        for i, (game, actions) in enumerate(stale):
+            try:
+                await self._rebase(game, actions)
+            except BaseException:
+                for game, actions in stale[i:]:
+                    self._retry(game, actions, [])
+                raise
+        if self.log_collection is not None:
+            log, self._log_backlog = self._log_backlog + log, []
+            if log:
+                try:
+                    with DB_LOG_TIME.time():
+                        await self._insert_log(log)
+                except BaseException:
+                    self._log_backlog = log
+                    raise
+        # Stored: the lines may leave memory, ``log_entries`` finds them in the collection
+        stored = {}
+        for entry in log:
+            stored[entry["game_id"]] = max(entry["seq"], stored.get(entry["game_id"], -1))
+        for game_id, seq in stored.items():
+            game = self._games.get(game_id)
+            if game is not None:
+                compact.trim_log(game, seq)
+        if self.history is not None and (events or snapshots):
+            with DB_HISTORY_TIME.time():
+                await self.history.store(events, snapshots)
+        self.writes += written
+        self.flushes += 1
+        if errors:
+            raise errors[0]
+        return written
+
+    async def log_entries(self, game: CompactGame, since: int = -1, limit: int = 100) -> List[dict]:
+        """Up to ``limit`` log entries of a game after seq ``since``, oldest first"""
+        entries = []
+        if self.log_collection is not None:
+            while True:
+                base = game.log_base
+                cursor = self.log_collection.find(
+                    {"game_id": game.id, "seq": {"$gt": since}}, {"_id": False}
+                ).sort("seq", 1).limit(limit)
+                entries = await cursor.to_list(limit)
+                # Lines trimmed while we read were stored after our query saw the collection
+                if game.log_base == base:
+                    break
+        # Lines that are not in the collection yet are still in memory
+        if len(entries) < limit:
+            last = entries[-1]["seq"] if entries else since
+            entries.extend(compact.log_entries(game, last)[:limit - len(entries)])
+        return entries
+
+    async def create_indexes(self):
+        await self.collection.create_index("id", unique=True)
+        # Cleanup queries: games by phase and by last activity
+        await self.collection.create_index([("current_phase", 1), ("updated_at", 1)])
+        await self.collection.create_index("updated_at")
+        if self.archive_collection is not None:
+            await self.archive_collection.create_index("id", unique=True)
+        if self.log_collection is not None:
+            await self.log_collection.create_index([("game_id", 1), ("seq", 1)], unique=True)
+        if self.history is not None:
+            await self.history.create_indexes()
+
+    def start(self):
+        """Start the write-behind task on the running event loop"""
+        if self._task is None:
+            # Made on the loop it runs on, which differs between test clients
+            self._stop = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._write_behind())
+
+    async def close(self):
+        """Stop the write-behind task and write what is still dirty"""
+        if self._task is not None:
+            # Let a flush in progress finish rather than cancel it halfway
+            self._stop.set()
+            await self._task
+            self._task = None
+        # Games rebased after a conflict need one more write
+        for _ in range(3):
+            if not self._dirty:
+                break
+            await self.flush()
+
+    def game_ids(self) -> Set[str]:
+        """Ids of the games this cache holds, including the ones still being written"""
+        return set(self._games).union(self._dirty, self._flushing)
+
+    def evict(self, game_id: str):
+        """Drop a game, which stays reachable until its pending write lands"""
+        if game_id in self._games:
+            self._evict(game_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._games),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "conflicts": self.conflicts,
+        }
+
+    def _lookup(self, game_id: str) -> Optional[CompactGame]:
+        game = self._games.get(game_id)
+        if game is not None:
+            if self._last_used[game_id] > self.clock() - self.ttl:
+                self._games.move_to_end(game_id)
+                self._last_used[game_id] = self.clock()
+                return game
+            self._evict(game_id)
+        # Evicted games whose write has not landed yet
+        game = self._dirty.get(game_id) or self._flushing.get(game_id)
+        if game is not None:
+            self.add(game)
+        return game
+
+    def _retry(self, game: CompactGame, actions: List[tuple], entries: List[dict]):
+        """Write a game again after a failed write, which may have landed anyway
+
+        The full rewrite then conflicts if it did land, and the replay of its
+        actions is rejected as already applied.
+        """
+        compact.mark_unsaved(game)
+        self._dirty[game.id] = game
+        self._actions[game.id] = actions + self._actions.get(game.id, [])
+        self._entries[game.id] = entries + self._entries.get(game.id, [])
+
+    async def _insert_log(self, entries: List[dict]):
+        try:
+            await self.log_collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # Lines already stored by an earlier attempt are fine
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    async def _rebase(self, game: CompactGame, actions: List[tuple]):
+        """Replay our actions on the stored game after someone else wrote it"""
+        self.conflicts += 1
+        doc = await self.collection.find_one({"id": game.id})
+        # Everything applied to the stale copy, including while we waited
+        actions = actions + self._actions.pop(game.id, [])
+        self._dirty.pop(game.id, None)
+        # The stale copy's log lines are replaced by the replay's
+        self._entries.pop(game.id, None)
+        if doc is None:
+            logger.warning("Game %s disappeared, dropping %d actions", game.id, len(actions))
+            self._games.pop(game.id, None)
+            self._last_used.pop(game.id, None)
+            return
+
+        fresh = compact.from_document(doc)
+        kept = []
+        for action in actions:
+            try:
+                compact.apply_action(fresh, action, bot=self.bot)
+                kept.append(action)
+            except compact.ActionRejected as e:
+                logger.info("Game %s: dropped %s after a conflict (%s)", game.id, action, e.detail)
+        if game.id in self._games:
+            self._games[game.id] = fresh
+        if self.on_rebase is not None:
+            self.on_rebase(fresh)
+        if kept:
+            self._dirty[game.id] = fresh
+            self._actions[game.id] = kept
+
+    def _evict(self, game_id: str):
+        del self._games[game_id]
+        del self._last_used[game_id]
+        self.evictions += 1
+
+    async def _write_behind(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.expire()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Game cache write-behind failed")
+
+
+def utcnow() -> datetime:
+    """Naive UTC, as MongoDB hands dates back"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
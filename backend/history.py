@@ -0,0 +1,119 @@
+"""Append-only history of every game: its actions as events, plus snapshots.
+
+The game document only holds the current state.  Every action that lands
+(``compact.*_action``: card selections, the AI's cards and processed turns)
+is also stored as one small event, keyed by
+the game ``version`` of the write that carried it and its index in that
+write.  Every ``snapshot_every`` versions the state written is stored too,
+so rebuilding the game as it was at any point replays the events since the
+nearest snapshot before it, not the whole race.
+
+Actions and the game's own generator (stored in every snapshot) carry
+everything an outcome depends on, so a replay is deterministic: it needs no
+AI search and makes the same draws.
+
+``GameCache`` hands the events and snapshots of each landed write to
+``store``; ``rewind`` rebuilds a past state.
+"""
+from typing import List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+import compact
+from compact import CompactGame
+
+DEFAULT_SNAPSHOT_EVERY = 10
+
+
+class GameHistory:
+    """Events and snapshots of games in two Motor collections"""
+
+    def __init__(self, event_collection, snapshot_collection, snapshot_every: int = DEFAULT_SNAPSHOT_EVERY):
+        self.event_collection = event_collection
+        self.snapshot_collection = snapshot_collection
+        self.snapshot_every = snapshot_every
+        # Documents of landed writes whose insert failed, retried on the next store
+        self._backlog: Tuple[List[dict], List[dict]] = ([], [])
+
+    def events(self, game: CompactGame, version: int, actions: List[tuple]) -> List[dict]:
+        """Event documents of the actions carried by the write of ``version``"""
+        return [{"game_id": game.id, "version": version, "index": i, "action": list(action)}
+                for i, action in enumerate(actions)]
+
+    def snapshot(self, game: CompactGame, version: int) -> Optional[dict]:
+        """Snapshot to store with the write of ``version``, if that write takes one
+
+        Call it before the game changes again, with the write's changes taken.
+        """
+        if version % self.snapshot_every:
+            return None
+        return self._snapshot_document(game, version)
+
+    async def record_created(self, game: CompactGame):
+        """Store the first snapshot of a new game, the base of every replay"""
+        await self.snapshot_collection.insert_one(self._snapshot_document(game, game.version))
+
+    async def store(self, events: List[dict], snapshots: List[dict]):
+        """Insert the events and snapshots of writes that landed"""
+        events, snapshots = self._backlog[0] + events, self._backlog[1] + snapshots
+        self._backlog = ([], [])
+        try:
+            if events:
+                await self._insert(self.event_collection, events)
+            if snapshots:
+                await self._insert(self.snapshot_collection, snapshots)
+        except BaseException:
+            self._backlog = (events, snapshots)
+            raise
+
+    async def rewind(self, game_id: str, turn: Optional[int] = None,
+                     version: Optional[int] = None) -> Optional[CompactGame]:
+        """The game at the start of ``turn``, or as of the write of ``version``
+
+        None if the game never got there.
+        """
+        if version is not None:
+            query = {"game_id": game_id, "version": {"$lte": version}}
+        elif turn is not None:
+            # A snapshot of turn N may hold some of its selections already
+            query = {"game_id": game_id, "$or": [{"turn": {"$lt": turn}}, {"version": 0}]}
+        else:
+            raise ValueError("rewind needs a turn or a version")
+        snapshot = await self.snapshot_collection.find_one(query, sort=[("version", -1)])
+        if snapshot is None:
+            return None
+        game = compact.from_document(snapshot["state"])
+        if turn is not None and game.current_turn > turn:
+            return None
+
+        events = {"game_id": game_id, "version": {"$gt": snapshot["version"]}}
+        if version is not None:
+            events["version"]["$lte"] = version
+        cursor = self.event_collection.find(events, {"_id": False}).sort([("version", 1), ("index", 1)])
+        last = snapshot["version"]
+        async for event in cursor:
+            if turn is not None and game.current_turn >= turn:
+                break
+            compact.apply_action(game, tuple(event["action"]))
+            last = event["version"]
+        if turn is not None and game.current_turn != turn:
+            return None
+        game.version = last
+        return game
+
+    async def create_indexes(self):
+        await self.event_collection.create_index([("game_id", 1), ("version", 1), ("index", 1)], unique=True)
+        await self.snapshot_collection.create_index([("game_id", 1), ("version", 1)], unique=True)
+
+    def _snapshot_document(self, game: CompactGame, version: int) -> dict:
+        state = compact.to_document(game)
+        state["version"] = version
+        return {"game_id": game.id, "version": version, "turn": game.current_turn, "state": state}
+
+    async def _insert(self, collection, documents: List[dict]):
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Documents already stored by an earlier attempt are fine
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
@@ -0,0 +1,423 @@
+"""Monte Carlo tree search bot for AI teams.
+
+The bot picks the cards of all the riders of a team at once.  Every search
+iteration deals a determinization of what the team cannot see (the
+opponents' hands and the order of every deck), walks the tree picking each
+rider's card with UCB1, plays on with the heuristic AI up to ``horizon``
+turns past the root and scores the position reached.  Card statistics are
+kept per rider (decoupled UCT), which needs far fewer iterations than one
+arm per combination of the team's cards.  Opponents are played
+by the heuristic AI (``heuristic_policy``) throughout.
+
+The tree is open loop: a node is reached by the cards the team played, not
+by the state they led to, so the subtree below the cards actually played is
+still valid on the next turn and becomes the new root.
+
+The card found for each rider is memoized by its canonical situation in a
+``TranspositionTable`` shared by all the bots of the process (see
+``transposition``): a team whose riders are all in situations searched
+before, in this game or another, plays without a search.
+
+The search runs on the headless simulator's ``RaceState``, which copies in a
+few microseconds; ``race_from_game`` builds one from a ``CompactGame``.
+Strength grows with ``budget_ms``: the default answers in about 30 ms.
+
+Usage::
+
+    bot = MCTSBot(budget_ms=30)
+    compact.process_turn(game, rng, bot=bot)
+    simulate_race(3, policies=[bot.policy, None, None])
+"""
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+import math
+import os
+import random
+import time
+
+from simulator import (
+    RaceState, RIDERS_PER_TEAM, ROULEUR_BIT, VALUE_MASK, compile_tables, heuristic_policy, play_turn,
+)
+from transposition import TranspositionTable, rider_key, shared_table
+import compact
+from compact import CompactGame, NO_CARD
+from engine import GamePhase
+
+DEFAULT_BUDGET_MS = 30.0
+DEFAULT_HORIZON = 8
+
+
+# (team, the race as the team sees it, riders without a choice, tree key)
+Decision = Tuple[int, RaceState, Set[int], Hashable]
+
+
+class Node:
+    __slots__ = ("visits", "arms", "children")
+
+    def __init__(self):
+        self.visits = 0
+        # (rider slot in the team, card) -> [visits, total reward]
+        self.arms: Dict[Tuple[int, int], List[float]] = {}
+        # Next turn, by the cards the team played
+        self.children: Dict[tuple, "Node"] = {}
+
+
+class MCTSBot:
+    """Search-based card choice with a time budget per decision
+
+    ``iterations`` caps the iterations per decision, with ``budget_ms=None``
+    it is the only limit (reproducible play for a given ``seed``).  Trees of
+    the last ``max_trees`` (game, team) pairs are kept for reuse.  Pass
+    ``table=None`` to search every decision.
+    """
+
+    def __init__(self, budget_ms: Optional[float] = DEFAULT_BUDGET_MS, iterations: Optional[int] = None,
+                 horizon: int = DEFAULT_HORIZON, exploration: float = 0.7, max_trees: int = 1000,
+                 seed: Optional[int] = None, clock=time.perf_counter,
+                 table: Optional[TranspositionTable] = shared_table):
+        if budget_ms is None and iterations is None:
+            raise ValueError("MCTSBot needs a time budget or an iteration cap")
+        self.budget_ms = budget_ms
+        self.iterations = iterations
+        self.horizon = horizon
+        self.exploration = exploration
+        self.max_trees = max_trees
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.table = table
+        # (game, team) -> (turn the tree is for, root)
+        self._trees: "OrderedDict[Hashable, Tuple[int, Node]]" = OrderedDict()
+        # team -> (race, turn, cards), for the simulator policy
+        self._decisions: Dict[int, tuple] = {}
+        self.decisions = 0
+        self.searched = 0
+        self.reused = 0
+        self.memoized = 0
+        self.searches = 0
+
+    def choose(self, race: RaceState, team: int, key: Hashable = None,
+               fixed: Set[int] = frozenset()) -> Dict[int, int]:
+        """Card to play for each rider of ``team`` that has a choice to make
+
+        Riders in ``fixed`` play the card(s) in their hand without a search.
+        Pass a ``key`` naming the game to reuse the tree on the next turn.
+        """
+        first = team * RIDERS_PER_TEAM
+        deciders = [r for r in range(first, first + RIDERS_PER_TEAM)
+                    if r not in fixed and not race.finished[r] and race.hand[r]]
+        if not deciders:
+            return {}
+        self.decisions += 1
+        search = any(len(set(race.hand[r])) > 1 for r in deciders)
+        keys = None
+        if search and self.table is not None:
+            keys = [rider_key(race, r) for r in deciders]
+            hits = [self.table.get(k) for k in keys]
+            if all(hits):
+                self.memoized += 1
+                self._trees.pop(key, None)
+                return {r: min(card for card in race.hand[r] if card & VALUE_MASK == hit[0])
+                        for r, hit in zip(deciders, hits)}
+        root = self._root(key, race.turn)
+        if search:
+            deadline = None if self.budget_ms is None else self.clock() + self.budget_ms / 1000
+            count = 0
+            while True:
+                self._iterate(root, race, team, deciders)
+                count += 1
+                if self.iterations is not None and count >= self.iterations:
+                    break
+                if deadline is not None and self.clock() >= deadline:
+                    break
+            self.searched += count
+            self.searches += 1
+        arms = root.arms
+        action = tuple(
+            max(sorted(set(race.hand[r])), key=lambda card: arms.get((r - first, card), (0,))[0])
+            for r in deciders
+        )
+        if keys is not None:
+            for k, r, card in zip(keys, deciders, action):
+                visits, reward = arms[r - first, card]
+                self.table.put(k, card & VALUE_MASK, reward / visits)
+        if key is not None:
+            self._trees[key] = (race.turn + 1, root.children.get(action) or Node())
+            self._trees.move_to_end(key)
+            while len(self._trees) > self.max_trees:
+                self._trees.popitem(last=False)
+        return dict(zip(deciders, action))
+
+    def select_cards(self, game: CompactGame) -> Dict[int, int]:
+        """Compact card index for the AI riders of ``game`` that still have to play"""
+        return cards_for(game, self.choose_all(plan_decisions(game)))
+
+    def choose_all(self, decisions: List[Decision]) -> Dict[int, int]:
+        """Simulator card for the riders of every decision of ``plan_decisions``"""
+        choices = {}
+        for team, race, fixed, key in decisions:
+            choices.update(self.choose(race, team, key=key, fixed=fixed))
+        return choices
+
+    def policy(self, race: RaceState, rider: int) -> int:
+        """``simulator.Policy``: index of the card to play in the rider's hand"""
+        team = rider // RIDERS_PER_TEAM
+        decision = self._decisions.get(team)
+        if decision is None or decision[0] is not race or decision[1] != race.turn:
+            decision = (race, race.turn, self.choose(race, team, key=(id(race), team)))
+            self._decisions[team] = decision
+        card = decision[2].get(rider)
+        if card is None or card not in race.hand[rider]:
+            return heuristic_policy(race, rider)
+        return race.hand[rider].index(card)
+
+    def stats(self) -> Dict[str, float]:
+        return search_stats(self.counters())
+
+    def counters(self) -> Dict[str, int]:
+        """The plain counts of ``stats``, which add up across bots"""
+        counts = {
+            "decisions": self.decisions,
+            "searches": self.searches,
+            "iterations": self.searched,
+            "trees_reused": self.reused,
+            "memoized": self.memoized,
+        }
+        if self.table is not None:
+            counts.update(table_size=len(self.table), table_hits=self.table.hits, table_misses=self.table.misses)
+        return counts
+
+    def _root(self, key: Hashable, turn: int) -> Node:
+        if key is not None:
+            kept = self._trees.pop(key, None)
+            if kept is not None and kept[0] == turn:
+                self.reused += 1
+                return kept[1]
+        return Node()
+
+    def _select(self, node: Node, slot: int, cards: List[int]) -> int:
+        """A rider's card by UCB1, trying every card of its hand first"""
+        arms = node.arms
+        untried = [card for card in cards if (slot, card) not in arms]
+        if untried:
+            return untried[self.rng.randrange(len(untried))]
+        log_visits = math.log(max(node.visits, 1))
+        c = self.exploration
+        best, best_score = cards[0], -1.0
+        for card in cards:
+            visits, reward = arms[slot, card]
+            score = reward / visits + c * math.sqrt(log_visits / visits)
+            if score > best_score:
+                best, best_score = card, score
+        return best
+
+    def _iterate(self, root: Node, race: RaceState, team: int, deciders: List[int]):
+        rng = self.rng
+        sim = determinize(race, team, rng)
+        first = team * RIDERS_PER_TEAM
+        chosen: Dict[int, int] = {}
+
+        def ours(race: RaceState, rider: int) -> int:
+            card = chosen.get(rider)
+            return heuristic_policy(race, rider) if card is None else race.hand[rider].index(card)
+
+        policies = [None] * race.team_count
+        policies[team] = ours
+        node = root
+        path = []
+        over = False
+        depth = 0
+        # Tree policy, down to the first node that was not there yet
+        while depth < self.horizon:
+            if depth:
+                deciders = [r for r in range(first, first + RIDERS_PER_TEAM)
+                            if not sim.finished[r] and sim.hand[r]]
+            action = tuple(self._select(node, r - first, sorted(set(sim.hand[r]))) for r in deciders)
+            path.append((node, [(r - first, card) for r, card in zip(deciders, action)]))
+            chosen = dict(zip(deciders, action))
+            over = play_turn(sim, rng, policies)
+            depth += 1
+            child = node.children.get(action)
+            if child is None:
+                node.children[action] = Node()
+                break
+            node = child
+            if over:
+                break
+        # Rollout
+        while not over and depth < self.horizon:
+            over = play_turn(sim, rng)
+            depth += 1
+        reward = _score(sim, team, over)
+        for visited, played in path:
+            visited.visits += 1
+            for arm in played:
+                stats = visited.arms.get(arm)
+                if stats is None:
+                    visited.arms[arm] = [1, reward]
+                else:
+                    stats[0] += 1
+                    stats[1] += reward
+
+
+def _score(race: RaceState, team: int, over: bool) -> float:
+    """1 for a win, 0 for a loss, else the lead squashed into (0, 1)"""
+    first = team * RIDERS_PER_TEAM
+    if over:
+        # Riders over the line on the same turn are ranked in team order
+        return 1.0 if race.finished.index(True) // RIDERS_PER_TEAM == team else 0.0
+    position = race.position
+    own = max(position[first:first + RIDERS_PER_TEAM])
+    rest = max(position[:first] + position[first + RIDERS_PER_TEAM:], default=0)
+    lead = own - rest
+    return 0.5 + 0.45 * lead / (abs(lead) + 4)
+
+
+def determinize(race: RaceState, team: int, rng: random.Random) -> RaceState:
+    """Copy of ``race`` with what ``team`` cannot see dealt at random
+
+    Every deck is shuffled, and each opponent's hands are dealt again from
+    the cards of the same type in its hands and deck.
+    """
+    sim = race.copy()
+    for t in range(sim.team_count):
+        riders = range(t * RIDERS_PER_TEAM, (t + 1) * RIDERS_PER_TEAM)
+        for decks, rouleur in ((sim.sprinteur_deck, False), (sim.rouleur_deck, True)):
+            pool = decks[t]
+            slots = []
+            if t != team:
+                for r in riders:
+                    hand = sim.hand[r]
+                    for i, card in enumerate(hand):
+                        if bool(card & ROULEUR_BIT) == rouleur:
+                            pool.append(card)
+                            slots.append((hand, i))
+            rng.shuffle(pool)
+            for hand, i in slots:
+                hand[i] = pool.pop()
+    return sim
+
+
+def _sim_card(game: CompactGame, card: int) -> int:
+    """Simulator int of a compact card index"""
+    value = game.card_values[card]
+    return value | ROULEUR_BIT if game.card_types[card] == compact.ROULEUR else value
+
+
+def plan_decisions(game: CompactGame) -> List[Decision]:
+    """The searches that pick the cards of the AI riders of ``game`` yet to play
+
+    Plain data, to search in another process (``search_in_process``).
+    """
+    if game.current_phase != GamePhase.CARD_SELECTION:
+        return []
+    pending = [r for r in range(game.rider_count)
+               if game.ai[r] and game.played[r] == NO_CARD and not game.finished[r] and game.hands[r]]
+    if not pending:
+        return []
+    race = race_from_game(game)
+    if race is None:
+        return []
+    decisions = []
+    for team in sorted({game.rider_team[r] for r in pending}):
+        view = race
+        fixed = set()
+        for r in game.team_riders[team]:
+            if game.played[r] != NO_CARD:
+                # A team mate's card is known, unlike an opponent's
+                if view is race:
+                    view = race.copy()
+                view.hand[r] = [_sim_card(game, game.played[r])]
+                fixed.add(r)
+            elif not game.ai[r]:
+                fixed.add(r)
+        decisions.append((team, view, fixed, (game.id, team)))
+    return decisions
+
+
+def cards_for(game: CompactGame, choices: Dict[int, int]) -> Dict[int, int]:
+    """Compact card index in the rider's hand for each simulator card chosen"""
+    cards = {}
+    for r, card in choices.items():
+        found = next((c for c in game.hands[r] if _sim_card(game, c) == card), None)
+        if found is not None:
+            cards[r] = found
+    return cards
+
+
+def search_stats(counters: Dict[str, int]) -> Dict[str, float]:
+    """``MCTSBot.stats`` of ``counters``, those of one bot or the sum of several"""
+    stats = dict(counters)
+    stats["iterations_per_decision"] = stats["iterations"] / stats["decisions"] if stats["decisions"] else 0.0
+    if "table_hits" in stats:
+        lookups = stats["table_hits"] + stats["table_misses"]
+        stats["table_hit_rate"] = stats["table_hits"] / lookups if lookups else 0.0
+    return stats
+
+
+class Decided:
+    """Stands in for the bot with the choices of a search made elsewhere"""
+
+    def __init__(self, choices: Dict[int, int]):
+        self.choices = choices
+
+    def select_cards(self, game: CompactGame) -> Dict[int, int]:
+        return cards_for(game, self.choices)
+
+
+# The bot of a search process, see ``start_search_process``
+_process_bot: Optional[MCTSBot] = None
+
+
+def start_search_process(budget_ms: float, table_size: int):
+    """``ProcessPoolExecutor`` initializer: the bot this process searches with"""
+    global _process_bot
+    shared_table.max_entries = table_size
+    _process_bot = MCTSBot(budget_ms=budget_ms)
+
+
+def search_in_process(decisions: List[Decision]) -> Tuple[Dict[int, int], int, Dict[str, int]]:
+    """``MCTSBot.choose_all`` on the bot of a search process
+
+    Returns the choices, the id of the process and the ``counters`` of its
+    bot, which only that process sees.
+    """
+    return _process_bot.choose_all(decisions), os.getpid(), _process_bot.counters()
+
+
+def race_from_game(game: CompactGame) -> Optional[RaceState]:
+    """The game as a simulator race, None unless every team has two riders
+
+    Cards already played go back to their riders' hands, so that the search
+    does not peek at an opponent's choice.
+    """
+    if any(len(riders) != RIDERS_PER_TEAM for riders in game.team_riders):
+        return None
+    track = compile_tables(game.tables, game.weather)
+    race = RaceState(track, len(game.team_ids))
+    stride = track.max_lanes
+    race.position = list(game.position)
+    race.lane = list(game.lane)
+    race.finished = [bool(done) for done in game.finished]
+    race.fatigue = list(game.fatigue_count)
+    race.occupied = [0] * (track.length + 1)
+    race.lane_used = [0] * ((track.length + 1) * stride)
+    for r in range(game.rider_count):
+        if not race.finished[r]:
+            race.occupied[race.position[r]] += 1
+            race.lane_used[race.position[r] * stride + race.lane[r]] += 1
+    race.turn = game.current_turn
+    for t, piles in enumerate(game.piles):
+        race.sprinteur_deck.append([_sim_card(game, c) for c in piles[compact.SPRINTEUR_DECK]])
+        race.rouleur_deck.append([_sim_card(game, c) for c in piles[compact.ROULEUR_DECK]])
+        race.sprinteur_discard[t] = [_sim_card(game, c) for c in piles[compact.SPRINTEUR_DISCARD]]
+        race.rouleur_discard[t] = [_sim_card(game, c) for c in piles[compact.ROULEUR_DISCARD]]
+        race.fatigue_deck[t] = len(piles[compact.FATIGUE_DECK])
+    for r in range(game.rider_count):
+        race.hand[r] = [_sim_card(game, c) for c in game.hands[r]]
+        played = game.played[r]
+        if played != NO_CARD and game.card_types[played] != compact.FATIGUE:
+            card = _sim_card(game, played)
+            team = game.rider_team[r]
+            (race.rouleur_discard if card & ROULEUR_BIT else race.sprinteur_discard)[team].remove(card)
+            race.hand[r].append(card)
+    return race
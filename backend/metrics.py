@@ -0,0 +1,186 @@
+"""Counters and latency histograms, served in the Prometheus text format.
+
+Metrics are declared once at import time, with their labels, and the hot
+paths only touch the objects returned::
+
+    MOVEMENT = metrics.histogram("flamme_rouge_phase_seconds", "...", phase="movement")
+
+    with MOVEMENT.time():
+        ...
+
+When ``registry.enabled`` is off, ``time()`` hands back a shared no-op
+context manager and ``inc``/``observe`` return at once, so instrumented code
+pays one attribute lookup and a call.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Upper bounds in seconds, from a fraction of a phase to a slow Mongo call
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels.items()) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"') for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+class Counter:
+    __slots__ = ("registry", "labels", "value")
+
+    def __init__(self, registry: "Registry", labels: Dict[str, str]):
+        self.registry = registry
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        if self.registry.enabled:
+            self.value += amount
+
+    def samples(self, name: str) -> List[str]:
+        return [f"{name}{_labels(self.labels)} {self.value}"]
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: "Histogram"):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    __slots__ = ("registry", "labels", "buckets", "counts", "sum", "count")
+
+    def __init__(self, registry: "Registry", labels: Dict[str, str], buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # One count per bucket plus +Inf, not cumulative until rendered
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        if self.registry.enabled:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager observing the seconds spent in its block"""
+        return _Timer(self) if self.registry.enabled else _NULL_TIMER
+
+    def samples(self, name: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_labels(self.labels, ('le', le))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(self.labels)} {self.sum!r}")
+        lines.append(f"{name}_count{_labels(self.labels)} {self.count}")
+        return lines
+
+
+class Registry:
+    """Metric families by name, each with one child per label set"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        # name -> (type, help, {label items: child})
+        self._families: Dict[str, Tuple[str, str, Dict[tuple, object]]] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], Dict[tuple, float]]]] = {}
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        return self._child(name, "counter", help, labels, lambda: Counter(self, labels))
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS, **labels: str) -> Histogram:
+        return self._child(name, "histogram", help, labels, lambda: Histogram(self, labels, buckets))
+
+    def gauge_callback(self, name: str, help: str, read: Callable[[], Dict[tuple, float]]):
+        """A gauge read when rendering; ``read`` returns values by label items"""
+        self._gauges[name] = (help, read)
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, children) in sorted(self._families.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for child in children.values():
+                lines.extend(child.samples(name))
+        for name, (help, read) in sorted(self._gauges.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for items, value in read().items():
+                lines.append(f"{name}{_labels(dict(items))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _child(self, name, kind, help, labels, make):
+        family = self._families.setdefault(name, (kind, help, {}))
+        if family[0] != kind:
+            raise ValueError(f"{name} is already a {family[0]}")
+        key = tuple(sorted(labels.items()))
+        child = family[2].get(key)
+        if child is None:
+            child = family[2][key] = make()
+        return child
+
+
+class RequestMetrics:
+    """ASGI middleware observing the latency of every HTTP request
+
+    Requests are labelled with the method and the route template
+    (``/api/flamme-rouge/game/{game_id}``), never the raw path, so the number
+    of series stays bounded.
+    """
+
+    def __init__(self, app, registry: "Registry", name: str = "http_request_seconds"):
+        self.app = app
+        self.registry = registry
+        self.name = name
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            histogram = self.registry.histogram(
+                self.name, "Seconds from request to response, by route",
+                method=scope["method"], route=getattr(route, "path", "unmatched"))
+            histogram.observe(time.perf_counter() - start)
+
+
+# The registry of the process, served at /api/metrics
+registry = Registry()
+
+counter = registry.counter
+histogram = registry.histogram
+gauge_callback = registry.gauge_callback
@@ -0,0 +1,271 @@
+"""Game ownership when several worker processes serve the API.
+
+Each game is owned by at most one worker at a time, through a lease stored
+in MongoDB (one document per game: owner, its address, expiry).  A worker
+claims the lease of a game the first time it serves it and renews the
+leases of the games it still caches every ``ttl / 3`` seconds; the games
+it stops caching lose their lease after ``ttl``.  Requests for a game that
+another worker owns are forwarded to that worker (``OwnerRouting``), so
+only the owner's ``GameCache`` changes the game and the others never serve
+a stale copy.
+
+Workers prove a request was forwarded by one of them with ``secret``, which
+all of them share: a forwarded request carrying it is served whatever the
+lease says, one without it (from a client) is routed like any other.
+Without a secret no request counts as forwarded.  Leases are only taken on
+games that exist (``exists``), a request for an unknown id goes straight
+to the app.
+
+When a worker shuts down it writes its dirty games and releases its leases,
+so another worker takes the games over on their next request.  When it
+dies, its leases expire after ``ttl`` and the games move the same way,
+losing only what the dead worker had not flushed yet (up to the cache's
+``flush_interval``).  A worker that stalls past its leases writes its games
+with the usual version check, so it cannot overwrite the new owner: its
+actions are merged onto the stored game (see ``game_cache``) and it drops
+the games it lost.
+
+Usage::
+
+    ownership = GameOwnership(db.flamme_rouge_leases, "worker-1", "http://10.0.0.5:8001", secret=secret)
+    app.add_middleware(OwnerRouting, ownership=ownership, exists=games.exists)
+"""
+import asyncio
+import hmac
+import logging
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Collection, Dict, Optional
+
+import httpx
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Requests about one game, by id
+GAME_PATH = re.compile(r"^/api/flamme-rouge/game/([^/]+)")
+# Set to the workers' secret on forwarded requests, which the receiving worker
+# serves whatever the lease says
+FORWARDED_HEADER = "x-flamme-rouge-forwarded"
+# Not forwarded either way, they describe one connection
+HOP_HEADERS = frozenset((
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "host", "content-length", "content-encoding",
+))
+
+
+class GameOwnership:
+    """Leases on games in a Motor collection, held by the worker ``worker_id``
+
+    ``address`` is the base URL other workers reach this one at, ``secret``
+    the one all of them share to mark forwarded requests.  ``on_lost`` is
+    called with the id of each game whose lease another worker took while
+    this one still cached it.
+    """
+
+    def __init__(self, collection, worker_id: str, address: str, ttl: float = 15.0,
+                 on_lost: Optional[Callable[[str], None]] = None, transport=None, secret: Optional[str] = None):
+        self.collection = collection
+        self.worker_id = worker_id
+        self.address = address.rstrip("/")
+        self.ttl = ttl
+        self.secret = secret
+        self.on_lost = on_lost
+        self.clock: Callable[[], float] = time.monotonic
+        # Games leased by this worker, to when the lease is good for without asking Mongo
+        self._leases: Dict[str, float] = {}
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self.claims = 0
+        self.forwarded = 0
+        self.lost = 0
+
+    async def create_indexes(self):
+        await self.collection.create_index("game_id", unique=True)
+        # Leases of games nobody serves any more go away by themselves
+        await self.collection.create_index("expires_at", expireAfterSeconds=3600)
+
+    def owns(self, game_id: str) -> bool:
+        """Whether this worker holds the lease of a game, as far as it knows"""
+        return self._leases.get(game_id, 0.0) > self.clock()
+
+    async def claim(self, game_id: str) -> Optional[str]:
+        """Take or renew the lease of a game: None once this worker owns it, else the owner's address"""
+        now = self.clock()
+        # Renewed in the background, no need to ask Mongo while half of it is left
+        if self._leases.get(game_id, 0.0) > now + self.ttl / 2:
+            return None
+        for _ in range(3):
+            expires_at = _utcnow()
+            try:
+                await self.collection.find_one_and_update(
+                    {"game_id": game_id, "$or": [{"owner": self.worker_id}, {"expires_at": {"$lt": expires_at}}]},
+                    {"$set": {"owner": self.worker_id, "address": self.address,
+                              "expires_at": expires_at + timedelta(seconds=self.ttl)}},
+                    upsert=True)
+                break
+            except DuplicateKeyError:
+                # Held by another worker, unless the lease went away in the meantime
+                lease = await self.collection.find_one({"game_id": game_id})
+                if lease is not None and lease["owner"] != self.worker_id:
+                    self._leases.pop(game_id, None)
+                    return lease["address"]
+        else:
+            raise RuntimeError(f"Could not claim game {game_id}")
+        self.claims += 1
+        self._leases[game_id] = now + self.ttl
+        return None
+
+    async def renew(self, game_ids: Collection[str]):
+        """Extend the leases of ``game_ids``, give up the others, report the ones lost"""
+        for game_id in set(self._leases).difference(game_ids):
+            del self._leases[game_id]
+        if not self._leases:
+            return
+        now = self.clock()
+        expires_at = _utcnow()
+        ids = list(self._leases)
+        await self.collection.update_many(
+            {"game_id": {"$in": ids}, "owner": self.worker_id},
+            {"$set": {"expires_at": expires_at + timedelta(seconds=self.ttl)}})
+        held = {lease["game_id"] async for lease in self.collection.find(
+            {"game_id": {"$in": ids}, "owner": self.worker_id}, {"game_id": 1})}
+        for game_id in ids:
+            if game_id in held:
+                self._leases[game_id] = now + self.ttl
+            else:
+                del self._leases[game_id]
+                self.lost += 1
+                logger.warning("Lost the lease of game %s", game_id)
+                if self.on_lost is not None:
+                    self.on_lost(game_id)
+
+    async def release(self):
+        """Give up every lease, for another worker to take the games over at once"""
+        self._leases.clear()
+        await self.collection.delete_many({"owner": self.worker_id})
+
+    def start(self, live: Callable[[], Collection[str]]):
+        """Renew the leases of the ``live()`` games in the background"""
+        if self._task is None:
+            # Made on the loop it runs on, which differs between test clients
+            self._stop = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._renew_forever(live))
+
+    async def close(self):
+        """Stop renewing and release every lease; write the games back first"""
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+        await self.release()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def forward(self, address: str, method: str, path: str, query: bytes, headers, body: bytes
+                      ) -> httpx.Response:
+        """Send a request on to the worker at ``address``"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(transport=self._transport, timeout=30.0)
+        self.forwarded += 1
+        headers = [(key, value) for key, value in headers
+                   if key.lower() not in HOP_HEADERS and key.lower() != FORWARDED_HEADER]
+        if self.secret is not None:
+            headers.append((FORWARDED_HEADER, self.secret))
+        return await self._client.request(method, f"{address}{path}", params=query.decode(),
+                                          headers=headers, content=body)
+
+    def forwarded_by_worker(self, headers) -> bool:
+        """Whether ASGI ``headers`` carry the workers' secret"""
+        if self.secret is None:
+            return False
+        secret = self.secret.encode()
+        return any(key == FORWARDED_HEADER.encode() and hmac.compare_digest(value, secret) for key, value in headers)
+
+    def stats(self) -> Dict[str, int]:
+        return {"leases": len(self._leases), "claims": self.claims, "forwarded": self.forwarded,
+                "lost": self.lost}
+
+    async def _renew_forever(self, live):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.ttl / 3)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.renew(live())
+            except Exception:
+                logger.exception("Lease renewal failed, retrying")
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class OwnerRouting:
+    """ASGI middleware serving each game's requests on the worker that owns it
+
+    HTTP requests for a game leased by another worker are forwarded to it;
+    WebSocket connections are refused (1013, try again later) with the
+    owner's address as the reason, the load balancer or client should
+    connect there.  If the owner cannot be reached, the request fails with
+    a 503 until its lease expires.  ``exists`` is awaited with the id of a
+    game this worker does not own yet; the app answers for the games it
+    does not find, without a lease.
+    """
+
+    def __init__(self, app, ownership: Optional[GameOwnership],
+                 exists: Optional[Callable[[str], Awaitable[bool]]] = None):
+        self.app = app
+        self.ownership = ownership
+        self.exists = exists
+
+    async def __call__(self, scope, receive, send):
+        match = GAME_PATH.match(scope.get("path", "")) if scope["type"] in ("http", "websocket") else None
+        if match is None or self.ownership is None:
+            await self.app(scope, receive, send)
+            return
+        game_id = match.group(1)
+        if not self.ownership.owns(game_id) and self.exists is not None and not await self.exists(game_id):
+            await self.app(scope, receive, send)
+            return
+        address = await self.ownership.claim(game_id)
+        if address is None or self.ownership.forwarded_by_worker(scope["headers"]):
+            await self.app(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await receive()
+            await send({"type": "websocket.close", "code": 1013, "reason": address})
+        else:
+            await self._forward(address, scope, receive, send)
+
+    async def _forward(self, address, scope, receive, send):
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+        headers = [(key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"]]
+        try:
+            response = await self.ownership.forward(address, scope["method"], scope["path"],
+                                                    scope["query_string"], headers, body)
+        except httpx.HTTPError as e:
+            logger.warning("Owner %s of %s unreachable: %s", address, scope["path"], e)
+            await _respond(send, 503, [(b"retry-after", str(int(self.ownership.ttl)).encode())],
+                           b'{"detail":"Game owner unreachable"}')
+            return
+        headers = [(key.encode("latin-1"), value.encode("latin-1"))
+                   for key, value in response.headers.multi_items() if key.lower() not in HOP_HEADERS]
+        await _respond(send, response.status_code, headers, response.content)
+
+
+async def _respond(send, status: int, headers, body: bytes):
+    headers = headers + [(b"content-length", str(len(body)).encode())]
+    if not any(key == b"content-type" for key, _ in headers):
+        headers.append((b"content-type", b"application/json"))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
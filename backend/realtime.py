@@ -0,0 +1,126 @@
+"""Push game changes to WebSocket subscribers.
+
+A subscriber follows the game as one team sees it, or as a spectator
+(``compact.to_view``): it first gets a snapshot of its view, then one message
+per action with the JSON Patch operations ``compact.apply_action`` returned,
+turned into operations on the view (``compact.view_patch``):
+
+    {"type": "snapshot", "seq": 3, "game_state": {...}}
+    {"type": "patch", "seq": 4, "ops": [{"op": "replace", "path": "/current_phase", ...}]}
+
+``seq`` counts the messages of a game, so a client can tell it missed one.
+Each message is serialized once per view and the same text is queued for
+every subscriber with that view; a subscriber whose queue is full (a slow
+client) has its backlog replaced by a fresh snapshot rather than holding up
+the others.
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import compact
+from compact import CompactGame
+
+logger = logging.getLogger(__name__)
+
+def _dumps(message: dict) -> str:
+    return json.dumps(message, separators=(",", ":"))
+
+class GameHub:
+    """Subscribers of each game, by game id"""
+
+    def __init__(self, max_queue: int = 64):
+        self.max_queue = max_queue
+        # Queues of the subscribers of each game, with the team they view it as
+        self._subscribers: Dict[str, Dict[asyncio.Queue, Optional[str]]] = {}
+        self._seq: Dict[str, int] = {}
+        self.messages = 0
+        self.resyncs = 0
+
+    def subscribers(self, game_id: str) -> int:
+        return len(self._subscribers.get(game_id, ()))
+
+    def publish(self, game: CompactGame, ops: List[dict]):
+        """Send the patch of one action to everyone following the game"""
+        queues = self._subscribers.get(game.id)
+        if not queues or not ops:
+            return
+        seq = self._next_seq(game.id)
+        texts: Dict[Optional[str], str] = {}
+        lagging = []
+        for queue, viewer in queues.items():
+            if viewer not in texts:
+                texts[viewer] = _dumps({"type": "patch", "seq": seq, "ops": compact.view_patch(game, viewer, ops)})
+                self.messages += 1
+            try:
+                queue.put_nowait(texts[viewer])
+            except asyncio.QueueFull:
+                lagging.append(queue)
+        if lagging:
+            self._resync(game, lagging)
+
+    def resync(self, game: CompactGame):
+        """Send everyone a new snapshot, after the game was replaced as a whole"""
+        queues = self._subscribers.get(game.id)
+        if queues:
+            self._resync(game, list(queues))
+
+    async def serve(self, websocket: WebSocket, game: CompactGame, viewer: Optional[str] = None):
+        """Follow a game as ``viewer`` (a team id, a spectator if None) until the client disconnects"""
+        await websocket.accept()
+        queue: asyncio.Queue = asyncio.Queue(self.max_queue)
+        queue.put_nowait(self._snapshot(game, viewer))
+        self._subscribers.setdefault(game.id, {})[queue] = viewer
+        sender = asyncio.create_task(self._send(websocket, queue))
+        receiver = asyncio.create_task(self._receive(websocket))
+        try:
+            # Clients have nothing to say, reading only notices them leave
+            await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sender.cancel()
+            receiver.cancel()
+            queues = self._subscribers[game.id]
+            queues.pop(queue, None)
+            if not queues:
+                del self._subscribers[game.id]
+                del self._seq[game.id]
+
+    def _next_seq(self, game_id: str) -> int:
+        seq = self._seq.get(game_id, 0) + 1
+        self._seq[game_id] = seq
+        return seq
+
+    def _snapshot(self, game: CompactGame, viewer: Optional[str]) -> str:
+        return _dumps({"type": "snapshot", "seq": self._seq.setdefault(game.id, 0),
+                       "game_state": compact.to_view(game, viewer)})
+
+    def _resync(self, game: CompactGame, queues: List[asyncio.Queue]):
+        texts: Dict[Optional[str], str] = {}
+        viewers = self._subscribers[game.id]
+        for queue in queues:
+            viewer = viewers[queue]
+            if viewer not in texts:
+                texts[viewer] = self._snapshot(game, viewer)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(texts[viewer])
+        self.resyncs += len(queues)
+
+    @staticmethod
+    async def _send(websocket: WebSocket, queue: asyncio.Queue):
+        try:
+            while True:
+                await websocket.send_text(await queue.get())
+        except (WebSocketDisconnect, RuntimeError) as e:
+            logger.debug("Subscriber gone: %s", e)
+
+    @staticmethod
+    async def _receive(websocket: WebSocket):
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
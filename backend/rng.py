@@ -0,0 +1,113 @@
+"""Per-game random number generator, small enough to store with the game.
+
+``GameRandom`` is a ``random.Random`` driven by PCG32 (O'Neill, 2014)
+instead of the Mersenne Twister: its whole state is two 64-bit words, so it
+goes into the game document as a 32 character string (``dumps``/``loads``)
+rather than the 625 words of ``random.getstate()``.  Every method of
+``random.Random`` (``choice``, ``shuffle``, ``sample``...) works on top of it.
+
+Each game draws from its own generator and nothing else does, so a game is
+reproducible from its seed whatever other games the process runs, and a
+stored game carries on with the same draws in any worker.
+"""
+import hashlib
+import os
+import random
+
+MASK64 = (1 << 64) - 1
+MULTIPLIER = 6364136223846793005
+# PCG's default stream, mixed with the high bits of the seed
+DEFAULT_STREAM = 0xDA3E39CB94B95BDB
+
+
+class GameRandom(random.Random):
+    """``random.Random`` on PCG32 (XSH RR), seeded from the OS by default
+
+    Seeds are ints (64 low bits for the state, the next 64 pick the stream)
+    or strings such as a game id, hashed into an int.
+    """
+
+    def __init__(self, seed=None):
+        self._state = 0
+        self._inc = 1
+        super().__init__(seed)
+
+    def seed(self, a=None, version=2):
+        if a is None:
+            a = int.from_bytes(os.urandom(16), "little")
+        elif not isinstance(a, int):
+            a = int.from_bytes(hashlib.sha256(str(a).encode()).digest()[:16], "little")
+        self._inc = ((((a >> 64) ^ DEFAULT_STREAM) & MASK64) << 1 | 1) & MASK64
+        self._state = 0
+        self._next()
+        self._state = (self._state + (a & MASK64)) & MASK64
+        self._next()
+        self.gauss_next = None
+
+    def _next(self) -> int:
+        """Advance the state and return the next 32-bit output"""
+        old = self._state
+        self._state = (old * MULTIPLIER + self._inc) & MASK64
+        shifted = (((old >> 18) ^ old) >> 27) & 0xFFFFFFFF
+        rotation = old >> 59
+        return ((shifted >> rotation) | (shifted << (-rotation & 31))) & 0xFFFFFFFF
+
+    def random(self) -> float:
+        # 53 bits from two outputs, as the Mersenne Twister does; _next inlined
+        old, inc = self._state, self._inc
+        new = (old * MULTIPLIER + inc) & MASK64
+        self._state = (new * MULTIPLIER + inc) & MASK64
+        shifted = (((old >> 18) ^ old) >> 27) & 0xFFFFFFFF
+        rotation = old >> 59
+        high = ((shifted >> rotation) | (shifted << (-rotation & 31))) & 0xFFFFFFFF
+        shifted = (((new >> 18) ^ new) >> 27) & 0xFFFFFFFF
+        rotation = new >> 59
+        low = ((shifted >> rotation) | (shifted << (-rotation & 31))) & 0xFFFFFFFF
+        return ((high >> 5) * 67108864.0 + (low >> 6)) * (1.0 / 9007199254740992.0)
+
+    def getrandbits(self, k: int) -> int:
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        if k <= 32:
+            return self._next() >> (32 - k)
+        words = (k + 31) // 32
+        x = 0
+        for _ in range(words):
+            x = (x << 32) | self._next()
+        return x >> (words * 32 - k)
+
+    def _randbelow(self, n: int) -> int:
+        # What choice and shuffle draw from, by rejection as random.Random does
+        k = n.bit_length()
+        if k > 32:
+            r = self.getrandbits(k)
+            while r >= n:
+                r = self.getrandbits(k)
+            return r
+        inc = self._inc
+        while True:
+            old = self._state
+            self._state = (old * MULTIPLIER + inc) & MASK64
+            shifted = (((old >> 18) ^ old) >> 27) & 0xFFFFFFFF
+            rotation = old >> 59
+            r = (((shifted >> rotation) | (shifted << (-rotation & 31))) & 0xFFFFFFFF) >> (32 - k)
+            if r < n:
+                return r
+
+    def getstate(self):
+        return ("pcg32", self._state, self._inc, self.gauss_next)
+
+    def setstate(self, state):
+        if state[0] != "pcg32":
+            raise ValueError("not a GameRandom state")
+        _, self._state, self._inc, self.gauss_next = state
+
+    def dumps(self) -> str:
+        """The state as 32 hex digits; ``gauss`` pairs in progress are dropped"""
+        return f"{self._state:016x}{self._inc:016x}"
+
+    @classmethod
+    def loads(cls, text: str) -> "GameRandom":
+        rng = cls(0)
+        rng._state, rng._inc = int(text[:16], 16), int(text[16:], 16)
+        return rng
@@ -1,590 +1,532 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import Body, FastAPI, APIRouter, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
 from dotenv import load_dotenv
+from pydantic import BaseModel
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+import hmac
 import os
 import logging
+import socket
+import msgpack
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Dict, Optional, Tuple, Literal
-import uuid
-from datetime import datetime
-import random
-from enum import Enum
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from archive import GameArchive
+import compact
+from engine import RiderType, create_new_game, get_layout
+from executor import GameExecutor, Overloaded
+from game_cache import GameCache, utcnow
+from history import GameHistory
+import mcts
+from mcts import MCTSBot
+from ownership import GameOwnership, OwnerRouting
+import metrics
+from transposition import shared_table
+from realtime import GameHub
+import tracks
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection, with a pool of up to MONGO_MAX_POOL_SIZE connections per
+# worker; requests wait up to MONGO_POOL_WAIT_MS for one before failing
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+    maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_MS', '0')) or None,
+    waitQueueTimeoutMS=int(os.environ.get('MONGO_POOL_WAIT_MS', '0')) or None,
+)
 db = client[os.environ['DB_NAME']]
 
+# AI teams search for up to this many milliseconds per turn, 0 for the heuristic AI
+ai_budget_ms = float(os.environ.get('AI_TIME_BUDGET_MS', '30'))
+bot = MCTSBot(budget_ms=ai_budget_ms) if ai_budget_ms > 0 else None
+# Cards found by the search, shared by all the games of this process
+shared_table.max_entries = int(os.environ.get('AI_MEMO_SIZE', '50000'))
+
+# AI searches run in this many processes (0 for a worker thread), one request at a time changes a game
+ai_processes = int(os.environ.get('AI_PROCESSES', '1')) if bot is not None else 0
+executor = GameExecutor(max_pending=int(os.environ.get('GAME_WORK_QUEUE', '64')), processes=ai_processes,
+                        initializer=mcts.start_search_process, initargs=(ai_budget_ms, shared_table.max_entries))
+# Latest search counters of each search process, by process id, for the AI stats
+search_counters: Dict[int, Dict[str, int]] = {}
+
+# WebSocket subscribers of each game
+hub = GameHub()
+
+# Every action taken, to replay or rewind games
+history = GameHistory(
+    db.flamme_rouge_events,
+    db.flamme_rouge_snapshots,
+    snapshot_every=int(os.environ.get('GAME_SNAPSHOT_EVERY', '10')),
+)
+
+async def load_stored_track(track_id: str):
+    """Register a custom track another worker added since this one started"""
+    doc = await db.flamme_rouge_tracks.find_one({"id": track_id}, {"_id": 0, "id": 0})
+    if doc is not None:
+        tracks.add_track(tracks.parse_track(doc))
+
+# Live games, written back to MongoDB in batches
+games = GameCache(
+    db.flamme_rouge_games,
+    max_games=int(os.environ.get('GAME_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('GAME_CACHE_TTL', '1800')),
+    flush_interval=float(os.environ.get('GAME_CACHE_FLUSH_INTERVAL', '1.0')),
+    log_collection=db.flamme_rouge_logs,
+    on_rebase=hub.resync,
+    bot=bot,
+    history=history,
+    load_track=load_stored_track,
+    archive_collection=db.flamme_rouge_archived_games,
+)
+
+# Finished games idle for GAME_ARCHIVE_AFTER seconds move to the archive
+# collection, checked every GAME_ARCHIVE_INTERVAL seconds; 0 to keep them
+archive_after = float(os.environ.get('GAME_ARCHIVE_AFTER', '86400'))
+archive = GameArchive(
+    db.flamme_rouge_games,
+    db.flamme_rouge_archived_games,
+    after=archive_after,
+    interval=float(os.environ.get('GAME_ARCHIVE_INTERVAL', '3600')),
+) if archive_after > 0 else None
+
+# With several workers, each game is served by the one holding its lease and
+# the others forward its requests there: WORKER_ADDRESS is the base URL the
+# other workers reach this one at, unset for a single process.  WORKER_SECRET,
+# the same for every worker, marks the requests they forward to each other
+worker_address = os.environ.get('WORKER_ADDRESS')
+ownership = GameOwnership(
+    db.flamme_rouge_leases,
+    os.environ.get('WORKER_ID', f"{socket.gethostname()}-{os.getpid()}"),
+    worker_address,
+    ttl=float(os.environ.get('GAME_LEASE_TTL', '15')),
+    on_lost=games.evict,
+    secret=os.environ.get('WORKER_SECRET') or None,
+) if worker_address else None
+
+# Counters and latency histograms at /api/metrics, METRICS_ENABLED=0 to turn them off
+metrics.registry.enabled = os.environ.get('METRICS_ENABLED', '1') != '0'
+GAMES_CREATED = metrics.counter("flamme_rouge_games_created_total", "Games created")
+TURNS_PROCESSED = metrics.counter("flamme_rouge_turns_processed_total", "Turns processed")
+SERIALIZE_TIME = metrics.histogram(
+    "flamme_rouge_phase_seconds", "Seconds spent in each phase of a turn", phase="serialize")
+metrics.gauge_callback(
+    "flamme_rouge_game_cache", "Live game cache counters, see /api/flamme-rouge/cache-stats",
+    lambda: {(("stat", key),): value for key, value in games.stats().items()},
+)
+
+class CardSelection(BaseModel):
+    rider_id: str
+    card_id: str
+
+class TurnRequest(BaseModel):
+    """Cards played by any number of riders, and whether to resolve the turn"""
+    selections: List[CardSelection] = []
+    resolve: bool = True
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Game Models
-class CardType(str, Enum):
-    SPRINTEUR = "sprinteur"
-    ROULEUR = "rouleur"
-    FATIGUE = "fatigue"
-
-class TerrainType(str, Enum):
-    NORMAL = "normal"
-    COBBLESTONE = "cobblestone"
-    MOUNTAIN = "mountain"
-    DOWNHILL = "downhill"
-    FINISH = "finish"
-    START = "start"
-
-class WeatherType(str, Enum):
-    NONE = "none"
-    HEADWIND = "headwind"
-    TAILWIND = "tailwind"
-    CROSSWIND = "crosswind"
-
-class RiderType(str, Enum):
-    HUMAN = "human"
-    AI_BOT = "ai_bot"
-
-class GamePhase(str, Enum):
-    CARD_SELECTION = "card_selection"
-    MOVEMENT = "movement"
-    SLIPSTREAM = "slipstream"
-    FATIGUE = "fatigue"
-    GAME_OVER = "game_over"
-
-class Card(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    type: CardType
-    value: int
-    description: Optional[str] = None
-
-class TrackTile(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    position: int  # Track position (0-based)
-    terrain: TerrainType = TerrainType.NORMAL
-    lanes: int = 2  # Usually 2, can be 1 for narrow sections
-    weather: WeatherType = WeatherType.NONE
-    
-class Position(BaseModel):
-    track_position: int
-    lane: int  # 0 or 1 for left/right lane
-    
-class Rider(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    color: str
-    team_id: str
-    rider_type: RiderType
-    position: Position
-    hand: List[Card] = []
-    played_card: Optional[Card] = None
-    fatigue_count: int = 0
-    finished: bool = False
-    finish_position: Optional[int] = None
-
-class Team(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    riders: List[Rider] = []
-    sprinteur_deck: List[Card] = []
-    rouleur_deck: List[Card] = []
-    fatigue_deck: List[Card] = []
-    sprinteur_discard: List[Card] = []
-    rouleur_discard: List[Card] = []
-
-class Track(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    tiles: List[TrackTile] = []
-    length: int
-
-class GameState(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    teams: List[Team] = []
-    track: Track
-    current_turn: int = 1
-    current_phase: GamePhase = GamePhase.CARD_SELECTION
-    active_team_index: int = 0
-    weather: WeatherType = WeatherType.NONE
-    finished_riders: List[str] = []  # Rider IDs in order of finish
-    game_log: List[str] = []
-
-# Game Logic Class
-class FlammeRougeEngine:
-    def __init__(self):
-        pass
-    
-    @staticmethod
-    def create_default_sprinteur_deck() -> List[Card]:
-        """Create standard Sprinteur deck: 2,2,2,3,3,3,4,4,5,9"""
-        deck = []
-        values = [2,2,2,3,3,3,4,4,5,9]
-        for value in values:
-            deck.append(Card(type=CardType.SPRINTEUR, value=value, description=f"Sprinteur {value}"))
-        return deck
-    
-    @staticmethod
-    def create_default_rouleur_deck() -> List[Card]:
-        """Create standard Rouleur deck: 3,3,3,4,4,4,5,5,6,7"""
-        deck = []
-        values = [3,3,3,4,4,4,5,5,6,7]
-        for value in values:
-            deck.append(Card(type=CardType.ROULEUR, value=value, description=f"Rouleur {value}"))
-        return deck
-    
-    @staticmethod
-    def create_fatigue_deck() -> List[Card]:
-        """Create fatigue deck: multiple 2-value fatigue cards"""
-        deck = []
-        for i in range(20):  # Plenty of fatigue cards
-            deck.append(Card(type=CardType.FATIGUE, value=2, description="Fatigue"))
-        return deck
-    
-    @staticmethod
-    def create_sample_track() -> Track:
-        """Create 'The Peaks' inspired track"""
-        tiles = []
-        # Start area (positions 0-2)
-        for i in range(3):
-            tiles.append(TrackTile(position=i, terrain=TerrainType.START, lanes=2))
-        
-        # Flat section (positions 3-8)
-        for i in range(3, 9):
-            tiles.append(TrackTile(position=i, terrain=TerrainType.NORMAL, lanes=2))
-        
-        # Mountain climb (positions 9-15)
-        for i in range(9, 16):
-            tiles.append(TrackTile(position=i, terrain=TerrainType.MOUNTAIN, lanes=2))
-        
-        # Downhill (positions 16-20)
-        for i in range(16, 21):
-            tiles.append(TrackTile(position=i, terrain=TerrainType.DOWNHILL, lanes=2))
-        
-        # Final sprint with cobblestones (positions 21-25)
-        for i in range(21, 26):
-            terrain = TerrainType.COBBLESTONE if i in [23, 24] else TerrainType.NORMAL
-            tiles.append(TrackTile(position=i, terrain=terrain, lanes=2))
-        
-        # Finish line (position 26)
-        tiles.append(TrackTile(position=26, terrain=TerrainType.FINISH, lanes=2))
-        
-        return Track(name="The Peaks", tiles=tiles, length=27)
-    
-    @staticmethod
-    def shuffle_deck(deck: List[Card]) -> List[Card]:
-        """Shuffle a deck of cards"""
-        shuffled = deck.copy()
-        random.shuffle(shuffled)
-        return shuffled
-    
-    @staticmethod
-    def draw_cards(team: Team, rider: Rider, count: int = 4):
-        """Draw cards for a rider (2 sprinteur + 2 rouleur by default)"""
-        rider.hand = []
-        
-        # Draw 2 sprinteur cards
-        for _ in range(2):
-            if team.sprinteur_deck:
-                card = team.sprinteur_deck.pop()
-                rider.hand.append(card)
-            elif team.sprinteur_discard:
-                # Reshuffle discard if deck empty
-                team.sprinteur_deck = FlammeRougeEngine.shuffle_deck(team.sprinteur_discard)
-                team.sprinteur_discard = []
-                if team.sprinteur_deck:
-                    card = team.sprinteur_deck.pop()
-                    rider.hand.append(card)
-        
-        # Draw 2 rouleur cards  
-        for _ in range(2):
-            if team.rouleur_deck:
-                card = team.rouleur_deck.pop()
-                rider.hand.append(card)
-            elif team.rouleur_discard:
-                # Reshuffle discard if deck empty
-                team.rouleur_deck = FlammeRougeEngine.shuffle_deck(team.rouleur_discard)
-                team.rouleur_discard = []
-                if team.rouleur_deck:
-                    card = team.rouleur_deck.pop()
-                    rider.hand.append(card)
-    
-    @staticmethod
-    def calculate_movement(card: Card, track_tile: TrackTile, weather: WeatherType) -> int:
-        """Calculate actual movement considering terrain and weather"""
-        base_movement = card.value
-        
-        # Terrain effects
-        if track_tile.terrain == TerrainType.MOUNTAIN:
-            # Mountains: reduce movement for high values
-            if base_movement >= 5:
-                base_movement = max(base_movement - 2, 1)
-        elif track_tile.terrain == TerrainType.DOWNHILL:
-            # Downhills: bonus movement
-            base_movement += 1
-        elif track_tile.terrain == TerrainType.COBBLESTONE:
-            # Cobblestones: slightly reduce movement
-            base_movement = max(base_movement - 1, 1)
-        
-        # Weather effects
-        if weather == WeatherType.HEADWIND:
-            base_movement = max(base_movement - 1, 1)
-        elif weather == WeatherType.TAILWIND:
-            base_movement += 1
-        elif weather == WeatherType.CROSSWIND:
-            # Crosswind: randomize lanes more
-            pass
-        
-        return base_movement
-    
-    @staticmethod
-    def get_riders_at_position(track_position: int, all_riders: List[Rider]) -> List[Rider]:
-        """Get all riders at a specific track position"""
-        return [r for r in all_riders if r.position.track_position == track_position and not r.finished]
-    
-    @staticmethod
-    def check_slipstream(rider: Rider, all_riders: List[Rider]) -> bool:
-        """Check if rider is in slipstream (directly behind another rider)"""
-        # Check if there's a rider directly in front
-        riders_in_front = [r for r in all_riders 
-                          if r.position.track_position == rider.position.track_position + 1 
-                          and not r.finished]
-        return len(riders_in_front) > 0
-    
-    @staticmethod
-    def move_rider(rider: Rider, movement: int, track: Track, all_riders: List[Rider]) -> List[str]:
-        """Move a rider and handle collisions/blocking"""
-        log = []
-        current_pos = rider.position.track_position
-        target_pos = min(current_pos + movement, track.length - 1)
-        
-        # Check for available lanes at target position
-        for pos in range(current_pos + 1, target_pos + 1):
-            riders_at_pos = FlammeRougeEngine.get_riders_at_position(pos, all_riders)
-            
-            if len(riders_at_pos) >= track.tiles[pos].lanes:
-                # Position blocked, stop here
-                target_pos = pos - 1
-                log.append(f"{rider.name} blocked at position {pos}")
-                break
-        
-        # Find available lane at target position
-        riders_at_target = FlammeRougeEngine.get_riders_at_position(target_pos, all_riders)
-        available_lanes = []
-        for lane in range(track.tiles[target_pos].lanes):
-            if not any(r.position.lane == lane for r in riders_at_target):
-                available_lanes.append(lane)
-        
-        if available_lanes:
-            rider.position.track_position = target_pos
-            rider.position.lane = random.choice(available_lanes)
-            log.append(f"{rider.name} moves to position {target_pos}, lane {rider.position.lane}")
-        else:
-            log.append(f"{rider.name} cannot move, no available lanes")
-        
-        # Check if finished
-        if rider.position.track_position >= track.length - 1:
-            rider.finished = True
-            log.append(f"{rider.name} finished the race!")
-        
-        return log
-    
-    @staticmethod
-    def ai_select_card(rider: Rider, track: Track, all_riders: List[Rider]) -> Card:
-        """Simple AI card selection logic"""
-        if not rider.hand:
-            return None
-        
-        current_pos = rider.position.track_position
-        distance_to_finish = track.length - current_pos
-        
-        # Simple strategy: 
-        # - Use high cards when far from finish
-        # - Use medium cards in mountains  
-        # - Use low cards when close to finish
-        
-        if distance_to_finish > 15:
-            # Far from finish: prefer higher cards
-            best_card = max(rider.hand, key=lambda c: c.value)
-        elif current_pos < track.length and track.tiles[current_pos].terrain == TerrainType.MOUNTAIN:
-            # In mountains: prefer medium cards
-            medium_cards = [c for c in rider.hand if 3 <= c.value <= 5]
-            best_card = medium_cards[0] if medium_cards else min(rider.hand, key=lambda c: c.value)
-        else:
-            # Default: pick middle value card
-            sorted_hand = sorted(rider.hand, key=lambda c: c.value)
-            best_card = sorted_hand[len(sorted_hand) // 2]
-        
-        return best_card
-
-# Game Management Functions
-def create_new_game(team_names: List[str], track_name: str = "The Peaks") -> GameState:
-    """Create a new game with specified teams"""
-    engine = FlammeRougeEngine()
-    
-    # Create track
-    track = engine.create_sample_track()
-    
-    # Create teams
-    teams = []
-    colors = ["red", "blue", "green", "yellow", "purple", "orange"]
-    
-    for i, team_name in enumerate(team_names):
-        team = Team(name=team_name)
-        
-        # Create riders for team (2 riders per team)
-        rider_names = [f"{team_name} Sprinteur", f"{team_name} Rouleur"] 
-        for j, rider_name in enumerate(rider_names):
-            rider = Rider(
-                name=rider_name,
-                color=colors[i % len(colors)],
-                team_id=team.id,
-                rider_type=RiderType.HUMAN if i == 0 else RiderType.AI_BOT,  # First team human, others AI
-                position=Position(track_position=0, lane=j % 2)  # Start in different lanes
-            )
-            team.riders.append(rider)
-        
-        # Create decks
-        team.sprinteur_deck = engine.shuffle_deck(engine.create_default_sprinteur_deck())
-        team.rouleur_deck = engine.shuffle_deck(engine.create_default_rouleur_deck())
-        team.fatigue_deck = engine.create_fatigue_deck()
-        
-        # Draw initial hands
-        for rider in team.riders:
-            engine.draw_cards(team, rider)
-        
-        teams.append(team)
-    
-    game_state = GameState(
-        teams=teams,
-        track=track,
-        current_turn=1,
-        current_phase=GamePhase.CARD_SELECTION
-    )
-    
-    return game_state
-
 # API Endpoints
 @api_router.post("/flamme-rouge/new-game")
-async def create_game(team_names: List[str] = ["Human Team", "AI Team 1", "AI Team 2"]):
+async def create_game(team_names: List[str] = ["Human Team", "AI Team 1", "AI Team 2"],
+                      track_name: str = "The Peaks"):
     """Create a new Flamme Rouge game"""
     try:
-        game_state = create_new_game(team_names)
-        
-        # Save to database
-        await db.flamme_rouge_games.insert_one(game_state.dict())
+        try:
+            game_state = create_new_game(team_names, track_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # Save to database, the track as a reference to its layout
+        game_doc = game_state.dict()
+        game_doc["updated_at"] = utcnow()
+        await db.flamme_rouge_games.insert_one(game_doc)
+        game = compact.from_document(game_doc)
+        await history.record_created(game)
+        if ownership is not None:
+            await ownership.claim(game.id)
+        games.add(game)
+        GAMES_CREATED.inc()
         
         return {
             "status": "success",
             "game_id": game_state.id,
-            "game_state": game_state
+            "game_state": game_view(game, None),
+            # The viewer of each human team, only ever sent here
+            "tokens": {team.id: team.token for team in game_state.teams
+                       if any(rider.rider_type == RiderType.HUMAN for rider in team.riders)},
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/flamme-rouge/tracks")
+async def list_tracks():
+    """Tracks a game can be created on"""
+    return {"status": "success", "tracks": [layout.reference() for layout in tracks.all_tracks()]}
+
+@api_router.get("/flamme-rouge/tracks/{track_id}")
+async def get_track(track_id: str):
+    """Tiles and definition of a track; ids are content hashes, so never stale"""
+    layout = get_layout(track_id)
+    if layout is None:
+        raise HTTPException(status_code=404, detail="Track not found")
+    track = layout.reference()
+    track["tiles"] = [tile.dict() for tile in layout.tiles]
+    track["segments"] = tracks.to_definition(layout)["segments"]
+    return JSONResponse({"status": "success", "track": track},
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@api_router.post("/flamme-rouge/tracks")
+async def create_track(definition: dict = Body(...)):
+    """Add a custom track, see ``tracks`` for the definition format"""
+    try:
+        layout = tracks.add_track(tracks.parse_track(definition))
+    except tracks.TrackDefinitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.flamme_rouge_tracks.update_one(
+        {"id": layout.id}, {"$setOnInsert": {"id": layout.id, **tracks.to_definition(layout)}}, upsert=True)
+    return {"status": "success", "track": layout.reference()}
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+VIEWER_QUERY = Query(None, description="Team token from new-game: what its players may see, a spectator's "
+                                        "view without one (see compact.to_view)")
+
+def viewer_team(game: compact.CompactGame, viewer: Optional[str]) -> Optional[str]:
+    """The id of the team whose token is ``viewer``, None for a spectator
+
+    Team ids are in every view, so only the secret token, which new-game
+    hands to the team's players, shows a team's hands.
+    """
+    if viewer is None:
+        return None
+    for team_id, token in zip(game.team_ids, game.team_tokens):
+        if token is not None and hmac.compare_digest(token, viewer):
+            return team_id
+    raise HTTPException(status_code=404, detail="Team not found")
+
+def check_riders(game: compact.CompactGame, team_id: Optional[str], rider_ids: List[str]):
+    """Players select cards for their own team's riders only"""
+    if team_id is None:
+        raise HTTPException(status_code=403, detail="Pass your team's token as viewer")
+    for rider_id in rider_ids:
+        rider = compact.find_rider(game, rider_id)
+        # Unknown riders are the action's to reject
+        if rider is not None and game.team_ids[game.rider_team[rider]] != team_id:
+            raise HTTPException(status_code=403, detail="Rider of another team")
+
+def game_view(game: compact.CompactGame, viewer: Optional[str], fields=None) -> dict:
+    """The state of the game as ``viewer`` sees it, as a spectator does without one"""
+    with SERIALIZE_TIME.time():
+        return compact.to_view(game, viewer, fields)
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Whether ``If-None-Match`` names ``etag``, compared weakly"""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def encoded(request: Request, content: dict, headers: dict) -> Response:
+    """JSON, or MessagePack if the client accepts it"""
+    accept = request.headers.get("accept", "")
+    if any(media_type in accept for media_type in MSGPACK_TYPES):
+        return Response(msgpack.packb(content), media_type="application/msgpack", headers=headers)
+    return ORJSONResponse(content, headers=headers)
+
 @api_router.get("/flamme-rouge/game/{game_id}")
-async def get_game(game_id: str):
-    """Get current game state"""
+async def get_game(game_id: str, request: Request,
+                   fields: Optional[str] = Query(None, description="Comma separated keys of the game state"),
+                   viewer: Optional[str] = VIEWER_QUERY):
+    """Get current game state
+
+    Answers 304 when ``If-None-Match`` has the game's ``ETag``, which changes
+    with every action.  The state is the view of ``viewer`` (a spectator's
+    without one), ``fields`` narrows it down, and MongoDB builds it when the
+    game is not cached; ``Accept: application/msgpack`` encodes the state as
+    MessagePack.
+    """
     try:
-        game_doc = await db.flamme_rouge_games.find_one({"id": game_id})
-        if not game_doc:
-            raise HTTPException(status_code=404, detail="Game not found")
-        
-        # Remove MongoDB ObjectId for JSON serialization
-        if "_id" in game_doc:
-            del game_doc["_id"]
-        
-        return {"status": "success", "game_state": game_doc}
+        wanted = None
+        if fields is not None:
+            wanted = {field for field in fields.split(",") if field}
+            unknown = wanted.difference(compact.VIEW_FIELDS)
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        
+        stored = None
+        if games.peek(game_id) is None:
+            if wanted is not None and "teams" not in wanted and wanted <= compact.STORED_FIELDS:
+                stored = await games.find_fields(game_id, wanted)
+            else:
+                stored = await games.find_view(game_id, viewer, wanted)
+                if stored is not None and not stored.pop("viewer") and viewer is not None:
+                    raise HTTPException(status_code=404, detail="Team not found")
+                if stored is not None and "track" in stored and get_layout(stored["track"].get("id")) is None:
+                    # Stored before games referred to their track, load it to migrate it
+                    stored = None
+        if stored is not None:
+            etag = compact.etag(stored.get("revision", 0))
+            game_doc = {key: value for key, value in stored.items() if wanted is None or key in wanted}
+        else:
+            game = await games.get(game_id)
+            if game is None:
+                raise HTTPException(status_code=404, detail="Game not found")
+            team_id = viewer_team(game, viewer)
+            etag = compact.etag(game.revision)
+            game_doc = None
+        
+        # Clients revalidate every time, a 304 costs no serialization
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+        if not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        if game_doc is None:
+            game_doc = game_view(game, team_id, wanted)
+        return encoded(request, {"status": "success", "game_state": game_doc}, headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def choose_ai_cards(game_id: str, game: compact.CompactGame) -> Tuple[compact.CompactGame, Optional[tuple]]:
+    """The AI's cards as an action of their own, so a replay needs no search
+
+    The search runs on the executor and changes nothing; returns the game the
+    cards were chosen on, the cached one, which a rebase may have replaced
+    meanwhile.
+    """
+    for _ in range(3):
+        if bot is None:
+            return game, compact.ai_cards_action(game)
+        if executor.processes:
+            # Only plain data crosses over to the search process
+            choices, pid, search_counters[pid] = await executor.run(
+                mcts.search_in_process, mcts.plan_decisions(game))
+            ai_action = compact.ai_cards_action(game, mcts.Decided(choices))
+        else:
+            ai_action = await executor.run(compact.ai_cards_action, game, bot)
+        current = await games.get(game_id)
+        if current is None:
+            raise HTTPException(status_code=404, detail="Game not found")
+        if current is game:
+            return game, ai_action
+        game = current
+    raise HTTPException(status_code=409, detail="Game changed during the AI's turn, try again")
+
+def play_ai_action(game: compact.CompactGame, ai_action: Optional[tuple]) -> List[dict]:
+    """Play the cards chosen by ``choose_ai_cards``, if any AI rider had to"""
+    if ai_action is None:
+        return []
+    ops = compact.apply_action(game, ai_action)
+    games.mark_dirty(game, ai_action)
+    return ops
+
 @api_router.post("/flamme-rouge/game/{game_id}/select-card")
-async def select_card(game_id: str, rider_id: str, card_id: str):
+async def select_card(game_id: str, rider_id: str, card_id: str, viewer: Optional[str] = VIEWER_QUERY):
     """Select a card for a rider"""
     try:
-        game_doc = await db.flamme_rouge_games.find_one({"id": game_id})
-        if not game_doc:
-            raise HTTPException(status_code=404, detail="Game not found")
-        
-        game_state = GameState(**game_doc)
-        
-        if game_state.current_phase != GamePhase.CARD_SELECTION:
-            raise HTTPException(status_code=400, detail="Not in card selection phase")
-        
-        # Find rider and card
-        rider = None
-        team = None
-        for t in game_state.teams:
-            for r in t.riders:
-                if r.id == rider_id:
-                    rider = r
-                    team = t
-                    break
-        
-        if not rider:
-            raise HTTPException(status_code=404, detail="Rider not found")
-        
-        # Find and play card
-        card = None
-        for c in rider.hand:
-            if c.id == card_id:
-                card = c
-                break
-        
-        if not card:
-            raise HTTPException(status_code=404, detail="Card not found in hand")
-        
-        # Remove card from hand and set as played
-        rider.hand.remove(card)
-        rider.played_card = card
-        
-        # Add to appropriate discard pile
-        if card.type == CardType.SPRINTEUR:
-            team.sprinteur_discard.append(card)
-        elif card.type == CardType.ROULEUR:
-            team.rouleur_discard.append(card)
-        
-        game_state.game_log.append(f"{rider.name} played {card.type} {card.value}")
-        
-        # Check if all riders have selected cards
-        all_selected = all(r.played_card is not None for team in game_state.teams for r in team.riders if not r.finished)
-        
-        if all_selected:
-            game_state.current_phase = GamePhase.MOVEMENT
-        
-        # Update database
-        await db.flamme_rouge_games.update_one(
-            {"id": game_id},
-            {"$set": game_state.dict()}
-        )
-        
-        return {"status": "success", "game_state": game_state}
+        async with executor.game(game_id):
+            game = await games.get(game_id)
+            if game is None:
+                raise HTTPException(status_code=404, detail="Game not found")
+            team_id = viewer_team(game, viewer)
+            check_riders(game, team_id, [rider_id])
+            
+            action = compact.select_card_action(rider_id, card_id)
+            try:
+                ops = compact.apply_action(game, action)
+            except compact.ActionRejected as e:
+                raise HTTPException(status_code=e.status_code, detail=e.detail)
+            
+            # Written back to the database by the cache
+            games.mark_dirty(game, action)
+            hub.publish(game, ops)
+            
+            return {"status": "success", "game_state": game_view(game, team_id)}
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/flamme-rouge/game/{game_id}/process-turn")
-async def process_turn(game_id: str):
+async def process_turn(game_id: str, viewer: Optional[str] = VIEWER_QUERY):
     """Process movement, slipstream, and fatigue phases"""
     try:
-        game_doc = await db.flamme_rouge_games.find_one({"id": game_id})
-        if not game_doc:
-            raise HTTPException(status_code=404, detail="Game not found")
-        
-        game_state = GameState(**game_doc)
-        engine = FlammeRougeEngine()
-        
-        # Auto-select cards for AI riders
-        for team in game_state.teams:
-            for rider in team.riders:
-                if rider.rider_type == RiderType.AI_BOT and not rider.played_card and not rider.finished:
-                    card = engine.ai_select_card(rider, game_state.track, 
-                                               [r for t in game_state.teams for r in t.riders])
-                    if card:
-                        rider.hand.remove(card)
-                        rider.played_card = card
-                        if card.type == CardType.SPRINTEUR:
-                            team.sprinteur_discard.append(card)
-                        elif card.type == CardType.ROULEUR:
-                            team.rouleur_discard.append(card)
-                        game_state.game_log.append(f"{rider.name} (AI) played {card.type} {card.value}")
-        
-        # Movement phase
-        if game_state.current_phase == GamePhase.MOVEMENT:
-            all_riders = [r for team in game_state.teams for r in team.riders if not r.finished]
-            
-            # Sort by initiative (card value descending, then random)
-            def get_initiative(rider):
-                return (rider.played_card.value if rider.played_card else 0, random.random())
-            
-            all_riders.sort(key=get_initiative, reverse=True)
-            
-            for rider in all_riders:
-                if rider.played_card:
-                    current_tile = game_state.track.tiles[rider.position.track_position]
-                    movement = engine.calculate_movement(rider.played_card, current_tile, game_state.weather)
-                    log = engine.move_rider(rider, movement, game_state.track, all_riders)
-                    game_state.game_log.extend(log)
+        async with executor.game(game_id):
+            game = await games.get(game_id)
+            if game is None:
+                raise HTTPException(status_code=404, detail="Game not found")
+            team_id = viewer_team(game, viewer)
             
-            game_state.current_phase = GamePhase.SLIPSTREAM
-        
-        # Slipstream phase
-        if game_state.current_phase == GamePhase.SLIPSTREAM:
-            all_riders = [r for team in game_state.teams for r in team.riders if not r.finished]
+            game, ai_action = await choose_ai_cards(game_id, game)
+            ops = play_ai_action(game, ai_action)
+            action = compact.process_turn_action(game)
+            ops += compact.apply_action(game, action, bot=bot)
+
+            # Written back to the database by the cache
+            games.mark_dirty(game, action)
+            hub.publish(game, ops)
+            TURNS_PROCESSED.inc()
             
-            for rider in all_riders:
-                # Check slipstream and move forward if applicable
-                riders_in_front = [r for r in all_riders 
-                                 if r.position.track_position == rider.position.track_position + 1]
-                
-                if riders_in_front:
-                    # Move to slipstream position
-                    target_pos = rider.position.track_position + 1
-                    riders_at_target = engine.get_riders_at_position(target_pos, all_riders)
-                    
-                    if len(riders_at_target) < game_state.track.tiles[target_pos].lanes:
-                        available_lanes = []
-                        for lane in range(game_state.track.tiles[target_pos].lanes):
-                            if not any(r.position.lane == lane for r in riders_at_target):
-                                available_lanes.append(lane)
-                        
-                        if available_lanes:
-                            rider.position.track_position = target_pos
-                            rider.position.lane = random.choice(available_lanes)
-                            game_state.game_log.append(f"{rider.name} slipstreams forward")
+            return {"status": "success", "game_state": game_view(game, team_id)}
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/flamme-rouge/game/{game_id}/turn")
+async def play_turn(game_id: str, turn: TurnRequest, viewer: Optional[str] = VIEWER_QUERY):
+    """Select the cards of several riders, then process the turn unless ``resolve`` is false
+
+    One request instead of a ``select-card`` per rider and a ``process-turn``:
+    the selections land all together or not at all, and the game is written
+    back once.
+    """
+    try:
+        async with executor.game(game_id):
+            game = await games.get(game_id)
+            if game is None:
+                raise HTTPException(status_code=404, detail="Game not found")
+            team_id = viewer_team(game, viewer)
+            if not turn.selections and not turn.resolve:
+                raise HTTPException(status_code=400, detail="Nothing to do")
+            if turn.selections:
+                check_riders(game, team_id, [selection.rider_id for selection in turn.selections])
             
-            game_state.current_phase = GamePhase.FATIGUE
-        
-        # Fatigue phase
-        if game_state.current_phase == GamePhase.FATIGUE:
-            all_riders = [r for team in game_state.teams for r in team.riders if not r.finished]
+            if turn.resolve:
+                # Chosen before anything changes: when the search fails, the
+                # selections have not landed and the request can be retried
+                game, ai_action = await choose_ai_cards(game_id, game)
             
-            for team in game_state.teams:
-                for rider in team.riders:
-                    if not rider.finished:
-                        # Check if rider gets fatigue (not in slipstream)
-                        in_slipstream = engine.check_slipstream(rider, all_riders)
-                        
-                        if not in_slipstream and team.fatigue_deck:
-                            fatigue_card = team.fatigue_deck.pop()
-                            rider.hand.append(fatigue_card)
-                            rider.fatigue_count += 1
-                            game_state.game_log.append(f"{rider.name} receives fatigue card")
-                        
-                        # Clear played card
-                        rider.played_card = None
-                        
-                        # Draw new cards
-                        engine.draw_cards(team, rider)
+            ops = []
+            if turn.selections:
+                action = compact.select_cards_action(
+                    game, [(selection.rider_id, selection.card_id) for selection in turn.selections])
+                try:
+                    ops += compact.apply_action(game, action)
+                except compact.ActionRejected as e:
+                    raise HTTPException(status_code=e.status_code, detail=e.detail)
+                games.mark_dirty(game, action)
+            if turn.resolve:
+                ops += play_ai_action(game, ai_action)
+                action = compact.process_turn_action(game)
+                ops += compact.apply_action(game, action, bot=bot)
+                games.mark_dirty(game, action)
+                TURNS_PROCESSED.inc()
+
+            # Written back to the database by the cache, in one write
+            hub.publish(game, ops)
             
-            # Check win condition
-            finished_riders = [r for team in game_state.teams for r in team.riders if r.finished]
-            if finished_riders:
-                game_state.current_phase = GamePhase.GAME_OVER
-                for i, rider in enumerate(finished_riders):
-                    if rider.finish_position is None:
-                        rider.finish_position = i + 1
-                        game_state.finished_riders.append(rider.id)
-            else:
-                game_state.current_phase = GamePhase.CARD_SELECTION
-                game_state.current_turn += 1
-        
-        # Update database
-        await db.flamme_rouge_games.update_one(
-            {"id": game_id},
-            {"$set": game_state.dict()}
-        )
+            return {"status": "success", "game_state": game_view(game, team_id)}
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/flamme-rouge/game/{game_id}/log")
+async def get_game_log(game_id: str, since: int = -1, limit: int = Query(100, ge=1, le=500)):
+    """Game log entries after the ``since`` cursor, oldest first"""
+    try:
+        game = await games.get(game_id)
+        if game is None:
+            raise HTTPException(status_code=404, detail="Game not found")
         
-        return {"status": "success", "game_state": game_state}
+        entries = await games.log_entries(game, since, limit)
+        return {
+            "status": "success",
+            "entries": entries,
+            # Pass back as ``since`` for the next page
+            "next": entries[-1]["seq"] if entries else since,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/flamme-rouge/game/{game_id}/history")
+async def get_game_history(game_id: str, turn: Optional[int] = Query(None, ge=1),
+                           version: Optional[int] = Query(None, ge=0), viewer: Optional[str] = VIEWER_QUERY):
+    """The game at the start of a past turn, or as of a past version
+
+    Replays written actions only, the history lags the game by up to the
+    cache's flush interval.
+    """
+    if (turn is None) == (version is None):
+        raise HTTPException(status_code=400, detail="Pass either turn or version")
+    try:
+        game = await history.rewind(game_id, turn=turn, version=version)
+        if game is None:
+            raise HTTPException(status_code=404, detail="No such turn in the game's history")
+        team_id = viewer_team(game, viewer)
+        
+        return {"status": "success", "game_state": game_view(game, team_id)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.websocket("/flamme-rouge/game/{game_id}/ws")
+async def game_updates(websocket: WebSocket, game_id: str, viewer: Optional[str] = None):
+    """A snapshot of the game as ``viewer`` sees it, then the JSON Patch of every action taken on it"""
+    game = await games.get(game_id)
+    try:
+        team_id = None if game is None else viewer_team(game, viewer)
+    except HTTPException:
+        game = None
+    if game is None:
+        # Policy violation, the closest WebSocket code to a 404
+        await websocket.close(code=1008)
+        return
+    await hub.serve(websocket, game, team_id)
+
+@api_router.get("/flamme-rouge/cache-stats")
+async def cache_stats():
+    """Hit, miss and eviction counters of the live game cache"""
+    return games.stats()
+
+@api_router.get("/flamme-rouge/ai-stats")
+async def ai_stats():
+    """Search counters of the AI and the hit rate of its memo, summed over the search processes"""
+    if bot is None:
+        return {}
+    totals = Counter(bot.counters())
+    for counters in search_counters.values():
+        totals.update(counters)
+    return {**mcts.search_stats(totals), "processes": len(search_counters)}
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Counters and histograms in the Prometheus text format"""
+    if not metrics.registry.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+if ownership is not None:
+    app.add_middleware(OwnerRouting, ownership=ownership, exists=games.exists)
+    metrics.gauge_callback("flamme_rouge_ownership", "Game leases of this worker",
+                           lambda: {(("stat", key),): value for key, value in ownership.stats().items()})
+
+app.add_middleware(metrics.RequestMetrics, registry=metrics.registry, name="flamme_rouge_request_seconds")
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -600,6 +542,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    # Before anything reads or writes games, so no lookup scans the collection
+    await games.create_indexes()
+    await db.flamme_rouge_tracks.create_index("id", unique=True)
+    if ownership is not None:
+        await ownership.create_indexes()
+
+@app.on_event("startup")
+async def load_custom_tracks():
+    # Games refer to their track by id, register the stored ones before any game loads
+    async for doc in db.flamme_rouge_tracks.find({}, {"_id": 0, "id": 0}):
+        try:
+            tracks.add_track(tracks.parse_track(doc))
+        except tracks.TrackDefinitionError as e:
+            logger.warning("Skipping stored track %r: %s", doc.get("name"), e)
+
+@app.on_event("startup")
+async def start_game_cache():
+    games.start()
+    if archive is not None:
+        archive.start(games.game_ids)
+    if ownership is not None:
+        ownership.start(games.game_ids)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if archive is not None:
+        await archive.close()
+    await games.close()
+    # Once the games are written, for the next worker to load them as they are
+    if ownership is not None:
+        await ownership.close()
+    executor.close()
     client.close()
\ No newline at end of file
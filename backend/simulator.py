@@ -0,0 +1,512 @@
+"""Headless race simulator.
+
+Runs complete races in-process with the rules of ``FlammeRougeEngine`` but
+without Mongo, Pydantic models or log strings in the loop.  Riders, hands and
+decks are plain ints and lists so that a whole race costs a few hundred
+microseconds.  Given the same seed, ``simulate_race`` consumes the random
+generator in exactly the same order as ``create_new_game`` followed by
+repeated ``FlammeRougeEngine.process_turn`` calls on an all-AI game, so both
+produce the same race.
+
+``run_parallel`` spreads a batch over a process pool.  Every race is seeded
+from the master seed and its index in the batch, so the aggregate is the same
+whatever the number of workers.
+
+Usage::
+
+    python simulator.py --races 100000 --teams 3 --seed 1 --workers 8
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Union
+import argparse
+import os
+import random
+import time
+
+from engine import (
+    FlammeRougeEngine, TERRAINS, Track, TrackTables, TerrainType, WeatherType, tables_for,
+    SPRINTEUR_VALUES, ROULEUR_VALUES, FATIGUE_DECK_SIZE,
+)
+
+RIDERS_PER_TEAM = 2
+MAX_TURNS = 200
+# Once every rider is out of cards or boxed in, no turn ever moves anyone again
+STALL_TURNS = 3
+
+# Cards are small ints: the low nibble is the value, bit 4 marks a rouleur card
+ROULEUR_BIT = 16
+VALUE_MASK = 15
+
+TeamsArg = Union[int, Sequence[str]]
+# A policy gets the race and a rider index and returns an index into its hand
+Policy = Callable[["RaceState", int], int]
+
+
+class CompiledTrack:
+    """Per-position lists for one track layout and weather, from its ``TrackTables``
+
+    ``key`` names the layout and weather by content, the same in every
+    process; a pickled track comes back as the copy the receiving process
+    compiled (``compile_tables``) rather than as a new one.
+    """
+    __slots__ = ("tables", "weather", "key", "length", "lanes", "max_lanes", "mountain", "far", "movement")
+
+    def __init__(self, tables: TrackTables, weather: WeatherType = WeatherType.NONE):
+        self.tables = tables
+        self.weather = weather
+        self.key = (tables.id, weather.value)
+        self.length = tables.length
+        # One extra entry so that "position + 1" lookups never run off the end
+        self.lanes = list(tables.lanes)
+        self.max_lanes = tables.max_lanes
+        self.mountain = [TERRAINS[code] == TerrainType.MOUNTAIN for code in tables.terrain]
+        # Positions where ai_select_card goes for the highest card
+        self.far = [tables.length - pos > 15 for pos in range(tables.length + 1)]
+        # movement[position][card value]
+        row = tables.movement_row(weather)
+        stride = VALUE_MASK + 1
+        self.movement = [list(row[pos * stride:(pos + 1) * stride]) for pos in range(tables.length)]
+
+    def __reduce__(self):
+        return compile_tables, (self.tables, self.weather)
+
+
+_compiled_tracks: Dict[tuple, CompiledTrack] = {}
+
+
+def compile_tables(tables: TrackTables, weather: WeatherType = WeatherType.NONE) -> CompiledTrack:
+    """Compile a layout once per weather, shared by every race on it"""
+    key = (tables.id, weather)
+    compiled = _compiled_tracks.get(key)
+    if compiled is None:
+        compiled = _compiled_tracks[key] = CompiledTrack(tables, weather)
+    return compiled
+
+
+def compile_track(track: Optional[Track] = None, weather: WeatherType = WeatherType.NONE) -> CompiledTrack:
+    """Compile a track once per layout and weather; defaults to 'The Peaks'"""
+    if track is None:
+        track = _sample_track()
+    key = (track.id, weather)
+    compiled = _compiled_tracks.get(key)
+    if compiled is None:
+        compiled = _compiled_tracks[key] = compile_tables(tables_for(track), weather)
+    return compiled
+
+
+_sample: List[Track] = []
+
+
+def _sample_track() -> Track:
+    if not _sample:
+        _sample.append(FlammeRougeEngine.create_sample_track())
+    return _sample[0]
+
+
+class RaceState:
+    """Mutable state of one race, exposed to policies"""
+    __slots__ = (
+        "track", "team_count", "position", "lane", "finished", "hand",
+        "fatigue", "sprinteur_deck", "rouleur_deck", "sprinteur_discard",
+        "rouleur_discard", "fatigue_deck", "occupied", "lane_used", "turn",
+        "idle_turns",
+    )
+
+    def __init__(self, track: CompiledTrack, team_count: int):
+        rider_count = team_count * RIDERS_PER_TEAM
+        self.track = track
+        self.team_count = team_count
+        self.position = [0] * rider_count
+        self.lane = [r % RIDERS_PER_TEAM for r in range(rider_count)]
+        self.finished = [False] * rider_count
+        self.hand: List[List[int]] = [[] for _ in range(rider_count)]
+        self.fatigue = [0] * rider_count
+        self.sprinteur_deck: List[List[int]] = []
+        self.rouleur_deck: List[List[int]] = []
+        self.sprinteur_discard: List[List[int]] = [[] for _ in range(team_count)]
+        self.rouleur_discard: List[List[int]] = [[] for _ in range(team_count)]
+        self.fatigue_deck = [FATIGUE_DECK_SIZE] * team_count
+        # Riders still racing per position and per position * max_lanes + lane,
+        # the equivalent of get_riders_at_position without the scan
+        self.occupied = [0] * (track.length + 1)
+        self.occupied[0] = rider_count
+        self.lane_used = [0] * ((track.length + 1) * track.max_lanes)
+        for l in self.lane:
+            self.lane_used[l] += 1
+        self.turn = 1
+        self.idle_turns = 0
+
+    def copy(self) -> "RaceState":
+        """Independent copy for search, sharing only the immutable track"""
+        race = RaceState.__new__(RaceState)
+        race.track = self.track
+        race.team_count = self.team_count
+        race.position = self.position[:]
+        race.lane = self.lane[:]
+        race.finished = self.finished[:]
+        race.hand = [hand[:] for hand in self.hand]
+        race.fatigue = self.fatigue[:]
+        race.sprinteur_deck = [deck[:] for deck in self.sprinteur_deck]
+        race.rouleur_deck = [deck[:] for deck in self.rouleur_deck]
+        race.sprinteur_discard = [pile[:] for pile in self.sprinteur_discard]
+        race.rouleur_discard = [pile[:] for pile in self.rouleur_discard]
+        race.fatigue_deck = self.fatigue_deck[:]
+        race.occupied = self.occupied[:]
+        race.lane_used = self.lane_used[:]
+        race.turn = self.turn
+        race.idle_turns = self.idle_turns
+        return race
+
+
+@dataclass
+class RaceResult:
+    finish_order: List[int]  # Rider indices, in the order the engine ranks them
+    turns: int
+    fatigue: List[int]  # Fatigue cards received per rider
+    completed: bool = True
+
+    @property
+    def winner_team(self) -> Optional[int]:
+        return self.finish_order[0] // RIDERS_PER_TEAM if self.finish_order else None
+
+
+@dataclass
+class BatchResult:
+    races: int = 0
+    completed: int = 0
+    total_turns: int = 0
+    wins: List[int] = field(default_factory=list)  # First finisher per team
+    finishers: List[int] = field(default_factory=list)  # Riders over the line per team
+    fatigue: List[int] = field(default_factory=list)  # Total fatigue per team
+    turn_histogram: Dict[int, int] = field(default_factory=dict)  # Races per turn count
+    elapsed: float = 0.0
+
+    @classmethod
+    def empty(cls, team_count: int) -> "BatchResult":
+        return cls(wins=[0] * team_count, finishers=[0] * team_count, fatigue=[0] * team_count)
+
+    @property
+    def races_per_second(self) -> float:
+        return self.races / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mean_turns(self) -> float:
+        return self.total_turns / self.races if self.races else 0.0
+
+    def add(self, result: RaceResult):
+        self.races += 1
+        self.total_turns += result.turns
+        self.turn_histogram[result.turns] = self.turn_histogram.get(result.turns, 0) + 1
+        if result.completed:
+            self.completed += 1
+            self.wins[result.winner_team] += 1
+        for rider in result.finish_order:
+            self.finishers[rider // RIDERS_PER_TEAM] += 1
+        for rider, count in enumerate(result.fatigue):
+            self.fatigue[rider // RIDERS_PER_TEAM] += count
+
+    def merge(self, other: "BatchResult"):
+        """Fold another batch of the same setup into this one"""
+        self.races += other.races
+        self.completed += other.completed
+        self.total_turns += other.total_turns
+        for team in range(len(self.wins)):
+            self.wins[team] += other.wins[team]
+            self.finishers[team] += other.finishers[team]
+            self.fatigue[team] += other.fatigue[team]
+        for turns, count in other.turn_histogram.items():
+            self.turn_histogram[turns] = self.turn_histogram.get(turns, 0) + count
+
+    def totals(self) -> dict:
+        """Everything but the timing, for comparing runs"""
+        return {
+            "races": self.races,
+            "completed": self.completed,
+            "total_turns": self.total_turns,
+            "wins": list(self.wins),
+            "finishers": list(self.finishers),
+            "fatigue": list(self.fatigue),
+            "turn_histogram": dict(sorted(self.turn_histogram.items())),
+        }
+
+
+def _randbelow(n: int, getrandbits) -> int:
+    """Random.randbelow, so that the simulator draws exactly what the engine draws"""
+    k = n.bit_length()
+    r = getrandbits(k)
+    while r >= n:
+        r = getrandbits(k)
+    return r
+
+
+def _shuffle(deck: List[int], getrandbits):
+    """Random.shuffle without the per-draw method lookups, same draws and swaps"""
+    for i in range(len(deck) - 1, 0, -1):
+        n = i + 1
+        k = n.bit_length()
+        j = getrandbits(k)
+        while j >= n:
+            j = getrandbits(k)
+        deck[i], deck[j] = deck[j], deck[i]
+
+
+def heuristic_policy(race: RaceState, rider: int) -> int:
+    """Index of the card ``FlammeRougeEngine.ai_select_card`` would play"""
+    values = [card & VALUE_MASK for card in race.hand[rider]]
+    pos = race.position[rider]
+    if race.track.far[pos]:
+        # Far from finish: prefer higher cards
+        return values.index(max(values))
+    if race.track.mountain[pos]:
+        # In mountains: prefer medium cards
+        for i, value in enumerate(values):
+            if 3 <= value <= 5:
+                return i
+        return values.index(min(values))
+    # Default: pick middle value card
+    return sorted(range(len(values)), key=values.__getitem__)[len(values) // 2]
+
+
+def _team_count(teams: TeamsArg) -> int:
+    return teams if isinstance(teams, int) else len(teams)
+
+
+def _take_two(hand: List[int], decks: List[List[int]], discards: List[List[int]], team: int, getrandbits):
+    deck = decks[team]
+    if len(deck) >= 2:
+        hand.append(deck.pop())
+        hand.append(deck.pop())
+        return
+    for _ in range(2):
+        if deck:
+            hand.append(deck.pop())
+        elif discards[team]:
+            # Reshuffle discard if deck empty
+            deck = decks[team] = discards[team]
+            discards[team] = []
+            _shuffle(deck, getrandbits)
+            hand.append(deck.pop())
+
+
+def _draw(race: RaceState, team: int, rider: int, getrandbits):
+    """Same draw order and reshuffle points as FlammeRougeEngine.draw_cards"""
+    hand = race.hand[rider] = []
+    _take_two(hand, race.sprinteur_deck, race.sprinteur_discard, team, getrandbits)
+    _take_two(hand, race.rouleur_deck, race.rouleur_discard, team, getrandbits)
+
+
+_ROULEUR_CARDS = [value | ROULEUR_BIT for value in ROULEUR_VALUES]
+
+
+def new_race(teams: TeamsArg, track: CompiledTrack, rng: random.Random) -> RaceState:
+    """Set up decks and opening hands like ``create_new_game``"""
+    team_count = _team_count(teams)
+    race = RaceState(track, team_count)
+    getrandbits = rng.getrandbits
+    for team in range(team_count):
+        sprinteur = list(SPRINTEUR_VALUES)
+        _shuffle(sprinteur, getrandbits)
+        rouleur = list(_ROULEUR_CARDS)
+        _shuffle(rouleur, getrandbits)
+        race.sprinteur_deck.append(sprinteur)
+        race.rouleur_deck.append(rouleur)
+        for j in range(RIDERS_PER_TEAM):
+            _draw(race, team, team * RIDERS_PER_TEAM + j, getrandbits)
+    return race
+
+
+def play_turn(race: RaceState, rng: random.Random, policies: Optional[Sequence[Optional[Policy]]] = None) -> bool:
+    """Play one full turn, returns True when the race is over"""
+    track = race.track
+    last = track.length - 1
+    lanes = track.lanes
+    movement = track.movement
+    position = race.position
+    lane = race.lane
+    finished = race.finished
+    hands = race.hand
+    occupied = race.occupied
+    lane_used = race.lane_used
+    stride = track.max_lanes
+    getrandbits = rng.getrandbits
+    active = [r for r in range(len(position)) if not finished[r]]
+
+    # Card selection
+    played = [0] * len(position)
+    for r in active:
+        hand = hands[r]
+        if not hand:
+            continue
+        team = r // RIDERS_PER_TEAM
+        policy = policies[team] if policies else None
+        card = hand.pop(policy(race, r) if policy else heuristic_policy(race, r))
+        played[r] = card
+        if card & ROULEUR_BIT:
+            race.rouleur_discard[team].append(card)
+        else:
+            race.sprinteur_discard[team].append(card)
+
+    # Movement phase, by initiative (card value descending, then random)
+    rand = rng.random
+    moved = False
+    for r in sorted(active, key=lambda r: (played[r] & VALUE_MASK, rand()), reverse=True):
+        card = played[r]
+        if not card:
+            continue
+        current = position[r]
+        target = current + movement[current][card & VALUE_MASK]
+        if target > last:
+            target = last
+        for pos in range(current + 1, target + 1):
+            if occupied[pos] >= lanes[pos]:
+                target = pos - 1
+                break
+        base = target * stride
+        free = [l for l in range(lanes[target]) if not lane_used[base + l]]
+        if free:
+            moved = moved or target != current
+            occupied[current] -= 1
+            lane_used[current * stride + lane[r]] -= 1
+            l = free[_randbelow(len(free), getrandbits)]
+            position[r] = target
+            lane[r] = l
+            if target >= last:
+                finished[r] = True
+            else:
+                occupied[target] += 1
+                lane_used[base + l] += 1
+
+    # Slipstream phase, in team order
+    active = [r for r in active if not finished[r]]
+    for r in active:
+        current = position[r]
+        target = current + 1
+        if occupied[target] and occupied[target] < lanes[target]:
+            base = target * stride
+            free = [l for l in range(lanes[target]) if not lane_used[base + l]]
+            if free:
+                moved = True
+                occupied[current] -= 1
+                lane_used[current * stride + lane[r]] -= 1
+                l = free[_randbelow(len(free), getrandbits)]
+                position[r] = target
+                lane[r] = l
+                occupied[target] += 1
+                lane_used[base + l] += 1
+
+    # Fatigue phase
+    fatigue_deck = race.fatigue_deck
+    for r in active:
+        team = r // RIDERS_PER_TEAM
+        if not occupied[position[r] + 1] and fatigue_deck[team]:
+            fatigue_deck[team] -= 1
+            race.fatigue[r] += 1
+        _draw(race, team, r, getrandbits)
+
+    if len(active) < len(position):
+        return True
+    race.turn += 1
+    race.idle_turns = 0 if moved else race.idle_turns + 1
+    return False
+
+
+def simulate_race(teams: TeamsArg = 3, track: Optional[Track] = None, seed: Optional[int] = None,
+                  policies: Optional[Sequence[Optional[Policy]]] = None,
+                  weather: WeatherType = WeatherType.NONE, rng: Optional[random.Random] = None) -> RaceResult:
+    """Play a complete race and return its result.
+
+    ``teams`` is a team count or a list of team names (only the count matters
+    here).  ``policies`` optionally holds one card policy per team, ``None``
+    entries fall back to the engine's heuristic AI.
+    """
+    if rng is None:
+        rng = random.Random(seed)
+    elif seed is not None:
+        rng.seed(seed)
+    race = new_race(teams, compile_track(track, weather), rng)
+    over = False
+    while not over and race.turn <= MAX_TURNS and race.idle_turns < STALL_TURNS:
+        over = play_turn(race, rng, policies)
+    return RaceResult(
+        finish_order=[r for r, done in enumerate(race.finished) if done],
+        turns=race.turn,
+        fatigue=race.fatigue,
+        completed=over,
+    )
+
+
+def race_seed(master_seed: int, index: int) -> int:
+    """Seed of race ``index`` in a batch, independent of how the batch is split"""
+    return (master_seed * 0x9E3779B97F4A7C15 + index) & 0xFFFFFFFFFFFFFFFF
+
+
+def simulate_many(n: int, teams: TeamsArg = 3, track: Optional[Track] = None, seed: int = 0,
+                  policies: Optional[Sequence[Optional[Policy]]] = None,
+                  weather: WeatherType = WeatherType.NONE, start: int = 0) -> BatchResult:
+    """Run races ``start`` to ``start + n`` of a batch and aggregate their results"""
+    team_count = _team_count(teams)
+    compile_track(track, weather)
+    batch = BatchResult.empty(team_count)
+    rng = random.Random()
+    began = time.perf_counter()
+    for index in range(start, start + n):
+        batch.add(simulate_race(team_count, track, race_seed(seed, index), policies, weather, rng))
+    batch.elapsed = time.perf_counter() - began
+    return batch
+
+
+def run_parallel(n: int, team_names: TeamsArg = 3, track: Optional[Track] = None, seed: int = 0,
+                 workers: Optional[int] = None, chunk_size: int = 2000,
+                 policies: Optional[Sequence[Optional[Policy]]] = None,
+                 weather: WeatherType = WeatherType.NONE) -> BatchResult:
+    """Run ``n`` races of a ``create_new_game`` setup on a process pool.
+
+    Work is cut into chunks of consecutive race indices and at most two chunks
+    per worker are in flight, so memory stays flat however large ``n`` is.
+    Chunk results are merged as they complete; the merge only adds counters,
+    so the totals are bit-identical for a given ``seed`` whatever ``workers``
+    and ``chunk_size`` are.  Policies must be picklable (module-level
+    functions).
+    """
+    team_count = _team_count(team_names)
+    workers = workers or os.cpu_count() or 1
+    total = BatchResult.empty(team_count)
+    began = time.perf_counter()
+    if workers == 1:
+        total.merge(simulate_many(n, team_count, track, seed, policies, weather))
+    else:
+        chunks = iter(range(0, n, chunk_size))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for start in chunks:
+                pending.add(pool.submit(simulate_many, min(chunk_size, n - start), team_count,
+                                        track, seed, policies, weather, start))
+                if len(pending) < workers * 2:
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    total.merge(future.result())
+            for future in pending:
+                total.merge(future.result())
+    total.elapsed = time.perf_counter() - began
+    return total
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run headless Flamme Rouge races")
+    parser.add_argument("--races", type=int, default=10000)
+    parser.add_argument("--teams", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="0 for one per core")
+    args = parser.parse_args(argv)
+
+    batch = run_parallel(args.races, args.teams, seed=args.seed, workers=args.workers or None)
+    print(f"{batch.races} races in {batch.elapsed:.3f}s: {batch.races_per_second:,.0f} races/s")
+    print(f"completed {batch.completed}, mean turns {batch.mean_turns:.2f}")
+    for team in range(args.teams):
+        print(f"team {team}: wins {batch.wins[team]}, fatigue {batch.fatigue[team]}")
+
+
+if __name__ == "__main__":
+    main()
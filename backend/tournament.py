@@ -0,0 +1,284 @@
+"""Round-robin tournaments between AI variants, rated with Elo.
+
+Entrants are AI specs: ``heuristic`` (the engine's AI), ``mcts:<ms>`` (an
+``MCTSBot`` with that time budget per decision) or ``mcts:<n>it`` (a fixed
+number of iterations), optionally named ``name=spec``.  Every game seats
+``teams`` different entrants on a track; the schedule cycles through every
+combination of entrants in every seat order (seats are not equal) on every
+track, and game ``i`` plays round ``i % len(rounds)`` with the seed
+``race_seed(seed, i)``.  Games are headless races on the simulator, which
+plays what ``create_new_game`` and ``FlammeRougeEngine`` would, and each
+bot is new to its game: with ``mcts:<n>it`` entrants or the heuristic, a
+tournament plays the same games whatever the workers and interruptions.
+
+Ratings are updated game by game as results come in: the winning team's
+entrant beats each of the others (a pairwise Elo update, K split between
+them) and a race that stalls changes nothing.  Results are applied in game
+order whatever order the workers finish them in, so the state after game
+``i`` is all the checkpoint needs: the tournament config, the next game and
+the counters, written to a JSON file every ``checkpoint_every`` games and
+on the way out.  A run started on an existing checkpoint carries on from
+there; games in flight when it stopped are played again.
+
+Usage::
+
+    python tournament.py heuristic mcts:5 mcts:30 --games 100000 --workers 0 \\
+        --checkpoint tournament.json --output standings.json
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from itertools import combinations, permutations
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import argparse
+import json
+import os
+import re
+import time
+
+from mcts import MCTSBot
+from simulator import Policy, race_seed, simulate_race
+from tracks import all_tracks, track_by_name
+from transposition import TranspositionTable
+
+INITIAL_RATING = 1500.0
+DEFAULT_K = 16.0
+
+_SPEC = re.compile(r"^(heuristic|mcts:(\d+(?:\.\d+)?)(it)?)$")
+
+
+def parse_entrant(entrant: str) -> Tuple[str, str]:
+    """(name, spec) of an entrant written ``spec`` or ``name=spec``"""
+    name, _, spec = entrant.rpartition("=")
+    if not _SPEC.match(spec):
+        raise ValueError(f"Unknown AI {spec!r}: use heuristic, mcts:<ms> or mcts:<n>it")
+    return name or spec, spec
+
+
+@dataclass
+class TournamentConfig:
+    entrants: List[str]
+    tracks: List[str] = field(default_factory=lambda: [layout.name for layout in all_tracks()])
+    teams: int = 2
+    games: int = 1000
+    seed: int = 0
+
+    def __post_init__(self):
+        names = [parse_entrant(entrant)[0] for entrant in self.entrants]
+        if len(set(names)) != len(names):
+            raise ValueError("Entrant names must be unique")
+        if not 2 <= self.teams <= len(self.entrants):
+            raise ValueError(f"Games of {self.teams} teams need at least {max(self.teams, 2)} entrants")
+        for track in self.tracks:
+            track_by_name(track)
+
+    def rounds(self) -> List[Tuple[int, Tuple[int, ...]]]:
+        """(track, entrant per seat) of each game of the cycle"""
+        return [(track, seats)
+                for group in combinations(range(len(self.entrants)), self.teams)
+                for seats in permutations(group)
+                for track in range(len(self.tracks))]
+
+
+def _policy(spec: str, seed: int) -> Optional[Policy]:
+    """A new bot for each game, so that a game plays the same wherever and whenever it runs"""
+    if spec == "heuristic":
+        return None
+    amount, iterations = _SPEC.match(spec).group(2, 3)
+    budget = dict(budget_ms=None, iterations=int(amount)) if iterations else dict(budget_ms=float(amount))
+    return MCTSBot(seed=seed, table=TranspositionTable(), **budget).policy
+
+
+def play_games(config: TournamentConfig, start: int, count: int) -> List[Optional[int]]:
+    """Winning seat of games ``start`` to ``start + count``, None for a stalled race"""
+    rounds = config.rounds()
+    specs = [parse_entrant(entrant)[1] for entrant in config.entrants]
+    tracks = [track_by_name(name).track() for name in config.tracks]
+    winners = []
+    for index in range(start, start + count):
+        track, seats = rounds[index % len(rounds)]
+        seed = race_seed(config.seed, index)
+        result = simulate_race(config.teams, tracks[track], seed,
+                               policies=[_policy(specs[entrant], seed) for entrant in seats])
+        winners.append(result.winner_team if result.completed else None)
+    return winners
+
+
+def expected_score(rating: float, opponent: float) -> float:
+    return 1.0 / (1.0 + 10 ** ((opponent - rating) / 400))
+
+
+class Tournament:
+    """Ratings and counters of a tournament, updated one game at a time"""
+
+    def __init__(self, config: TournamentConfig, k: float = DEFAULT_K):
+        self.config = config
+        self.k = k
+        self.names = [parse_entrant(entrant)[0] for entrant in config.entrants]
+        self._rounds = config.rounds()
+        self.next_game = 0
+        self.ratings = [INITIAL_RATING] * len(self.names)
+        self.games = [0] * len(self.names)
+        self.wins = [0] * len(self.names)
+        self.stalled = 0
+        # [games, wins] per track, per entrant
+        self.track_games = [[[0, 0] for _ in self.names] for _ in config.tracks]
+
+    def record(self, winner: Optional[int]):
+        """Apply the result of game ``next_game``: its winning seat or None"""
+        track, seats = self._rounds[self.next_game % len(self._rounds)]
+        self.next_game += 1
+        for entrant in seats:
+            self.games[entrant] += 1
+            self.track_games[track][entrant][0] += 1
+        if winner is None:
+            self.stalled += 1
+            return
+        champion = seats[winner]
+        self.wins[champion] += 1
+        self.track_games[track][champion][1] += 1
+        # Against each loser at once, from the ratings before the game
+        k = self.k / (len(seats) - 1)
+        gained = 0.0
+        for loser in seats:
+            if loser != champion:
+                delta = k * (1.0 - expected_score(self.ratings[champion], self.ratings[loser]))
+                self.ratings[loser] -= delta
+                gained += delta
+        self.ratings[champion] += gained
+
+    def run(self, workers: int = 1, chunk_size: int = 100, checkpoint: Union[str, Path, None] = None,
+            checkpoint_every: int = 1000, limit: Optional[int] = None):
+        """Play the games left, at most ``limit`` of them, on ``workers`` processes"""
+        end = self.config.games if limit is None else min(self.config.games, self.next_game + limit)
+        saved = self.next_game
+        try:
+            for _, winners in self._results(self.next_game, end, workers, chunk_size):
+                for winner in winners:
+                    self.record(winner)
+                if checkpoint is not None and self.next_game - saved >= checkpoint_every:
+                    self.save(checkpoint)
+                    saved = self.next_game
+        finally:
+            if checkpoint is not None:
+                self.save(checkpoint)
+
+    def standings(self) -> List[dict]:
+        """Entrants by rating, best first"""
+        rows = [{"name": name, "ai": parse_entrant(entrant)[1], "rating": round(self.ratings[i], 1),
+                 "games": self.games[i], "wins": self.wins[i],
+                 "win_rate": self.wins[i] / self.games[i] if self.games[i] else 0.0}
+                for i, (name, entrant) in enumerate(zip(self.names, self.config.entrants))]
+        return sorted(rows, key=lambda row: -row["rating"])
+
+    def track_win_rates(self) -> Dict[str, Dict[str, float]]:
+        """Win rate of each entrant on each track, over the games it played there"""
+        return {track: {name: wins / games if games else 0.0
+                        for name, (games, wins) in zip(self.names, counts)}
+                for track, counts in zip(self.config.tracks, self.track_games)}
+
+    def export(self) -> dict:
+        return {"games": self.next_game, "stalled": self.stalled, "standings": self.standings(),
+                "track_win_rates": self.track_win_rates()}
+
+    def state(self) -> dict:
+        return {"config": asdict(self.config), "k": self.k, "next_game": self.next_game,
+                "ratings": self.ratings, "games": self.games, "wins": self.wins, "stalled": self.stalled,
+                "track_games": self.track_games}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Tournament":
+        tournament = cls(TournamentConfig(**state["config"]), k=state["k"])
+        for key in ("next_game", "ratings", "games", "wins", "stalled", "track_games"):
+            setattr(tournament, key, state[key])
+        return tournament
+
+    def save(self, path: Union[str, Path]):
+        """Write the checkpoint, replacing the previous one only once it is complete"""
+        path = Path(path)
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "w") as f:
+            json.dump(self.state(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Tournament":
+        with open(path) as f:
+            return cls.from_state(json.load(f))
+
+    def _results(self, start: int, end: int, workers: int, chunk_size: int):
+        """(first game, winners) of chunks of games, in game order"""
+        if workers == 1:
+            for first in range(start, end, chunk_size):
+                yield first, play_games(self.config, first, min(chunk_size, end - first))
+            return
+        # At most two chunks per worker in flight or done early, waiting for their turn
+        done_early = {}
+        following = start
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            for first in range(start, end, chunk_size):
+                pending[pool.submit(play_games, self.config, first, min(chunk_size, end - first))] = first
+                while len(pending) + len(done_early) >= workers * 2 or (first + chunk_size >= end and pending):
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        done_early[pending.pop(future)] = future.result()
+                    while following in done_early:
+                        winners = done_early.pop(following)
+                        yield following, winners
+                        following += len(winners)
+
+
+def open_tournament(config: TournamentConfig, checkpoint: Union[str, Path, None] = None,
+                    k: float = DEFAULT_K) -> Tournament:
+    """A new tournament, or the one saved in ``checkpoint`` if it has the same config"""
+    if checkpoint is None or not Path(checkpoint).exists():
+        return Tournament(config, k)
+    tournament = Tournament.load(checkpoint)
+    if asdict(tournament.config) != asdict(config) or tournament.k != k:
+        raise ValueError(f"{checkpoint} is a checkpoint of another tournament")
+    return tournament
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description="Rate AI variants in a round-robin tournament")
+    parser.add_argument("entrants", nargs="+", help="heuristic, mcts:<ms> or mcts:<n>it, as name=spec to name them")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--teams", type=int, default=2)
+    parser.add_argument("--tracks", nargs="+", default=None, help="Track names, default every track")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k", type=float, default=DEFAULT_K)
+    parser.add_argument("--workers", type=int, default=1, help="0 for one per core")
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--checkpoint", help="Progress file, resumed from if it exists")
+    parser.add_argument("--checkpoint-every", type=int, default=1000)
+    parser.add_argument("--output", help="Write the standings and per-track win rates as JSON")
+    args = parser.parse_args(argv)
+
+    tracks = {"tracks": args.tracks} if args.tracks else {}
+    config = TournamentConfig(args.entrants, teams=args.teams, games=args.games, seed=args.seed, **tracks)
+    tournament = open_tournament(config, args.checkpoint, args.k)
+    if tournament.next_game:
+        print(f"Resuming at game {tournament.next_game} of {config.games}")
+    began = time.perf_counter()
+    played = tournament.next_game
+    tournament.run(args.workers or os.cpu_count() or 1, args.chunk_size, args.checkpoint, args.checkpoint_every)
+    elapsed = time.perf_counter() - began
+    played = tournament.next_game - played
+    print(f"{played} games in {elapsed:.1f}s ({played / elapsed if elapsed else 0:,.0f} games/s), "
+          f"{tournament.stalled} stalled in all")
+
+    print(f"{'entrant':<20} {'rating':>7} {'games':>7} {'win rate':>9}")
+    for row in tournament.standings():
+        print(f"{row['name']:<20} {row['rating']:>7.1f} {row['games']:>7} {row['win_rate']:>9.1%}")
+    for track, rates in tournament.track_win_rates().items():
+        print(f"{track}: " + ", ".join(f"{name} {rate:.1%}" for name, rate in rates.items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(tournament.export(), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Track definitions: the file format, its validation and the built-in tracks.
+
+A definition is a name and the track as runs of identical tiles, from the
+start to the finish line::
+
+    {"name": "The Peaks",
+     "segments": [{"terrain": "start", "length": 3},
+                  {"terrain": "mountain", "length": 7, "lanes": 2, "weather": "none"},
+                  ...
+                  {"terrain": "finish", "length": 1}]}
+
+``lanes`` defaults to 2, the narrowest a start can be, and ``weather``
+to ``none``, the weather of the race; any other weather moves riders on
+the segment whatever the race's (``engine.tile_weather``).  ``parse_track``
+validates a definition and compiles it into an ``engine.TrackLayout``,
+registered under the hash of its content, so loading the same track twice
+gives the same layout and every game on it shares one copy.  The tracks in
+``track_definitions/`` are loaded on first use.
+"""
+import json
+from pathlib import Path
+from typing import Dict, List, Union
+
+from engine import (
+    TERRAINS, WEATHERS, TerrainType, TrackLayout, WeatherType, register_layout,
+)
+
+DEFINITIONS_DIR = Path(__file__).parent / "track_definitions"
+
+MAX_LANES = 4
+# A team's two riders line up side by side on the start (engine.create_new_game)
+START_LANES = 2
+MIN_LENGTH = 5
+MAX_LENGTH = 200
+
+SEGMENT_KEYS = {"terrain", "length", "lanes", "weather"}
+
+
+class TrackDefinitionError(ValueError):
+    """A track definition that does not describe a raceable track"""
+
+
+def _segment(segment, where: str):
+    if not isinstance(segment, dict):
+        raise TrackDefinitionError(f"{where}: must be an object")
+    unknown = set(segment) - SEGMENT_KEYS
+    if unknown:
+        raise TrackDefinitionError(f"{where}: unknown keys {sorted(unknown)}")
+    try:
+        terrain = TerrainType(segment.get("terrain"))
+    except ValueError:
+        raise TrackDefinitionError(
+            f"{where}.terrain: must be one of {[t.value for t in TERRAINS]}") from None
+    try:
+        weather = WeatherType(segment.get("weather", WeatherType.NONE.value))
+    except ValueError:
+        raise TrackDefinitionError(
+            f"{where}.weather: must be one of {[w.value for w in WEATHERS]}") from None
+    length, lanes = segment.get("length"), segment.get("lanes", 2)
+    # bool is an int, but never a length
+    if type(length) is not int or length < 1:
+        raise TrackDefinitionError(f"{where}.length: must be a positive integer")
+    if type(lanes) is not int or not 1 <= lanes <= MAX_LANES:
+        raise TrackDefinitionError(f"{where}.lanes: must be an integer from 1 to {MAX_LANES}")
+    return terrain, length, lanes, weather
+
+
+def parse_track(definition: dict) -> TrackLayout:
+    """Validate a definition and return its registered layout
+
+    Raises ``TrackDefinitionError`` on the first problem found.
+    """
+    if not isinstance(definition, dict):
+        raise TrackDefinitionError("definition: must be an object")
+    unknown = set(definition) - {"name", "segments"}
+    if unknown:
+        raise TrackDefinitionError(f"definition: unknown keys {sorted(unknown)}")
+    name = definition.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise TrackDefinitionError("name: must be a non-empty string")
+    segments = definition.get("segments")
+    if not isinstance(segments, list) or not segments:
+        raise TrackDefinitionError("segments: must be a non-empty list")
+
+    lanes, terrain, weather = bytearray(), bytearray(), bytearray()
+    for i, segment in enumerate(segments):
+        where = f"segments[{i}]"
+        kind, length, width, wind = _segment(segment, where)
+        if (kind == TerrainType.START) != (i == 0):
+            raise TrackDefinitionError(f"{where}.terrain: the track starts with the one start segment")
+        if (kind == TerrainType.FINISH) != (i == len(segments) - 1):
+            raise TrackDefinitionError(f"{where}.terrain: the track ends with the one finish segment")
+        if kind == TerrainType.START and width < START_LANES:
+            raise TrackDefinitionError(f"{where}.lanes: the start is at least {START_LANES} lanes wide")
+        if kind == TerrainType.FINISH and length != 1:
+            raise TrackDefinitionError(f"{where}.length: the finish line is a single tile")
+        lanes.extend([width] * length)
+        terrain.extend([TERRAINS.index(kind)] * length)
+        weather.extend([WEATHERS.index(wind)] * length)
+        if len(lanes) > MAX_LENGTH:
+            raise TrackDefinitionError(f"segments: tracks are at most {MAX_LENGTH} tiles long")
+    if len(lanes) < MIN_LENGTH:
+        raise TrackDefinitionError(f"segments: tracks are at least {MIN_LENGTH} tiles long")
+    return register_layout(TrackLayout(name.strip(), bytes(lanes), bytes(terrain), bytes(weather)))
+
+
+def to_definition(layout: TrackLayout) -> dict:
+    """The definition of a layout, with runs of identical tiles merged"""
+    segments: List[dict] = []
+    previous = None
+    for tile in zip(layout.terrain, layout.lanes, layout.weather):
+        if tile == previous:
+            segments[-1]["length"] += 1
+            continue
+        terrain, lanes, weather = previous = tile
+        segments.append({"terrain": TERRAINS[terrain].value, "length": 1, "lanes": lanes,
+                         "weather": WEATHERS[weather].value})
+    return {"name": layout.name, "segments": segments}
+
+
+def load_track(path: Union[str, Path]) -> TrackLayout:
+    with open(path, encoding="utf-8") as f:
+        try:
+            definition = json.load(f)
+        except json.JSONDecodeError as e:
+            raise TrackDefinitionError(f"{path}: {e}") from None
+    return parse_track(definition)
+
+
+# Tracks that can be raced by name
+_by_name: Dict[str, TrackLayout] = {}
+
+
+def add_track(layout: TrackLayout) -> TrackLayout:
+    """Make a layout available by name; names are unique"""
+    _load_builtin_tracks()
+    existing = _by_name.setdefault(layout.name, layout)
+    if existing is not layout:
+        raise TrackDefinitionError(f"name: a different track is already called {layout.name!r}")
+    return layout
+
+
+def track_by_name(name: str) -> TrackLayout:
+    _load_builtin_tracks()
+    try:
+        return _by_name[name]
+    except KeyError:
+        raise ValueError(f"Unknown track: {name}") from None
+
+
+def all_tracks() -> List[TrackLayout]:
+    _load_builtin_tracks()
+    return list(_by_name.values())
+
+
+def _load_builtin_tracks():
+    if _by_name:
+        return
+    for path in sorted(DEFINITIONS_DIR.glob("*.json")):
+        layout = load_track(path)
+        _by_name[layout.name] = layout
@@ -0,0 +1,116 @@
+"""Memo of AI card choices by canonical situation, shared by the games of a process.
+
+Many AI decisions repeat a situation some other game already searched: the
+same hand values on the same tile with riders at the same gaps ahead and
+behind, above all in the opening turns.  ``rider_key`` reduces one rider's
+situation to a Zobrist hash of what decides its card, and
+``TranspositionTable`` keeps the card the search found best for each key in
+a bounded LRU, so that a repeat costs a dict lookup instead of a search.
+
+A rider's key covers:
+
+- the track, weather and its position (so the terrain ahead)
+- its hand values as a multiset (movement only depends on a card's value)
+- the gaps to the nearest riders ahead and behind, capped at ``MAX_GAP``
+- whether its team mate still races, and at what gap
+- its team's deck sizes, capped at 2 (what the next draw can take)
+
+Rival hands and the order of the decks are hidden from the team and left
+out, and so are the other riders further away.  Cards are shared on that
+approximation.
+"""
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+import random
+
+from simulator import RaceState, RIDERS_PER_TEAM, VALUE_MASK
+
+DEFAULT_MAX_ENTRIES = 50_000
+# Gaps beyond this many tiles are all the same to the key
+MAX_GAP = 6
+
+# One random 64-bit word per feature, drawn on first use
+_zobrist: Dict[tuple, int] = {}
+_zobrist_rng = random.Random(0x5EED)
+
+
+def _z(feature: tuple) -> int:
+    word = _zobrist.get(feature)
+    if word is None:
+        word = _zobrist[feature] = _zobrist_rng.getrandbits(64)
+    return word
+
+
+def _gap(gap: int) -> int:
+    return gap if gap <= MAX_GAP else MAX_GAP + 1
+
+
+def rider_key(race: RaceState, rider: int) -> Hashable:
+    """Canonical key of the situation of ``rider`` choosing a card"""
+    position, finished = race.position, race.finished
+    here = position[rider]
+    team = rider // RIDERS_PER_TEAM
+    mate = rider ^ 1 if RIDERS_PER_TEAM == 2 else None
+    ahead = behind = MAX_GAP + 1
+    for r in range(len(position)):
+        if r == rider or r == mate or finished[r]:
+            continue
+        gap = position[r] - here
+        if gap >= 0:
+            ahead = min(ahead, gap)
+        else:
+            behind = min(behind, -gap)
+    h = _z(("position", here)) ^ _z(("ahead", _gap(ahead))) ^ _z(("behind", _gap(behind)))
+    if mate is not None and not finished[mate]:
+        h ^= _z(("mate", max(min(position[mate] - here, MAX_GAP + 1), -MAX_GAP - 1)))
+    h ^= _z(("decks", min(len(race.sprinteur_deck[team]), 2), min(len(race.rouleur_deck[team]), 2)))
+    copies: Dict[int, int] = {}
+    for card in race.hand[rider]:
+        value = card & VALUE_MASK
+        copy = copies.get(value, 0)
+        copies[value] = copy + 1
+        h ^= _z(("card", value, copy))
+    # The layout and weather by content: races pickled to a search process
+    # share entries with the ones searched there before
+    return race.track.key, h
+
+
+class TranspositionTable:
+    """Bounded LRU of (card value, mean reward) by ``rider_key``"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[int, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Tuple[int, float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, card_value: int, value: float):
+        self._entries[key] = (card_value, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate}
+
+
+# The table of every bot that is not given its own
+shared_table = TranspositionTable()
@@ -0,0 +1,320 @@
+"""NumPy race engine that steps many races in lockstep.
+
+``RaceBatch`` keeps R races as struct-of-arrays: positions, lanes, hands and
+fatigue are (races, riders) arrays, decks and discard piles are
+(races, teams, kind, cards) arrays with a card count.  ``RaceBatch.step`` plays one ``process_turn`` (AI selection,
+initiative sort, movement with blocking, slipstream, fatigue, redraw) for
+every live race at once.  Python only loops over riders, never over races.
+
+The random stream is a NumPy ``Generator`` consumed in a different order
+than ``random.Random`` in the engine, so results match
+``FlammeRougeEngine`` and the scalar simulator statistically, not race by
+race.  Only the engine's heuristic AI is supported.
+
+Races that end are folded into the aggregate and dropped from the arrays,
+so late turns only pay for the races still going.
+
+Usage::
+
+    python vectorized.py --races 1000000 --teams 3 --seed 1
+"""
+from typing import Optional
+import argparse
+import time
+
+import numpy as np
+
+from engine import Track, WeatherType, SPRINTEUR_VALUES, ROULEUR_VALUES, FATIGUE_DECK_SIZE
+from simulator import (
+    BatchResult, RIDERS_PER_TEAM, MAX_TURNS, STALL_TURNS, TeamsArg, _team_count, compile_track,
+)
+
+HAND_SLOTS = 4  # Slots 0-1 hold sprinteur cards, 2-3 rouleur cards, 0 is empty
+SPRINTEUR, ROULEUR = 0, 1
+DECK_SIZE = 10
+
+# Per-race arrays, sliced down to the live races by RaceBatch._compact
+_RACE_ARRAYS = (
+    "position", "lane", "finished", "hand", "fatigue", "deck", "deck_top",
+    "discard", "discard_top", "fatigue_deck", "occupied", "lane_used",
+    "live", "completed", "turn", "idle_turns",
+)
+
+
+class RaceBatch:
+    """R races of the same setup, advanced together one turn at a time.
+
+    Decks and discard piles are (races, teams, kind, 10) card arrays with a
+    count of cards in use, so drawing is a pop from the top and reshuffling
+    is an argsort of random keys over the rows that ran out.
+    """
+
+    def __init__(self, races: int, teams: TeamsArg = 3, track: Optional[Track] = None,
+                 rng: Optional[np.random.Generator] = None, weather: WeatherType = WeatherType.NONE):
+        compiled = compile_track(track, weather)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.races = races
+        self.team_count = _team_count(teams)
+        self.rider_count = self.team_count * RIDERS_PER_TEAM
+        self.length = compiled.length
+        self.last = compiled.length - 1
+
+        # Track tables; index ``length`` is a sentinel with no lanes
+        self.lanes = np.array(compiled.lanes, dtype=np.int16)
+        self.max_lanes = compiled.max_lanes
+        self.far = np.array(compiled.far, dtype=bool)
+        self.mountain = np.array(compiled.mountain, dtype=bool)
+        self.movement = np.array(compiled.movement, dtype=np.int16)
+        self.max_move = int(self.movement.max())
+
+        shape = (races, self.rider_count)
+        self.position = np.zeros(shape, dtype=np.int16)
+        self.lane = np.tile(np.arange(self.rider_count, dtype=np.int16) % RIDERS_PER_TEAM, (races, 1))
+        self.finished = np.zeros(shape, dtype=bool)
+        self.hand = np.zeros(shape + (HAND_SLOTS,), dtype=np.int16)
+        self.fatigue = np.zeros(shape, dtype=np.int16)
+
+        pile_shape = (races, self.team_count, 2, DECK_SIZE)
+        self.deck = np.empty(pile_shape, dtype=np.int16)
+        for kind, values in ((SPRINTEUR, SPRINTEUR_VALUES), (ROULEUR, ROULEUR_VALUES)):
+            order = self.rng.random((races, self.team_count, DECK_SIZE)).argsort(-1)
+            self.deck[:, :, kind] = np.array(values, dtype=np.int16)[order]
+        self.deck_top = np.full(pile_shape[:3], DECK_SIZE, dtype=np.int16)
+        self.discard = np.zeros(pile_shape, dtype=np.int16)
+        self.discard_top = np.zeros(pile_shape[:3], dtype=np.int16)
+        self.fatigue_deck = np.full((races, self.team_count), FATIGUE_DECK_SIZE, dtype=np.int16)
+
+        # Riders still racing per position and per (position, lane)
+        self.occupied = np.zeros((races, self.length + 1), dtype=np.int16)
+        self.occupied[:, 0] = self.rider_count
+        self.lane_used = np.zeros((races, self.length + 1, self.max_lanes), dtype=np.int16)
+        self.lane_used[:, 0, 0] = (self.rider_count + 1) // 2
+        self.lane_used[:, 0, 1] = self.rider_count // 2
+
+        self.live = np.ones(races, dtype=bool)
+        self.completed = np.zeros(races, dtype=bool)
+        self.turn = np.ones(races, dtype=np.int32)
+        self.idle_turns = np.zeros(races, dtype=np.int32)
+
+        # Results of races dropped by _compact
+        self.ended = BatchResult.empty(self.team_count)
+        self._teams = np.arange(self.team_count)
+        for j in range(RIDERS_PER_TEAM):
+            self._draw(j, np.ones((races, self.team_count), dtype=bool))
+
+    def _draw_one(self, kind: int, races: np.ndarray, teams: np.ndarray) -> np.ndarray:
+        """Pop a card of ``kind`` for each (race, team) pair, 0 when none is left"""
+        top = self.deck_top[races, teams, kind]
+
+        # Reshuffle discard if deck empty
+        empty = top == 0
+        if empty.any():
+            r, t = races[empty], teams[empty]
+            count = self.discard_top[r, t, kind]
+            keys = self.rng.random((len(r), DECK_SIZE))
+            keys[np.arange(DECK_SIZE) >= count[:, None]] = 2.0
+            order = keys.argsort(-1)
+            self.deck[r, t, kind] = np.take_along_axis(self.discard[r, t, kind], order, -1)
+            self.deck_top[r, t, kind] = count
+            self.discard_top[r, t, kind] = 0
+            top = self.deck_top[races, teams, kind]
+
+        can = top > 0
+        r, t = races[can], teams[can]
+        value = np.zeros(len(races), dtype=np.int16)
+        value[can] = self.deck[r, t, kind, top[can] - 1]
+        self.deck_top[r, t, kind] -= 1
+        return value
+
+    def _draw(self, j: int, mask: np.ndarray):
+        """draw_cards for rider ``j`` of every team where ``mask`` is set"""
+        races, teams = np.nonzero(mask)
+        riders = teams * RIDERS_PER_TEAM + j
+        for slot in range(HAND_SLOTS):
+            self.hand[races, riders, slot] = self._draw_one(SPRINTEUR if slot < 2 else ROULEUR, races, teams)
+
+    def _select_cards(self) -> np.ndarray:
+        """FlammeRougeEngine.ai_select_card for every rider, returns the played values"""
+        values = self.hand
+        held = values > 0
+        count = held.sum(-1)
+
+        # Far from finish: first highest card
+        highest = np.where(held, values, -1).argmax(-1)
+        # In mountains: first medium card, else first lowest card
+        medium = held & (values >= 3) & (values <= 5)
+        lowest = np.where(held, values, 99).argmin(-1)
+        mountain_pick = np.where(medium.any(-1), medium.argmax(-1), lowest)
+        # Default: middle card of the stable sort by value
+        by_value = np.where(held, values, 99).argsort(-1, kind="stable")
+        middle = np.take_along_axis(by_value, (count // 2)[..., None], -1)[..., 0]
+
+        pos = self.position
+        choice = np.where(self.far[pos], highest, np.where(self.mountain[pos], mountain_pick, middle))
+        playing = self.live[:, None] & ~self.finished & (count > 0)
+        played = np.where(playing, np.take_along_axis(values, choice[..., None], -1)[..., 0], 0)
+
+        # One rider per team at a time so discard appends never collide
+        for j in range(RIDERS_PER_TEAM):
+            riders = self._teams * RIDERS_PER_TEAM + j
+            races, teams = np.nonzero(playing[:, riders])
+            n = teams * RIDERS_PER_TEAM + j
+            slot = choice[races, n]
+            self.hand[races, n, slot] = 0
+            kind = (slot >= 2).astype(np.int64)
+            top = self.discard_top[races, teams, kind]
+            self.discard[races, teams, kind, top] = played[races, n]
+            self.discard_top[races, teams, kind] += 1
+        return played
+
+    def _free_lanes(self, races: np.ndarray, target: np.ndarray):
+        free = (self.lane_used[races, target] == 0) & (np.arange(self.max_lanes) < self.lanes[target][:, None])
+        return free, free.sum(-1)
+
+    def _pick_lane(self, free: np.ndarray, count: np.ndarray) -> np.ndarray:
+        k = (self.rng.random(len(count)) * count).astype(np.int16)
+        return ((np.cumsum(free, -1) == (k + 1)[:, None]) & free).argmax(-1)
+
+    def _move(self, races: np.ndarray, riders: np.ndarray, target: np.ndarray, lane: np.ndarray):
+        current = self.position[races, riders]
+        self.occupied[races, current] -= 1
+        self.lane_used[races, current, self.lane[races, riders]] -= 1
+        self.position[races, riders] = target
+        self.lane[races, riders] = lane
+        done = target >= self.last
+        self.finished[races[done], riders[done]] = True
+        staying = ~done
+        self.occupied[races[staying], target[staying]] += 1
+        self.lane_used[races[staying], target[staying], lane[staying]] += 1
+
+    def step(self) -> int:
+        """Play one turn in every live race, returns the number of races still live"""
+        played = self._select_cards()
+        races = np.arange(len(self.live))
+        moved = np.zeros(len(races), dtype=bool)
+        offsets = np.arange(1, self.max_move + 1)
+
+        # Movement phase, by initiative (card value descending, then random)
+        initiative = played + self.rng.random(played.shape)
+        order = np.argsort(-initiative, axis=1)
+        for k in range(self.rider_count):
+            riders = order[:, k]
+            value = played[races, riders]
+            mask = value > 0
+            r, n, value = races[mask], riders[mask], value[mask]
+            current = self.position[r, n]
+            target = np.minimum(current + self.movement[current, value], self.last)
+
+            ahead = np.minimum(current[:, None] + offsets, self.length)
+            blocked = (self.occupied[r[:, None], ahead] >= self.lanes[ahead]) & (ahead <= target[:, None])
+            target = np.where(blocked.any(-1), current + blocked.argmax(-1), target)
+
+            free, count = self._free_lanes(r, target)
+            can = count > 0
+            lane = self._pick_lane(free[can], count[can])
+            moved[r[can & (target != current)]] = True
+            self._move(r[can], n[can], target[can], lane)
+
+        # Slipstream phase, in team order
+        racing = self.live[:, None] & ~self.finished
+        for n in range(self.rider_count):
+            r = races[racing[:, n]]
+            target = self.position[r, n] + 1
+            in_front = self.occupied[r, target]
+            follow = (in_front > 0) & (in_front < self.lanes[target])
+            r, target = r[follow], target[follow]
+            free, count = self._free_lanes(r, target)
+            can = count > 0
+            lane = self._pick_lane(free[can], count[can])
+            moved[r[can]] = True
+            self._move(r[can], np.full(can.sum(), n), target[can], lane)
+
+        # Fatigue phase
+        for j in range(RIDERS_PER_TEAM):
+            riders = self._teams * RIDERS_PER_TEAM + j
+            active = racing[:, riders]
+            ahead = self.occupied[races[:, None], self.position[:, riders] + 1]
+            tired = active & (ahead == 0) & (self.fatigue_deck > 0)
+            self.fatigue_deck -= tired
+            self.fatigue[:, riders] += tired
+            self._draw(j, active)
+
+        # Check win condition, then stop races that can no longer move
+        over = self.live & self.finished.any(-1)
+        self.completed |= over
+        going = self.live & ~over
+        self.turn[going] += 1
+        self.idle_turns[going] = np.where(moved[going], 0, self.idle_turns[going] + 1)
+        stalled = going & ((self.idle_turns >= STALL_TURNS) | (self.turn > MAX_TURNS))
+        self.live &= ~(over | stalled)
+
+        live = int(self.live.sum())
+        if live <= len(self.live) // 2:
+            self._compact()
+        return live
+
+    def _compact(self):
+        """Fold ended races into ``ended`` and keep only the live rows"""
+        self.ended.merge(self._aggregate(~self.live))
+        keep = self.live
+        for name in _RACE_ARRAYS:
+            setattr(self, name, getattr(self, name)[keep])
+
+    def _aggregate(self, rows: np.ndarray) -> BatchResult:
+        batch = BatchResult.empty(self.team_count)
+        finished, completed, turn = self.finished[rows], self.completed[rows], self.turn[rows]
+        batch.races = len(turn)
+        batch.completed = int(completed.sum())
+        batch.total_turns = int(turn.sum())
+        winners = finished[completed].argmax(-1) // RIDERS_PER_TEAM
+        batch.wins = np.bincount(winners, minlength=self.team_count).tolist()
+        team_of = np.arange(self.rider_count) // RIDERS_PER_TEAM
+        batch.finishers = np.bincount(team_of, weights=finished.sum(0), minlength=self.team_count).astype(int).tolist()
+        batch.fatigue = np.bincount(team_of, weights=self.fatigue[rows].sum(0), minlength=self.team_count).astype(int).tolist()
+        turns, counts = np.unique(turn, return_counts=True)
+        batch.turn_histogram = dict(zip(turns.tolist(), counts.tolist()))
+        return batch
+
+    def run(self):
+        while self.step():
+            pass
+
+    def result(self) -> BatchResult:
+        """Aggregate the batch into the simulator's BatchResult"""
+        batch = BatchResult.empty(self.team_count)
+        batch.merge(self.ended)
+        batch.merge(self._aggregate(np.ones(len(self.live), dtype=bool)))
+        return batch
+
+
+def simulate_vectorized(n: int, teams: TeamsArg = 3, track: Optional[Track] = None, seed: int = 0,
+                        batch_size: int = 100_000, weather: WeatherType = WeatherType.NONE) -> BatchResult:
+    """Run ``n`` races in lockstep batches of ``batch_size`` and aggregate them"""
+    rng = np.random.default_rng(seed)
+    total = BatchResult.empty(_team_count(teams))
+    began = time.perf_counter()
+    for start in range(0, n, batch_size):
+        batch = RaceBatch(min(batch_size, n - start), teams, track, rng, weather)
+        batch.run()
+        total.merge(batch.result())
+    total.elapsed = time.perf_counter() - began
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Flamme Rouge races in NumPy lockstep")
+    parser.add_argument("--races", type=int, default=100_000)
+    parser.add_argument("--teams", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    batch = simulate_vectorized(args.races, args.teams, seed=args.seed, batch_size=args.batch_size)
+    print(f"{batch.races} races in {batch.elapsed:.3f}s: {batch.races_per_second:,.0f} races/s")
+    print(f"completed {batch.completed}, mean turns {batch.mean_turns:.2f}")
+    for team in range(args.teams):
+        print(f"team {team}: wins {batch.wins[team]}, fatigue {batch.fatigue[team]}")
+
+
+if __name__ == "__main__":
+    main()
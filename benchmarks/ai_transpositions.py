@@ -0,0 +1,66 @@
+"""AI turn latency with and without the shared transposition table.
+
+Usage: python benchmarks/ai_transpositions.py [--games 300] [--budget 5]
+
+Plays ``--games`` all-AI games to the end through ``compact.process_turn``,
+one turn of every game after the other as a busy server would, once with
+a bot that searches every decision and once with one that shares its
+decisions through a ``TranspositionTable``.  A decision is one team's
+cards for one turn when some rider has a choice of cards; "memoized" ones
+were answered by the table.
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import compact  # noqa: E402
+from engine import GamePhase, RiderType, create_new_game  # noqa: E402
+from mcts import MCTSBot  # noqa: E402
+from transposition import TranspositionTable  # noqa: E402
+
+
+def new_games(count: int, teams: int):
+    games = []
+    for seed in range(count):
+        game_state = create_new_game([f"Team {i}" for i in range(teams)], rng=random.Random(seed))
+        for team in game_state.teams:
+            for rider in team.riders:
+                rider.rider_type = RiderType.AI_BOT
+        games.append(compact.from_state(game_state))
+    return games
+
+
+def play(games, bot, seed: int) -> float:
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    live = list(games)
+    while live:
+        for game in live:
+            compact.process_turn(game, rng, bot=bot)
+        live = [game for game in live if game.current_phase != GamePhase.GAME_OVER and game.current_turn < 100]
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=300)
+    parser.add_argument("--teams", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=5, help="search budget per decision (ms)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print(f"{args.games} games, {args.teams} AI teams, {args.budget:g} ms per search")
+    print(f"{'':12} {'ms/decision':>12} {'memoized':>9} {'hit rate':>9}")
+    for name, table in (("search only", None), ("with table", TranspositionTable())):
+        bot = MCTSBot(budget_ms=args.budget, seed=args.seed, table=table)
+        elapsed = play(new_games(args.games, args.teams), bot, args.seed)
+        hit_rate = f"{table.hit_rate:9.1%}" if table else f"{'-':>9}"
+        decisions = bot.searches + bot.memoized
+        print(f"{name:12} {elapsed * 1000 / decisions:12.2f} {bot.memoized / decisions:9.1%} {hit_rate}")
+
+if __name__ == "__main__":
+    main()
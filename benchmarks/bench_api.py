@@ -0,0 +1,117 @@
+"""Macro benchmarks: API requests through the FastAPI app, MongoDB played by mongomock-motor
+
+The AI is the heuristic one, so that the numbers measure the request path
+rather than the search budget.
+"""
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+
+TEAMS = [3, 6, 12]
+ROUNDS = 100
+
+
+@pytest.fixture
+def client(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["benchmarks"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "bot", None)
+    monkeypatch.setattr(server.games, "collection", database.flamme_rouge_games)
+    monkeypatch.setattr(server.games, "archive_collection", database.flamme_rouge_archived_games)
+    monkeypatch.setattr(server.games, "log_collection", database.flamme_rouge_logs)
+    monkeypatch.setattr(server.history, "event_collection", database.flamme_rouge_events)
+    monkeypatch.setattr(server.history, "snapshot_collection", database.flamme_rouge_snapshots)
+    with TestClient(server.app) as client:
+        yield client
+
+
+def new_game(client, teams):
+    response = client.post("/api/flamme-rouge/new-game", json=[f"Team {i}" for i in range(teams)])
+    assert response.status_code == 200
+    return response.json()
+
+
+def token(created):
+    """The first team's viewer, which only new-game tells"""
+    return created["tokens"][created["game_state"]["teams"][0]["id"]]
+
+
+def own_riders(client, created):
+    """The first team's riders with their hands, which only its own view shows"""
+    response = client.get(f"/api/flamme-rouge/game/{created['game_id']}", params={"viewer": token(created)})
+    return response.json()["game_state"]["teams"][0]["riders"]
+
+
+@pytest.mark.benchmark(group="api new-game")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_new_game(benchmark, client, teams):
+    benchmark.pedantic(new_game, args=(client, teams), rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="api get game")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_get_game(benchmark, client, teams):
+    game_id = new_game(client, teams)["game_id"]
+    benchmark.pedantic(client.get, args=(f"/api/flamme-rouge/game/{game_id}",), rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="api get game")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_get_game_not_modified(benchmark, client, teams):
+    """A poll of a game that did not change since the last one"""
+    url = f"/api/flamme-rouge/game/{new_game(client, teams)['game_id']}"
+    headers = {"If-None-Match": client.get(url).headers["etag"]}
+    benchmark.pedantic(client.get, args=(url,), kwargs={"headers": headers}, rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="api get game")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_get_game_msgpack(benchmark, client, teams):
+    url = f"/api/flamme-rouge/game/{new_game(client, teams)['game_id']}"
+    benchmark.pedantic(client.get, args=(url,), kwargs={"headers": {"Accept": "application/msgpack"}},
+                       rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="api turn")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_turn(benchmark, client, teams):
+    """A human team's turn: two select-card requests and one process-turn"""
+
+    def setup():
+        created = new_game(client, teams)
+        riders = own_riders(client, created)
+        return (created["game_id"], token(created), [(r["id"], r["hand"][0]["id"]) for r in riders]), {}
+
+    def turn(game_id, viewer, selections):
+        for rider_id, card_id in selections:
+            response = client.post(f"/api/flamme-rouge/game/{game_id}/select-card",
+                                   params={"viewer": viewer, "rider_id": rider_id, "card_id": card_id})
+            assert response.status_code == 200
+        response = client.post(f"/api/flamme-rouge/game/{game_id}/process-turn")
+        assert response.json()["game_state"]["current_turn"] == 2
+
+    benchmark.pedantic(turn, setup=setup, rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="api turn")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_bulk_turn(benchmark, client, teams):
+    """The same turn as ``bench_turn`` in one request to the turn endpoint"""
+
+    def setup():
+        created = new_game(client, teams)
+        riders = own_riders(client, created)
+        selections = [{"rider_id": r["id"], "card_id": r["hand"][0]["id"]} for r in riders]
+        return (created["game_id"], token(created), selections), {}
+
+    def turn(game_id, viewer, selections):
+        response = client.post(f"/api/flamme-rouge/game/{game_id}/turn", params={"viewer": viewer},
+                               json={"selections": selections})
+        assert response.json()["game_state"]["current_turn"] == 2
+
+    benchmark.pedantic(turn, setup=setup, rounds=ROUNDS)
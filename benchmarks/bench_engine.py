@@ -0,0 +1,86 @@
+"""Micro benchmarks of the rules, Pydantic engine and compact state side by side"""
+import pytest
+
+import compact
+from engine import FlammeRougeEngine, GameState, RiderType, create_new_game
+from rng import GameRandom
+
+TEAMS = [3, 6, 12]
+ROUNDS = 300
+
+
+def team_names(teams):
+    return [f"Team {i}" for i in range(teams)]
+
+
+def ai_game(teams, seed=0) -> GameState:
+    game_state = create_new_game(team_names(teams), rng=GameRandom(seed))
+    for team in game_state.teams:
+        for rider in team.riders:
+            rider.rider_type = RiderType.AI_BOT
+    return game_state
+
+
+@pytest.mark.benchmark(group="create_new_game")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_create_new_game(benchmark, teams):
+    rng = GameRandom(0)
+    benchmark(create_new_game, team_names(teams), rng=rng)
+
+
+@pytest.mark.benchmark(group="draw_cards")
+def bench_draw_cards_engine(benchmark):
+    template = ai_game(3).teams[0]
+    rng = GameRandom(1)
+
+    def setup():
+        team = template.model_copy(deep=True)
+        return (team, team.riders[0]), {"rng": rng}
+
+    benchmark.pedantic(FlammeRougeEngine.draw_cards, setup=setup, rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="draw_cards")
+def bench_draw_cards_compact(benchmark):
+    document = ai_game(3).dict()
+    rng = GameRandom(1)
+    benchmark.pedantic(compact.draw_cards, setup=lambda: ((compact.from_document(document), 0, rng), {}),
+                       rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="calculate_movement")
+def bench_calculate_movement(benchmark):
+    game_state = ai_game(3)
+    card = game_state.teams[0].riders[0].hand[0]
+    tile = game_state.track.tiles[10]
+    benchmark(FlammeRougeEngine.calculate_movement, card, tile, game_state.weather)
+
+
+@pytest.mark.benchmark(group="move_rider")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_move_rider(benchmark, teams):
+    template = ai_game(teams)
+    rng = GameRandom(2)
+
+    def setup():
+        game_state = template.model_copy(deep=True)
+        riders = [r for team in game_state.teams for r in team.riders]
+        return (riders[0], 5, game_state.track, riders, rng), {}
+
+    benchmark.pedantic(FlammeRougeEngine.move_rider, setup=setup, rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="process_turn")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_process_turn_engine(benchmark, teams):
+    template = ai_game(teams)
+    benchmark.pedantic(FlammeRougeEngine.process_turn, setup=lambda: ((template.model_copy(deep=True),), {}),
+                       rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group="process_turn")
+@pytest.mark.parametrize("teams", TEAMS)
+def bench_process_turn_compact(benchmark, teams):
+    document = ai_game(teams).dict()
+    benchmark.pedantic(compact.process_turn, setup=lambda: ((compact.from_document(document),), {}),
+                       rounds=ROUNDS)
@@ -0,0 +1,105 @@
+"""Pydantic GameState vs CompactGame: memory per live game and time per turn.
+
+Usage: python benchmarks/compact_state.py [--games 200] [--teams 4]
+
+"turn" is what the process-turn endpoint does with a stored document:
+parse it, play one turn and dump it back for the database.
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import compact  # noqa: E402
+from engine import FlammeRougeEngine, GameState, RiderType, create_new_game  # noqa: E402
+
+
+def make_documents(games: int, teams: int):
+    documents = []
+    for seed in range(games):
+        game_state = create_new_game([f"Team {i}" for i in range(teams)], rng=random.Random(seed))
+        for rider in game_state.teams[0].riders:
+            rider.rider_type = RiderType.AI_BOT
+        # Serialized like Mongo hands it back: plain strings, nothing shared
+        documents.append(json.dumps(game_state.dict()))
+    return documents
+
+
+def retained_bytes(build, documents) -> float:
+    gc.collect()
+    tracemalloc.start()
+    live = [build(json.loads(raw)) for raw in documents]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del live
+    return size / len(documents)
+
+
+def pydantic_turn(doc: dict, rng):
+    game_state = GameState(**doc)
+    FlammeRougeEngine.process_turn(game_state, rng)
+    return game_state.dict()
+
+
+def compact_turn(doc: dict, rng):
+    game = compact.from_document(doc)
+    compact.process_turn(game, rng)
+    return compact.to_document(game)
+
+
+def time_per_call(func, items, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--teams", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    raw = make_documents(args.games, args.teams)
+    docs = [json.loads(r) for r in raw]
+    states = [GameState(**d) for d in docs]
+    games = [compact.from_document(d) for d in docs]
+
+    rows = [
+        ("memory per live game (KiB)",
+         retained_bytes(lambda d: GameState(**d), raw) / 1024,
+         retained_bytes(compact.from_document, raw) / 1024),
+        ("parse document (us)",
+         time_per_call(lambda d: GameState(**d), docs) * 1e6,
+         time_per_call(compact.from_document, docs) * 1e6),
+        ("dump document (us)",
+         time_per_call(lambda s: s.dict(), states) * 1e6,
+         time_per_call(compact.to_document, games) * 1e6),
+        ("engine turn only (us)",
+         time_per_call(lambda d: FlammeRougeEngine.process_turn(GameState(**d), random.Random(0)), docs) * 1e6
+         - time_per_call(lambda d: GameState(**d), docs) * 1e6,
+         time_per_call(lambda d: compact.process_turn(compact.from_document(d), random.Random(0)), docs) * 1e6
+         - time_per_call(compact.from_document, docs) * 1e6),
+        ("parse + turn + dump (us)",
+         time_per_call(lambda d: pydantic_turn(d, random.Random(0)), docs) * 1e6,
+         time_per_call(lambda d: compact_turn(d, random.Random(0)), docs) * 1e6),
+    ]
+
+    print(f"{args.games} games, {args.teams} teams")
+    print(f"{'':28} {'GameState':>10} {'compact':>10} {'ratio':>7}")
+    for name, before, after in rows:
+        print(f"{name:28} {before:10.1f} {after:10.1f} {before / after:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
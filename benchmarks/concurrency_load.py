@@ -0,0 +1,126 @@
+"""Load test: concurrent card selections on multi-seat games.
+
+Usage: python benchmarks/concurrency_load.py [--games 200] [--workers 2]
+
+Every rider of every game is a human who selects a card through a randomly
+chosen worker (a GameCache, as in one server process), then every game's
+turn is processed once through every worker.  Workers hold stale copies of
+the games, so their versioned writes conflict and get merged.  The baseline
+serializes every request behind one lock and reads and rewrites the
+document each time.  Both runs check that no selection was lost and that
+each turn was processed exactly once.  Needs mongomock-motor.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import compact  # noqa: E402
+from engine import RiderType, create_new_game  # noqa: E402
+from game_cache import GameCache  # noqa: E402
+
+
+async def store_games(collection, count: int, teams: int):
+    requests = []
+    for seed in range(count):
+        game_state = create_new_game([f"Team {i}" for i in range(teams)], rng=random.Random(seed))
+        for team in game_state.teams:
+            for rider in team.riders:
+                rider.rider_type = RiderType.HUMAN
+        await collection.insert_one(game_state.dict())
+        for team in game_state.teams:
+            for rider in team.riders:
+                requests.append((game_state.id, compact.select_card_action(rider.id, rider.hand[0].id)))
+    return requests
+
+
+async def optimistic(collection, requests, workers: int, rng):
+    caches = [GameCache(collection, flush_interval=0.005) for _ in range(workers)]
+    for cache in caches:
+        cache.start()
+
+    async def handle(game_id, action, cache=None):
+        cache = cache or rng.choice(caches)
+        game = await cache.get(game_id)
+        if action is None:
+            action = compact.process_turn_action(game)
+        compact.apply_action(game, action)
+        cache.mark_dirty(game, action)
+        await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handle(game_id, action) for game_id, action in requests))
+    game_ids = {game_id for game_id, _ in requests}
+    await asyncio.gather(*(handle(game_id, None, cache) for game_id in game_ids for cache in caches))
+    for cache in caches:
+        await cache.close()
+    elapsed = time.perf_counter() - start
+    return elapsed, len(requests) + len(game_ids) * workers, sum(cache.conflicts for cache in caches)
+
+
+async def serialized(collection, requests, workers: int, rng):
+    lock = asyncio.Lock()
+
+    async def handle(game_id, action):
+        async with lock:
+            game = compact.from_document(await collection.find_one({"id": game_id}))
+            if action is None:
+                action = compact.process_turn_action(game)
+            try:
+                compact.apply_action(game, action)
+            except compact.ActionRejected:
+                return
+            await collection.update_one({"id": game_id}, {"$set": compact.to_document(game)})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handle(game_id, action) for game_id, action in requests))
+    game_ids = {game_id for game_id, _ in requests}
+    await asyncio.gather(*(handle(game_id, None) for game_id in game_ids for _ in range(workers)))
+    elapsed = time.perf_counter() - start
+    return elapsed, len(requests) + len(game_ids) * workers, 0
+
+
+async def check(collection, requests):
+    riders_per_game = {}
+    for game_id, _ in requests:
+        riders_per_game[game_id] = riders_per_game.get(game_id, 0) + 1
+    lost = 0
+    async for doc in collection.find({}):
+        game = compact.from_document(doc)
+        played = sum(" played " in line for line in game.game_log)
+        moved = sum("moves to" in line or "cannot move" in line for line in game.game_log)
+        expected = riders_per_game[game.id]
+        lost += expected - played
+        assert moved == expected, f"game {game.id}: {moved} moves for {expected} riders"
+        assert game.current_turn == 2
+    return lost
+
+
+async def run(args):
+    for name, strategy in (("serialized", serialized), ("optimistic", optimistic)):
+        collection = AsyncMongoMockClient()["load"]["flamme_rouge_games"]
+        requests = await store_games(collection, args.games, args.teams)
+        rng = random.Random(args.seed)
+        rng.shuffle(requests)
+        elapsed, count, conflicts = await strategy(collection, requests, args.workers, rng)
+        lost = await check(collection, requests)
+        print(f"{name:11} {count / elapsed:9.0f} requests/s  lost updates: {lost}  conflicts merged: {conflicts}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--teams", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""pytest-benchmark suite: engine hot paths and the API served in-process.
+
+Usage, from the repository root:
+
+    python -m pytest benchmarks                      # run, save JSON under .benchmarks/
+    python -m pytest benchmarks --benchmark-compare  # and compare with the last saved run
+    python -m pytest benchmarks --benchmark-compare-fail=median:10%
+    python -m pytest benchmarks --benchmark-json=results.json
+
+``bench_engine.py`` times the rules one call at a time, ``bench_api.py``
+drives the FastAPI app with mongomock-motor standing in for MongoDB.  Every
+run is saved as JSON (``--benchmark-autosave``), numbered and tagged with the
+commit, so regressions show up by comparing runs.
+"""
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# server reads these when imported; no MongoDB is contacted
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+os.environ.setdefault("DB_NAME", "benchmarks")
@@ -0,0 +1,112 @@
+"""Latency of game reads while AI turns are searched, with the search on or off the event loop.
+
+Usage: python benchmarks/loop_latency.py [--turns 4] [--games 4] [--budget-ms 30] [--processes 2]
+
+``--games`` games of AI teams process turns back to back through the API
+(MCTSBot with ``--budget-ms`` per decision) while another client polls a
+game's state every 5 ms.  The poller's latency, from when each poll was
+due, is reported with the search run inline on the event loop, as before,
+on an executor thread and in executor processes (``executor.GameExecutor``).
+MongoDB is played by mongomock-motor.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+os.environ.setdefault("DB_NAME", "benchmarks")
+
+import httpx  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import server  # noqa: E402
+import mcts  # noqa: E402
+from executor import GameExecutor  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class Inline(GameExecutor):
+    async def run(self, fn, *args):
+        return fn(*args)
+
+
+async def measure(turns: int, games: int):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def new_game():
+            response = await client.post("/api/flamme-rouge/new-game", json=[f"AI {i}" for i in range(3)])
+            game_id = response.json()["game_id"]
+            # Every rider searched for, the first team's too
+            game = await server.games.get(game_id)
+            game.ai[:] = b"\1" * len(game.ai)
+            return game_id
+
+        ai_games = [await new_game() for _ in range(games)]
+        polled = await new_game()
+        done = asyncio.Event()
+        latencies = []
+
+        async def play(game_id):
+            for _ in range(turns):
+                response = await client.post(f"/api/flamme-rouge/game/{game_id}/process-turn")
+                response.raise_for_status()
+
+        async def poll():
+            # Every 5 ms, timed from when the poll was due: a blocked loop delays it
+            due = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                await client.get(f"/api/flamme-rouge/game/{polled}")
+                latencies.append(time.perf_counter() - due)
+                due = max(due + 0.005, time.perf_counter())
+
+        poller = asyncio.ensure_future(poll())
+        await asyncio.gather(*(play(game_id) for game_id in ai_games))
+        done.set()
+        await poller
+    latencies.sort()
+    return (len(latencies), statistics.median(latencies) * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000, latencies[-1] * 1000)
+
+
+def run(args):
+    database = AsyncMongoMockClient()["benchmarks"]
+    server.db = database
+    server.games.collection = database.flamme_rouge_games
+    server.games.archive_collection = database.flamme_rouge_archived_games
+    server.history.event_collection = database.flamme_rouge_events
+    server.history.snapshot_collection = database.flamme_rouge_snapshots
+    server.bot = mcts.MCTSBot(budget_ms=args.budget_ms, table=None)
+    executors = (
+        ("inline", Inline()),
+        ("thread", GameExecutor()),
+        (f"{args.processes} procs", GameExecutor(processes=args.processes, initializer=mcts.start_search_process,
+                                                 initargs=(args.budget_ms, 50000))),
+    )
+    print(f"{args.games} AI games x {args.turns} turns, {args.budget_ms} ms per AI decision")
+    print(f"{'search':<10} {'polls':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, executor in executors:
+        server.executor = executor
+        polls, p50, p99, worst = asyncio.run(measure(args.turns, args.games))
+        print(f"{name:<10} {polls:>6} {p50:>8.2f} {p99:>8.2f} {worst:>8.2f}")
+        executor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--games", type=int, default=4)
+    parser.add_argument("--budget-ms", type=float, default=30)
+    parser.add_argument("--processes", type=int, default=2)
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Win rate and decision time of the MCTS bot against the heuristic AI.
+
+Usage: python benchmarks/mcts_strength.py [--races 150] [--budgets 0 5 30]
+
+One team is played by the bot, the others by the heuristic AI, on the
+simulator.  Budget 0 is the heuristic AI in that seat, the baseline: seats
+are not equal, as riders who finish on the same turn are ranked in team
+order.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from mcts import MCTSBot  # noqa: E402
+from simulator import simulate_race  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--races", type=int, default=150)
+    parser.add_argument("--teams", type=int, default=3)
+    parser.add_argument("--seat", type=int, default=None, help="the bot's team, default the last one")
+    parser.add_argument("--budgets", type=float, nargs="+", default=[0, 5, 30])
+    args = parser.parse_args(argv)
+    seat = args.teams - 1 if args.seat is None else args.seat
+
+    print(f"{args.races} races, {args.teams} teams, bot in seat {seat}")
+    print(f"{'budget (ms)':>11} {'win rate':>9} {'ms/decision':>12} {'iterations':>11}")
+    for budget in args.budgets:
+        bot = MCTSBot(budget_ms=budget, seed=0) if budget else None
+        policies = [None] * args.teams
+        if bot is not None:
+            policies[seat] = bot.policy
+        wins = 0
+        started = time.perf_counter()
+        for seed in range(args.races):
+            wins += simulate_race(args.teams, seed=seed, policies=policies).winner_team == seat
+        elapsed = time.perf_counter() - started
+        stats = bot.stats() if bot else {"decisions": 0, "iterations_per_decision": 0}
+        per_decision = elapsed * 1000 / stats["decisions"] if stats["decisions"] else 0.0
+        print(f"{budget:11.0f} {wins / args.races:9.1%} {per_decision:12.1f} "
+              f"{stats['iterations_per_decision']:11.0f}")
+
+
+if __name__ == "__main__":
+    main()
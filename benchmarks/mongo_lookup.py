@@ -0,0 +1,131 @@
+"""Game lookup latency with a million stored games, with and without the indexes.
+
+Usage: python benchmarks/mongo_lookup.py [--games 1000000] [--lookups 2000] [--full]
+
+Fills a scratch database on MONGO_URL (a local mongod by default) with
+``--games`` games, a fifth of them finished, then times what the server
+does against it: ``find_one({"id": ...})`` on random ids, as a cache miss
+does, and the archival query for finished idle games
+(``archive.GameArchive``), first without indexes (a few lookups only, each
+scans the collection) and then with the ones ``GameCache.create_indexes``
+makes.  Last, one archival pass moves the finished games out and the
+lookups are timed again on the smaller collection.
+
+The documents hold the fields these queries use plus the track; ``--full``
+stores whole games instead (about 15 kB each, 15 GB for a million).  Needs a
+running MongoDB.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+from archive import GameArchive  # noqa: E402
+from engine import GamePhase, create_new_game  # noqa: E402
+from game_cache import GameCache  # noqa: E402
+
+
+def documents(count: int, full: bool, rng: random.Random, start: datetime):
+    template = create_new_game(["A", "B", "C"], rng=rng).dict()
+    if not full:
+        template = {key: template[key] for key in ("track", "current_turn", "current_phase", "version")}
+    for i in range(count):
+        finished = i % 5 == 0
+        yield dict(template, id=str(uuid.UUID(int=rng.getrandbits(128))),
+                   current_phase=(GamePhase.GAME_OVER if finished else GamePhase.CARD_SELECTION).value,
+                   updated_at=start - timedelta(seconds=rng.randrange(7 * 86400)))
+
+
+async def fill(collection, count: int, full: bool, rng: random.Random, start: datetime):
+    ids = []
+    batch = []
+    for doc in documents(count, full, rng, start):
+        ids.append(doc["id"])
+        batch.append(doc)
+        if len(batch) == 10_000:
+            await collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+    return ids
+
+
+async def lookups(collection, ids, count: int, rng: random.Random):
+    times = []
+    for game_id in rng.sample(ids, min(count, len(ids))):
+        start = time.perf_counter()
+        await collection.find_one({"id": game_id})
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return (len(times), statistics.median(times) * 1000, times[int(len(times) * 0.99)] * 1000)
+
+
+async def timed(call):
+    start = time.perf_counter()
+    result = await call
+    return result, (time.perf_counter() - start) * 1000
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    client = AsyncIOMotorClient(args.mongo_url)
+    db_name = f"mongo_lookup_{uuid.uuid4().hex[:8]}"
+    db = client[db_name]
+    games = GameCache(db.flamme_rouge_games, archive_collection=db.flamme_rouge_archived_games)
+    archive = GameArchive(db.flamme_rouge_games, db.flamme_rouge_archived_games, after=86400,
+                          batch=args.archive_batch)
+    now = datetime.utcnow()
+    archive.clock = lambda: now
+    finished = {"current_phase": GamePhase.GAME_OVER.value, "updated_at": {"$lt": now - timedelta(days=1)}}
+    try:
+        start = time.perf_counter()
+        ids = await fill(db.flamme_rouge_games, args.games, args.full, rng, now)
+        print(f"{args.games} games stored in {time.perf_counter() - start:.1f} s")
+        print(f"{'':<28} {'lookups':>8} {'p50 ms':>9} {'p99 ms':>9}")
+
+        def report(name, result):
+            print(f"{name:<28} {result[0]:>8} {result[1]:>9.3f} {result[2]:>9.3f}")
+
+        report("find_one, no index", await lookups(db.flamme_rouge_games, ids, args.scan_lookups, rng))
+        _, scan = await timed(db.flamme_rouge_games.count_documents(finished))
+        print(f"{'archival query, no index':<28} {scan:>28.1f} ms")
+
+        _, build = await timed(games.create_indexes())
+        print(f"Indexes built in {build / 1000:.1f} s")
+        report("find_one, indexed", await lookups(db.flamme_rouge_games, ids, args.lookups, rng))
+        candidates, query = await timed(db.flamme_rouge_games.count_documents(finished))
+        print(f"{'archival query, indexed':<28} {query:>28.1f} ms ({candidates} games)")
+
+        moved, elapsed = await timed(archive.archive())
+        print(f"Archived {moved} games in {elapsed / 1000:.1f} s")
+        # Archived ids included: a miss costs the same index lookup
+        report("find_one after archival", await lookups(db.flamme_rouge_games, ids, args.lookups, rng))
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--scan-lookups", type=int, default=20, help="Lookups timed without an index")
+    parser.add_argument("--archive-batch", type=int, default=1000)
+    parser.add_argument("--full", action="store_true", help="Store whole games")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Multi-worker check: games played through several uvicorn workers sharing one MongoDB.
+
+Usage: python benchmarks/multi_worker.py [--workers 4] [--games 50] [--turns 10] [--kill]
+
+Starts ``--workers`` uvicorn processes on consecutive ports, each with its
+own WORKER_ADDRESS, against MONGO_URL (a local mongod by default) and a
+scratch database.  Every request of every game goes to a random worker,
+which serves it or forwards it to the game's owner (``ownership``).  Half
+way through, one worker is stopped (SIGTERM, or SIGKILL with ``--kill``)
+and the games it owned move to the others.  At the end every game must
+have played exactly the turns that were acknowledged; after a SIGKILL the
+turns the dead worker had not flushed are reported as lost.  Needs uvicorn
+and a running MongoDB.
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+from pymongo import MongoClient
+
+BACKEND = Path(__file__).resolve().parent.parent / "backend"
+
+
+def start_workers(count: int, port: int, mongo_url: str, db_name: str, lease_ttl: float):
+    workers = []
+    secret = uuid.uuid4().hex
+    for i in range(count):
+        address = f"http://127.0.0.1:{port + i}"
+        env = dict(os.environ, MONGO_URL=mongo_url, DB_NAME=db_name, WORKER_ADDRESS=address,
+                   WORKER_ID=f"worker-{i}", WORKER_SECRET=secret, GAME_LEASE_TTL=str(lease_ttl),
+                   AI_TIME_BUDGET_MS="0", GAME_CACHE_FLUSH_INTERVAL="0.2")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port + i), "--log-level", "warning"],
+            cwd=BACKEND, env=env)
+        workers.append((address, process))
+    return workers
+
+
+async def wait_ready(client, addresses):
+    deadline = time.monotonic() + 30
+    for address in addresses:
+        while True:
+            try:
+                (await client.get(f"{address}/api/flamme-rouge/tracks")).raise_for_status()
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def request(client, addresses, rng, method, path, **kwargs):
+    """Through a random live worker, retried while a game moves to a new owner
+
+    Only requests that were not served are retried: a turn must not be
+    played twice.
+    """
+    for _ in range(100):
+        try:
+            response = await client.request(method, f"{rng.choice(addresses)}{path}", **kwargs)
+        except httpx.ConnectError:
+            response = None
+        if response is not None and response.status_code != 503:
+            return response
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{method} {path} kept failing")
+
+
+async def play(client, addresses, rng, turns: int, stopped: asyncio.Event):
+    created = (await request(client, addresses, rng, "POST", "/api/flamme-rouge/new-game",
+                             json=["Human", "AI 1", "AI 2"])).json()
+    game_id, viewer = created["game_id"], created["tokens"][created["game_state"]["teams"][0]["id"]]
+    acknowledged = 0
+    for turn in range(turns):
+        if turn == turns // 2:
+            await stopped.wait()
+        state = (await request(client, addresses, rng, "GET", f"/api/flamme-rouge/game/{game_id}",
+                               params={"viewer": viewer})).json()["game_state"]
+        if state["current_phase"] == "game_over":
+            break
+        selections = [{"rider_id": r["id"], "card_id": r["hand"][0]["id"]}
+                      for r in state["teams"][0]["riders"] if not r["finished"] and r["hand"]]
+        response = await request(client, addresses, rng, "POST", f"/api/flamme-rouge/game/{game_id}/turn",
+                                 params={"viewer": viewer}, json={"selections": selections})
+        if response.status_code == 200:
+            acknowledged += 1
+    return game_id, acknowledged
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    db_name = f"multi_worker_{uuid.uuid4().hex[:8]}"
+    workers = start_workers(args.workers, args.port, args.mongo_url, db_name, args.lease_ttl)
+    addresses = [address for address, _ in workers]
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            await wait_ready(client, addresses)
+            stopped = asyncio.Event()
+            start = time.perf_counter()
+            games = asyncio.gather(*(play(client, addresses, rng, args.turns, stopped) for _ in range(args.games)))
+            await asyncio.sleep(0.5)
+            victim, process = workers[-1]
+            process.send_signal(signal.SIGKILL if args.kill else signal.SIGTERM)
+            process.wait()
+            addresses.remove(victim)
+            stopped.set()
+            results = await games
+            elapsed = time.perf_counter() - start
+
+            lost = 0
+            for game_id, acknowledged in results:
+                state = (await request(client, addresses, rng, "GET", f"/api/flamme-rouge/game/{game_id}",
+                                       params={"fields": "current_turn,current_phase"})).json()["game_state"]
+                played = state["current_turn"] - (state["current_phase"] != "game_over")
+                if played > acknowledged:
+                    raise AssertionError(f"{game_id}: {played} turns played, {acknowledged} acknowledged")
+                lost += acknowledged - played
+            turns = sum(acknowledged for _, acknowledged in results)
+            print(f"{args.games} games, {turns} turns through {args.workers} workers in {elapsed:.1f} s, "
+                  f"worker {victim} {'killed' if args.kill else 'stopped'} half way")
+            print(f"Turns lost: {lost}" + ("" if args.kill else " (must be 0)"))
+            if lost and not args.kill:
+                raise AssertionError("Turns were lost")
+    finally:
+        for _, process in workers:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+        MongoClient(args.mongo_url).drop_database(db_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--lease-ttl", type=float, default=3.0)
+    parser.add_argument("--kill", action="store_true", help="SIGKILL the worker instead of stopping it")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
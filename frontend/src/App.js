@@ -4,6 +4,10 @@ import axios from "axios";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+// Log lines kept, as many as the server sends (compact.LOG_TAIL)
+const LOG_TAIL = 20;
+// Wait before connecting the game socket again
+const RECONNECT_MS = 1000;
 
 // Terrain icons and colors
 const TERRAIN_CONFIG = {
@@ -315,9 +319,9 @@ const PlayerHand = ({ rider, team, onCardSelect, selectedCard, canSelect, gamePh
       {/* Deck Status */}
       <div className="mt-4 pt-4 border-t border-gray-200">
         <div className="flex justify-between text-sm text-gray-600">
-          <span>Sprinteur: {team.sprinteur_deck.length} cards</span>
-          <span>Rouleur: {team.rouleur_deck.length} cards</span>
-          <span>Fatigue: {team.fatigue_deck.length} cards</span>
+          <span>Sprinteur: {team.sprinteur_deck_count} cards</span>
+          <span>Rouleur: {team.rouleur_deck_count} cards</span>
+          <span>Fatigue: {team.fatigue_deck_count} cards</span>
         </div>
       </div>
     </div>
@@ -380,14 +384,86 @@ const GameLog = ({ log, maxEntries = 8 }) => {
   );
 };
 
+// Apply the JSON Patch operations pushed by the game WebSocket, keeping the tail of the log
+const applyPatch = (state, ops) => {
+  const next = structuredClone(state);
+  for (const op of ops) {
+    const keys = op.path.split("/").slice(1);
+    const last = keys.pop();
+    const target = keys.reduce((node, key) => node[key], next);
+    if (op.op === "add" && last === "-") {
+      target.push(op.value);
+    } else {
+      target[last] = op.value;
+    }
+  }
+  next.game_log = next.game_log.slice(-LOG_TAIL);
+  return next;
+};
+
+// A state from a request, unless the socket already brought a newer one
+const newest = (next) => (prev) => (!prev || next.revision >= prev.revision ? next : prev);
+
 // Main Game Component
 const FlammeRougeGame = () => {
   const [gameState, setGameState] = useState(null);
   const [gameId, setGameId] = useState(null);
+  // The human team: the server only shows its hands to whoever views the game as it
+  const [viewer, setViewer] = useState(null);
   const [selectedCards, setSelectedCards] = useState({});
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [animations, setAnimations] = useState({});
+  const [track, setTrack] = useState(null);
+
+  // Games only carry a reference to their track, its tiles never change
+  const trackId = gameState?.track.id;
+  useEffect(() => {
+    if (!trackId || track?.id === trackId) return;
+    axios.get(`${API}/flamme-rouge/tracks/${trackId}`)
+      .then(response => setTrack(response.data.track))
+      .catch(err => setError('Failed to load track: ' + err.message));
+  }, [trackId, track]);
+
+  // The game socket sends a snapshot then the changes of every action, ours included
+  useEffect(() => {
+    if (!gameId || !viewer) return;
+    const url = `${API.replace(/^http/, "ws")}/flamme-rouge/game/${gameId}/ws?viewer=${viewer}`;
+    let socket;
+    let retry;
+    let stopped = false;
+    const connect = () => {
+      let seq = null;
+      socket = new WebSocket(url);
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === "snapshot") {
+          seq = message.seq;
+          setGameState(message.game_state);
+        } else if (message.type === "patch") {
+          if (seq === null || message.seq !== seq + 1) {
+            // Missed a change: start over from a snapshot
+            socket.close();
+            return;
+          }
+          seq = message.seq;
+          // Already in the state a request answered with
+          const revision = message.ops.find(op => op.path === "/revision")?.value;
+          setGameState(prev => prev && (revision <= prev.revision ? prev : applyPatch(prev, message.ops)));
+        }
+      };
+      // Dropped, or turned away by a busy server (1013): connect again, the snapshot catches up
+      socket.onclose = () => {
+        if (!stopped) retry = setTimeout(connect, RECONNECT_MS);
+      };
+    };
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retry);
+      socket.close();
+    };
+  }, [gameId, viewer]);
 
   const createNewGame = async () => {
     setLoading(true);
@@ -401,8 +477,14 @@ const FlammeRougeGame = () => {
       ]);
       
       if (response.data.status === 'success') {
-        setGameId(response.data.game_id);
-        setGameState(response.data.game_state);
+        // A spectator's view, without the hands: fetch the human team's with
+        // its token, which only this response tells
+        const gameId = response.data.game_id;
+        const token = response.data.tokens[response.data.game_state.teams[0].id];
+        const view = await axios.get(`${API}/flamme-rouge/game/${gameId}`, { params: { viewer: token } });
+        setGameId(gameId);
+        setViewer(token);
+        setGameState(view.data.game_state);
       }
     } catch (err) {
       setError('Failed to create game: ' + err.message);
@@ -418,12 +500,13 @@ const FlammeRougeGame = () => {
       const response = await axios.post(`${API}/flamme-rouge/game/${gameId}/select-card`, null, {
         params: {
           rider_id: riderId,
-          card_id: card.id
+          card_id: card.id,
+          viewer
         }
       });
       
       if (response.data.status === 'success') {
-        setGameState(response.data.game_state);
+        setGameState(newest(response.data.game_state));
         setSelectedCards(prev => ({ ...prev, [riderId]: card }));
       }
     } catch (err) {
@@ -439,10 +522,12 @@ const FlammeRougeGame = () => {
     setAnimations({ moving: true });
     
     try {
-      const response = await axios.post(`${API}/flamme-rouge/game/${gameId}/process-turn`);
+      const response = await axios.post(`${API}/flamme-rouge/game/${gameId}/process-turn`, null, {
+        params: { viewer }
+      });
       
       if (response.data.status === 'success') {
-        setGameState(response.data.game_state);
+        setGameState(newest(response.data.game_state));
         setSelectedCards({});
         
         // Animate movement
@@ -549,11 +634,13 @@ const FlammeRougeGame = () => {
         )}
 
         {/* Track Display */}
-        <TrackComponent 
-          track={gameState.track} 
-          riders={allRiders}
-          highlightPositions={allRiders.map(r => r.position.track_position)}
-        />
+        {track && (
+          <TrackComponent 
+            track={track} 
+            riders={allRiders}
+            highlightPositions={allRiders.map(r => r.position.track_position)}
+          />
+        )}
 
         {/* Game Stats */}
         <GameStats gameState={gameState} />
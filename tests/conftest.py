@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The backend modules import each other as top-level modules (uvicorn runs
+# ``server:app`` from inside backend/), mirror that for the tests.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,73 @@
+import asyncio
+import random
+from datetime import datetime
+
+import pytest
+
+import compact
+from archive import GameArchive
+from engine import GamePhase, create_new_game
+from game_cache import GameCache
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_finished_idle_games_move_to_the_archive():
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    games, archived = database.flamme_rouge_games, database.flamme_rouge_archived_games
+    cache = GameCache(games, archive_collection=archived)
+    archive = GameArchive(games, archived, after=3600, batch=2)
+    archive.clock = lambda: datetime(2024, 1, 2)
+
+    async def store(phase, updated_at):
+        doc = create_new_game(["A", "B"], rng=random.Random(len(ids))).dict()
+        doc.update(current_phase=phase.value, updated_at=updated_at)
+        await games.insert_one(doc)
+        ids.append(doc["id"])
+
+    async def scenario():
+        await cache.create_indexes()
+        for _ in range(3):
+            await store(GamePhase.GAME_OVER, datetime(2024, 1, 1))
+        await store(GamePhase.GAME_OVER, datetime(2024, 1, 1, 23, 30))
+        await store(GamePhase.CARD_SELECTION, datetime(2023, 1, 1))
+        # Copied by a pass that did not get to delete it
+        await archived.insert_one(await games.find_one({"id": ids[0]}))
+
+        assert await archive.archive(live=lambda: {ids[2]}) == 2
+        assert sorted(doc["id"] for doc in await games.find().to_list(None)) == sorted(ids[2:])
+        assert await archived.count_documents({}) == 2
+
+        assert await cache.exists(ids[0]) and await cache.exists(ids[2]) and not await cache.exists("missing")
+
+        # Still readable, moved back from the archive so that its writes land
+        game = await cache.get(ids[1])
+        assert game.id == ids[1] and game.current_phase == GamePhase.GAME_OVER
+        assert await archived.count_documents({}) == 1 and await games.find_one({"id": ids[1]})
+        compact.add_log(game, "Rematch?")
+        cache.mark_dirty(game)
+        await cache.flush()
+        assert (await games.find_one({"id": ids[1]}))["game_log"][-1] == "Rematch?"
+
+        # Cached and freshly written: left in place
+        assert await archive.archive(live=cache.game_ids) == 1
+        assert archive.stats() == {"archived": 3, "passes": 2}
+
+    ids = []
+    asyncio.run(scenario())
+
+
+def test_background_tasks_restart_on_a_new_event_loop():
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    cache = GameCache(database.flamme_rouge_games)
+    archive = GameArchive(database.flamme_rouge_games, database.flamme_rouge_archived_games)
+
+    async def run():
+        cache.start()
+        archive.start()
+        await asyncio.sleep(0.01)
+        await archive.close()
+
+    # As two test clients do, one after the other
+    asyncio.run(run())
+    asyncio.run(run())
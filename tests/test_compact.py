@@ -0,0 +1,167 @@
+import asyncio
+import random
+
+import pytest
+
+import compact
+from engine import FlammeRougeEngine, GamePhase, GameState, create_new_game
+
+
+def assert_same_game(game, game_state):
+    """Compare with an engine game, whose log is never moved out"""
+    expected = game_state.dict()
+    expected["log_count"] = len(expected["game_log"])
+    expected["game_log"] = expected["game_log"][-compact.LOG_TAIL:]
+    assert compact.to_state(game) == GameState(**expected)
+
+
+def test_document_round_trip():
+    game_state = create_new_game(["A", "B", "C"], rng=random.Random(1))
+    FlammeRougeEngine.process_turn(game_state, random.Random(2))
+    game = compact.from_state(game_state)
+    assert_same_game(game, game_state)
+    assert compact.to_document(compact.from_document(compact.to_document(game))) == compact.to_document(game)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_compact_turns_match_engine(seed):
+    game_state = create_new_game(["Human", "AI 1", "AI 2", "AI 3"], rng=random.Random(seed))
+    game = compact.from_state(game_state)
+    engine_rng, compact_rng = random.Random(seed), random.Random(seed)
+
+    for _ in range(40):
+        # The human plays its first card like the select-card endpoint does
+        for rider in game_state.teams[0].riders:
+            if rider.hand and rider.played_card is None:
+                card = rider.hand[0]
+                FlammeRougeEngine.play_card(game_state.teams[0], rider, card)
+                game_state.game_log.append(f"{rider.name} played {card.type} {card.value}")
+                r = compact.find_rider(game, rider.id)
+                index = compact.find_card(game, r, card.id)
+                compact.play_card(game, r, index)
+                compact.add_log(game, f"{game.rider_names[r]} played {compact.card_label(game, index)}")
+
+        FlammeRougeEngine.process_turn(game_state, engine_rng)
+        compact.process_turn(game, compact_rng)
+        assert_same_game(game, game_state)
+        if game_state.current_phase == GamePhase.GAME_OVER:
+            break
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_delta_updates_match_full_rewrite(seed):
+    mongomock = pytest.importorskip("mongomock")
+    database = mongomock.MongoClient().db
+    game = compact.from_state(create_new_game(["Human", "AI 1", "AI 2"], rng=random.Random(seed)))
+    for collection in (database.delta, database.full):
+        collection.insert_one(compact.to_document(game))
+    rng = random.Random(seed)
+
+    for _ in range(30):
+        for rider in range(2):
+            if game.hands[rider] and game.played[rider] == compact.NO_CARD:
+                card = game.hands[rider][-1]
+                compact.play_card(game, rider, card)
+                compact.add_log(game, f"{game.rider_names[rider]} played {compact.card_label(game, card)}")
+        update, entries = compact.take_update(game)
+        database.delta.update_one(compact.version_filter(game), update)
+        if entries:
+            database.log.insert_many(entries)
+        game.version += 1
+        compact.process_turn(game, rng)
+        if seed % 2:
+            # A write that may not have landed is redone in full
+            compact.mark_unsaved(game)
+        update, entries = compact.take_update(game)
+        assert database.delta.update_one(compact.version_filter(game), update).matched_count
+        if entries:
+            database.log.insert_many(entries)
+            compact.trim_log(game, entries[-1]["seq"])
+        game.version += 1
+        database.full.update_one({"id": game.id}, {"$set": compact.to_document(game)})
+
+        assert database.delta.find_one({}, {"_id": False}) == database.full.find_one({}, {"_id": False})
+        if game.current_phase == GamePhase.GAME_OVER:
+            break
+
+    stored = database.delta.find_one({})
+    lines = list(database.log.find({"game_id": game.id}).sort("seq"))
+    assert [entry["seq"] for entry in lines] == list(range(stored["log_count"]))
+    assert [entry["line"] for entry in lines[-compact.LOG_TAIL:]] == stored["game_log"]
+    assert len(game.game_log) == len(stored["game_log"]) == compact.LOG_TAIL
+
+
+def test_select_card_update_is_targeted():
+    game = compact.from_state(create_new_game(["Human", "AI"], rng=random.Random(0)))
+    card = game.hands[0][0]
+    compact.play_card(game, 0, card)
+    compact.add_log(game, "played")
+    update, entries = compact.take_update(game)
+    pile = "sprinteur_discard" if game.card_types[card] == compact.SPRINTEUR else "rouleur_discard"
+    assert set(update["$set"]) == {
+        "teams.0.riders.0.hand", "teams.0.riders.0.played_card", f"teams.0.{pile}",
+        "current_turn", "current_phase", "active_team_index", "weather", "log_count", "version", "revision",
+    }
+    assert update["$push"] == {"game_log": {"$each": ["played"], "$slice": -compact.LOG_TAIL}}
+    assert entries == [{"game_id": game.id, "seq": 0, "turn": 1, "line": "played"}]
+    assert compact.take_update(game) == ({"$set": {
+        "current_turn": 1, "current_phase": "card_selection", "active_team_index": 0, "weather": "none",
+        "log_count": 1, "version": 1, "revision": 0,
+    }}, [])
+
+
+def test_document_fields_are_a_projection_of_the_document():
+    game = compact.from_state(create_new_game(["Human", "AI"], rng=random.Random(0)))
+    document = compact.to_document(game)
+    assert tuple(document) == compact.DOCUMENT_FIELDS
+    for fields in ({"current_turn"}, {"teams", "version"}, set(compact.DOCUMENT_FIELDS)):
+        assert compact.to_document(game, fields) == {key: document[key] for key in fields}
+
+    etag = compact.etag(game.revision)
+    with pytest.raises(compact.ActionRejected):
+        compact.apply_action(game, compact.select_card_action("missing", "missing"))
+    assert compact.etag(game.revision) == etag
+    compact.apply_action(game, compact.process_turn_action(game))
+    assert compact.etag(game.revision) != etag
+
+
+def test_view_hides_what_other_teams_may_not_see():
+    game = compact.from_state(create_new_game(["Human", "Rival"], rng=random.Random(0)))
+    compact.select_card(game, game.rider_ids[0], game.card_ids[game.hands[0][0]])
+    compact.select_card(game, game.rider_ids[2], game.card_ids[game.hands[2][0]])
+    document = compact.to_document(game)
+    view = compact.to_view(game, game.team_ids[0])
+    assert "rng_state" not in view
+    own, rival = view["teams"]
+    assert own["riders"][0]["hand"] == document["teams"][0]["riders"][0]["hand"]
+    assert own["riders"][0]["played_card"] == document["teams"][0]["riders"][0]["played_card"]
+    assert rival["riders"][0]["hand"] is None and rival["riders"][0]["hand_count"] == 3
+    assert rival["riders"][0]["played_card"] is None and rival["riders"][0]["card_selected"]
+    assert own["sprinteur_deck_count"] == len(document["teams"][0]["sprinteur_deck"])
+    assert "sprinteur_deck" not in own
+    assert document["teams"][0]["token"] == game.team_tokens[0] and "token" not in own
+    assert compact.to_view(game, game.team_ids[0], {"current_turn"}) == {"current_turn": 1}
+
+
+def test_view_pipeline_builds_the_same_view():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    game = compact.from_state(create_new_game(["Human", "Rival"], rng=random.Random(1)))
+    compact.select_card(game, game.rider_ids[2], game.card_ids[game.hands[2][0]])
+    collection = mongomock_motor.AsyncMongoMockClient()["test"]["games"]
+
+    async def view(token, fields=None):
+        return (await collection.aggregate(compact.view_pipeline(game.id, token, fields)).to_list(1))[0]
+
+    async def check():
+        await collection.insert_one(compact.to_document(game))
+        for team_id, token in zip(game.team_ids, game.team_tokens):
+            stored = await view(token)
+            assert stored.pop("viewer") and stored == compact.to_view(game, team_id)
+        spectator = await view(None)
+        assert not spectator.pop("viewer") and spectator == compact.to_view(game, None)
+        # Ids are public, only tokens show hands
+        assert not (await view(game.team_ids[0]))["viewer"]
+        assert not (await view("$teams"))["viewer"]
+        assert set(await view(game.team_tokens[0], {"weather"})) == {"weather", "version", "revision", "viewer"}
+
+    asyncio.run(check())
@@ -0,0 +1,66 @@
+import random
+
+from engine import (
+    MAX_CARD_VALUE, WEATHERS, FlammeRougeEngine, GamePhase, RiderType, TrackOccupancy, create_new_game,
+    movement_for, tables_for, tile_weather,
+)
+
+
+def test_occupancy_tracks_shared_lanes_and_finish():
+    track = FlammeRougeEngine.create_sample_track()
+    game_state = create_new_game(["A", "B", "C"], rng=random.Random(3))
+    riders = [r for team in game_state.teams for r in team.riders]
+    occupancy = TrackOccupancy.from_riders(track, riders)
+
+    # Six riders share the two start lanes
+    assert occupancy.riders_at(0) == 6
+    assert not occupancy.is_free(0)
+    assert occupancy.free_lanes(0) == []
+
+    occupancy.move(riders[0], 5, 1)
+    assert occupancy.riders_at(0) == 5
+    assert occupancy.free_lanes(5) == [0]
+    assert occupancy.is_free(5)
+    assert occupancy.rider_ahead(4)
+    assert not occupancy.rider_ahead(5)
+
+    occupancy.move(riders[1], 5, 0)
+    assert not occupancy.is_free(5)
+    assert occupancy.first_blocked(0, 9) == 5
+    assert occupancy.first_blocked(0, 4) is None
+    assert occupancy.first_blocked(5, 9) is None
+
+    # Riders on the finish line leave the track
+    occupancy.move(riders[0], track.length - 1, 0)
+    assert occupancy.riders_at(5) == 1
+    assert occupancy.riders_at(track.length - 1) == 0
+
+
+def test_large_field_runs_to_the_end():
+    rng = random.Random(8)
+    game_state = create_new_game([f"Team {i}" for i in range(12)], rng=rng)
+    for rider in game_state.teams[0].riders:
+        rider.rider_type = RiderType.AI_BOT
+    for _ in range(10):
+        FlammeRougeEngine.process_turn(game_state, rng)
+        if game_state.current_phase == GamePhase.GAME_OVER:
+            break
+    riders = [r for team in game_state.teams for r in team.riders]
+    assert len(riders) == 24
+    for position in {r.position.track_position for r in riders if not r.finished}:
+        lanes = [r.position.lane for r in riders if not r.finished and r.position.track_position == position]
+        if position:
+            assert len(lanes) == len(set(lanes)) <= game_state.track.tiles[position].lanes
+
+
+def test_track_tables_are_shared_and_match_the_rules():
+    first, second = (create_new_game(["A", "B"], rng=random.Random(seed)).track for seed in (1, 2))
+    assert first.id == second.id
+    tables = tables_for(first)
+    assert tables_for(second) is tables
+    assert len(tables.lanes) == first.length + 1 and tables.lanes[-1] == 0
+    for weather in WEATHERS:
+        for tile in first.tiles:
+            for value in range(MAX_CARD_VALUE + 1):
+                expected = movement_for(value, tile.terrain, tile_weather(tile.weather, weather))
+                assert tables.move(tile.position, value, weather) == expected
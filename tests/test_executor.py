@@ -0,0 +1,123 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import pytest
+
+from executor import GameExecutor, Overloaded
+
+
+def test_one_request_at_a_time_per_game():
+    executor = GameExecutor()
+    events = []
+
+    async def hold(game_id, name):
+        async with executor.game(game_id):
+            events.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name} end")
+
+    async def scenario():
+        await asyncio.gather(hold("a", "first"), hold("a", "second"), hold("b", "other"))
+
+    asyncio.run(scenario())
+    assert events.index("first end") < events.index("second start")
+    assert events.index("other start") < events.index("first end")
+    assert executor.stats()["games"] == 0
+
+
+def test_work_runs_off_the_loop_within_bounds():
+    executor = GameExecutor(max_pending=1, max_waiting=0)
+    release = threading.Event()
+
+    async def scenario():
+        assert await executor.run(lambda: threading.current_thread().name) != threading.current_thread().name
+        blocked = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await executor.run(time.time)
+        release.set()
+        await blocked
+
+        async with executor.game("a"):
+            with pytest.raises(Overloaded):
+                async with executor.game("a"):
+                    pass
+
+    asyncio.run(scenario())
+    assert executor.stats()["rejected"] == 2
+    executor.close()
+
+
+def test_reads_go_on_during_a_slow_ai_turn(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    httpx = pytest.importorskip("httpx")
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+    os.environ.setdefault("DB_NAME", "test")
+    import server
+
+    class SlowBot:
+        def select_cards(self, game):
+            time.sleep(0.3)
+            return {}
+
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "bot", SlowBot())
+    monkeypatch.setattr(server, "executor", GameExecutor())
+    monkeypatch.setattr(server.games, "collection", database.flamme_rouge_games)
+    monkeypatch.setattr(server.games, "archive_collection", database.flamme_rouge_archived_games)
+    monkeypatch.setattr(server.history, "event_collection", database.flamme_rouge_events)
+    monkeypatch.setattr(server.history, "snapshot_collection", database.flamme_rouge_snapshots)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            slow, other = [(await client.post("/api/flamme-rouge/new-game", json=["AI 1", "AI 2"])).json()
+                           for _ in range(2)]
+            turn = asyncio.ensure_future(client.post(f"/api/flamme-rouge/game/{slow['game_id']}/process-turn"))
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            response = await client.get(f"/api/flamme-rouge/game/{other['game_id']}")
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 200 and not turn.done()
+            assert elapsed < 0.2
+            assert (await turn).status_code == 200
+
+    asyncio.run(scenario())
+
+
+def test_search_in_a_process():
+    import compact
+    import mcts
+    from engine import RiderType, create_new_game
+    from simulator import VALUE_MASK
+
+    game_state = create_new_game(["Human", "AI 1", "AI 2"], rng=random.Random(1))
+    for team in game_state.teams[1:]:
+        for rider in team.riders:
+            rider.rider_type = RiderType.AI_BOT
+    game = compact.from_state(game_state)
+    decisions = mcts.plan_decisions(game)
+    assert [team for team, _, _, _ in decisions] == [1, 2]
+    executor = GameExecutor(processes=1, initializer=mcts.start_search_process, initargs=(5, 100))
+
+    async def scenario():
+        first = await executor.run(mcts.search_in_process, decisions)
+        # The same situations pickled over again: answered from the process's memo
+        second = await executor.run(mcts.search_in_process, mcts.plan_decisions(game))
+        return first, second
+
+    (choices, pid, counters), (again, _, after) = asyncio.run(scenario())
+    executor.close()
+    # Counted by the bot of the search process
+    assert pid != os.getpid() and counters["decisions"] == 2 and counters["table_misses"]
+    assert after["table_hits"] == counters["table_misses"] and after["table_size"] == counters["table_size"]
+    # The memo keeps card values, a card of the same value may stand in
+    assert after["memoized"] == 2
+    assert {r: card & VALUE_MASK for r, card in again.items()} == {r: card & VALUE_MASK for r, card in choices.items()}
+    cards = compact.ai_cards_action(game, mcts.Decided(choices))[2]
+    assert sorted(compact.find_rider(game, rider_id) for rider_id, _ in cards) == [
+        r for r in range(game.rider_count) if game.ai[r]]
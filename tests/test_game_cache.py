@@ -0,0 +1,190 @@
+import asyncio
+import random
+from datetime import datetime
+
+import pytest
+
+import compact
+from engine import GamePhase, create_new_game
+from game_cache import GameCache
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def new_collection():
+    return mongomock_motor.AsyncMongoMockClient()["test"]["flamme_rouge_games"]
+
+
+async def store_games(collection, count):
+    docs = [create_new_game(["A", "B"], rng=random.Random(seed)).dict() for seed in range(count)]
+    for doc in docs:
+        await collection.insert_one(dict(doc))
+    return [doc["id"] for doc in docs]
+
+
+def test_hits_skip_mongo_and_writes_are_coalesced():
+    async def scenario():
+        collection = new_collection()
+        (game_id,) = await store_games(collection, 1)
+        cache = GameCache(collection)
+
+        game = await cache.get(game_id)
+        await collection.delete_many({})
+        assert await cache.get(game_id) is game
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert await cache.get("missing") is None
+
+        await collection.insert_one(compact.to_document(game))
+        for seed in range(3):
+            compact.process_turn(game, random.Random(seed))
+            cache.mark_dirty(game)
+        assert await cache.flush() == 1
+        assert await cache.flush() == 0
+        stored = await collection.find_one({"id": game_id}, {"_id": False})
+        assert isinstance(stored.pop("updated_at"), datetime)
+        assert stored == compact.to_document(game)
+
+    asyncio.run(scenario())
+
+
+def test_evicted_dirty_games_are_not_reloaded_stale():
+    async def scenario():
+        collection = new_collection()
+        ids = await store_games(collection, 3)
+        cache = GameCache(collection, max_games=2)
+
+        first = await cache.get(ids[0])
+        compact.process_turn(first, random.Random(0))
+        cache.mark_dirty(first)
+        await cache.get(ids[1])
+        await cache.get(ids[2])
+        assert cache.evictions == 1 and len(cache) == 2
+
+        # Still waiting for its write: served from memory
+        assert await cache.get(ids[0]) is first
+        await cache.close()
+        stored = await collection.find_one({"id": ids[0]}, {"_id": False, "updated_at": False})
+        assert stored == compact.to_document(first)
+
+    asyncio.run(scenario())
+
+
+def test_idle_games_expire():
+    async def scenario():
+        collection = new_collection()
+        ids = await store_games(collection, 2)
+        clock = Clock()
+        cache = GameCache(collection, ttl=60, clock=clock)
+
+        await cache.get(ids[0])
+        clock.now = 45
+        await cache.get(ids[1])
+        clock.now = 90
+        cache.expire()
+        assert len(cache) == 1 and cache.evictions == 1
+        await cache.get(ids[0])
+        assert cache.misses == 3
+
+    asyncio.run(scenario())
+
+
+def test_etags_are_not_reused_after_a_reload():
+    async def scenario():
+        collection = new_collection()
+        (game_id,) = await store_games(collection, 1)
+        clock = Clock()
+        cache = GameCache(collection, ttl=60, clock=clock)
+
+        etags = []
+        for _ in range(2):
+            game = await cache.get(game_id)
+            action = compact.process_turn_action(game)
+            compact.apply_action(game, action)
+            cache.mark_dirty(game, action)
+            await cache.flush()
+            etags.append(compact.etag(game.revision))
+            clock.now += 90
+            cache.expire()
+        assert cache.misses == 2
+        assert etags[0] != etags[1]
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_workers_merge_selections():
+    async def scenario():
+        collection = new_collection()
+        game_state = create_new_game(["A", "B", "C"], rng=random.Random(4))
+        for team in game_state.teams:
+            for rider in team.riders:
+                rider.rider_type = "human"
+        await collection.insert_one(game_state.dict())
+        workers = [GameCache(collection), GameCache(collection)]
+
+        # Each rider picks a card through either worker, from a stale copy
+        riders = [rider for team in game_state.teams for rider in team.riders]
+        for i, rider in enumerate(riders):
+            cache = workers[i % 2]
+            game = await cache.get(game_state.id)
+            action = compact.select_card_action(rider.id, rider.hand[0].id)
+            compact.apply_action(game, action)
+            cache.mark_dirty(game, action)
+        # Both process the turn, which must only happen once
+        for cache in workers:
+            game = await cache.get(game_state.id)
+            action = compact.process_turn_action(game)
+            compact.apply_action(game, action)
+            cache.mark_dirty(game, action)
+        for cache in workers:
+            await cache.close()
+
+        stored = compact.from_document(await collection.find_one({"id": game_state.id}))
+        assert workers[1].conflicts == 1
+        assert stored.current_turn == 2
+        assert all(f"{rider.name} played" in " ".join(stored.game_log) for rider in riders)
+        # Every rider moved exactly once
+        assert sum("moves to" in line or "cannot move" in line for line in stored.game_log) == len(riders)
+        assert stored.version == 2
+
+    asyncio.run(scenario())
+
+
+def test_log_moves_out_of_the_game_document():
+    async def scenario():
+        database = mongomock_motor.AsyncMongoMockClient()["test"]
+        (game_id,) = await store_games(database.flamme_rouge_games, 1)
+        cache = GameCache(database.flamme_rouge_games, log_collection=database.flamme_rouge_logs)
+        await cache.create_indexes()
+        game = await cache.get(game_id)
+        game.ai[:] = bytes([1] * game.rider_count)
+
+        rng = random.Random(0)
+        while game.current_phase != GamePhase.GAME_OVER and game.current_turn < 15:
+            compact.process_turn(game, rng)
+            cache.mark_dirty(game)
+            await cache.flush()
+        compact.add_log(game, "not written yet")
+
+        stored = await database.flamme_rouge_games.find_one({"id": game_id})
+        assert len(stored["game_log"]) == compact.LOG_TAIL < stored["log_count"]
+        pages, since = [], -1
+        while True:
+            page = await cache.log_entries(game, since, limit=7)
+            if not page:
+                break
+            pages.append(page)
+            since = page[-1]["seq"]
+        entries = [entry for page in pages for entry in page]
+        assert [entry["seq"] for entry in entries] == list(range(stored["log_count"] + 1))
+        assert entries[-1]["line"] == "not written yet"
+        assert [entry["line"] for entry in entries[-compact.LOG_TAIL - 1:-1]] == stored["game_log"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,79 @@
+import asyncio
+import random
+
+import pytest
+
+import compact
+from engine import GamePhase, RiderType, create_new_game
+from game_cache import GameCache
+from history import GameHistory
+from mcts import MCTSBot
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def without_version(doc):
+    return dict(doc, version=None)
+
+
+async def play(cache, history, game, bot=None):
+    """Play the game to the end, one write per action; the state at the start of each turn"""
+    await history.record_created(game)
+    cache.add(game)
+    starts = {game.current_turn: compact.to_document(game)}
+    while game.current_phase != GamePhase.GAME_OVER:
+        for action in (compact.ai_cards_action(game, bot), compact.process_turn_action(game)):
+            if action is not None:
+                compact.apply_action(game, action, bot=bot)
+                cache.mark_dirty(game, action)
+                await cache.flush()
+        starts.setdefault(game.current_turn, compact.to_document(game))
+    return starts
+
+
+def test_rewind_replays_events_since_the_nearest_snapshot():
+    async def scenario():
+        database = mongomock_motor.AsyncMongoMockClient()["test"]
+        history = GameHistory(database.events, database.snapshots, snapshot_every=3)
+        cache = GameCache(database.games, history=history)
+        game_state = create_new_game(["A", "B"], rng=random.Random(2))
+        for rider in game_state.teams[0].riders:
+            rider.rider_type = RiderType.AI_BOT
+        await database.games.insert_one(game_state.dict())
+        game = compact.from_state(game_state)
+
+        starts = await play(cache, history, game)
+        assert len(starts) > 3
+        # One event per action, a snapshot every third write
+        assert await database.events.count_documents({}) == game.version
+        assert await database.snapshots.count_documents({}) == 1 + game.version // 3
+
+        for turn, expected in starts.items():
+            rewound = await history.rewind(game.id, turn=turn)
+            assert without_version(compact.to_document(rewound)) == without_version(expected)
+        assert await history.rewind(game.id, turn=game.current_turn + 1) is None
+
+        latest = await history.rewind(game.id, version=game.version)
+        assert compact.to_document(latest) == compact.to_document(game)
+
+    asyncio.run(scenario())
+
+
+def test_replay_does_not_search_again():
+    async def scenario():
+        database = mongomock_motor.AsyncMongoMockClient()["test"]
+        history = GameHistory(database.events, database.snapshots)
+        cache = GameCache(database.games, history=history)
+        game_state = create_new_game(["A", "B"], rng=random.Random(5))
+        await database.games.insert_one(game_state.dict())
+        game = compact.from_state(game_state)
+        bot = MCTSBot(budget_ms=None, iterations=30, seed=1, table=None)
+        # Every rider is the bot's, the replay has to play its cards without it
+        game.ai[:] = b"\1" * len(game.ai)
+
+        await play(cache, history, game, bot)
+        assert bot.searches
+        replayed = await history.rewind(game.id, version=game.version)
+        assert compact.to_document(replayed) == compact.to_document(game)
+
+    asyncio.run(scenario())
@@ -0,0 +1,95 @@
+import pickle
+import random
+import time
+
+import compact
+from engine import GamePhase, RiderType, create_new_game
+from mcts import MCTSBot, race_from_game, search_stats
+from simulator import play_turn
+from transposition import TranspositionTable, rider_key
+
+
+def new_game(seed, teams=3):
+    game_state = create_new_game([f"Team {i}" for i in range(teams)], rng=random.Random(seed))
+    for team in game_state.teams:
+        for rider in team.riders:
+            rider.rider_type = RiderType.AI_BOT
+    return compact.from_state(game_state)
+
+
+def test_race_from_game_plays_the_same_turns():
+    game = new_game(3)
+    for turn in range(4):
+        race = race_from_game(game)
+        over = play_turn(race, random.Random(turn))
+        compact.process_turn(game, random.Random(turn))
+        assert list(game.position) == race.position
+        assert list(game.lane) == race.lane
+        assert [[compact.card_label(game, c) for c in hand] for hand in game.hands] == [
+            [f"CardType.{'ROULEUR' if card & 16 else 'SPRINTEUR'} {card & 15}" for card in hand]
+            for hand in race.hand]
+        assert over == (game.current_phase == GamePhase.GAME_OVER)
+        if over:
+            break
+
+
+def test_bot_plays_legal_cards_within_its_budget():
+    bot = MCTSBot(budget_ms=20, seed=0, table=None)
+    game = new_game(5)
+    game.ai[:2] = bytes(2)
+    # The human team has played, its cards must not change the search
+    for r in range(2):
+        compact.play_card(game, r, game.hands[r][0])
+    hands = [list(hand) for hand in game.hands]
+
+    started = time.perf_counter()
+    choices = bot.select_cards(game)
+    elapsed = time.perf_counter() - started
+    assert set(choices) == {2, 3, 4, 5}
+    assert all(card in hands[r] for r, card in choices.items())
+    # Two AI teams of 20 ms each, plus some slack for a busy machine
+    assert elapsed < 0.2
+    assert bot.stats()["iterations_per_decision"] > 10
+
+
+def test_tree_is_reused_between_turns():
+    bot = MCTSBot(budget_ms=None, iterations=200, seed=1, table=None)
+    game = new_game(7, teams=2)
+    while game.current_phase != GamePhase.GAME_OVER:
+        compact.process_turn(game, random.Random(game.current_turn), bot=bot)
+    assert game.current_turn > 2
+    assert bot.reused >= bot.decisions // 2
+
+
+def test_decisions_are_shared_between_games():
+    table = TranspositionTable()
+    bot = MCTSBot(budget_ms=None, iterations=50, seed=2, table=table)
+    first, second = new_game(11), new_game(11)
+    assert race_from_game(first).track is race_from_game(second).track
+    # Keyed by content: a race pickled to a search process finds the same entries
+    race = race_from_game(first)
+    assert rider_key(pickle.loads(pickle.dumps(race)), 2) == rider_key(race, 2)
+
+    choices = bot.select_cards(first)
+    assert bot.memoized == 0 and len(table) > 0
+    searched = bot.searched
+    # Same hands at the same places: answered from the table
+    assert [first.card_values[c] for c in choices.values()] == [
+        second.card_values[c] for c in bot.select_cards(second).values()]
+    assert bot.searched == searched
+    assert bot.memoized == bot.searches == 3
+    assert table.hit_rate == 0.5
+
+    # Counters of bots in other processes add up
+    idle = MCTSBot(budget_ms=None, iterations=50, table=TranspositionTable())
+    totals = search_stats({name: count + idle.counters()[name] for name, count in bot.counters().items()})
+    assert totals["table_hit_rate"] == 0.5 and totals["decisions"] == bot.decisions
+
+
+def test_no_search_once_the_race_is_over():
+    game = new_game(1)
+    bot = MCTSBot(iterations=20, seed=1, table=TranspositionTable())
+    while game.current_phase != GamePhase.GAME_OVER:
+        compact.process_turn(game, random.Random(game.current_turn), bot)
+    assert bot.select_cards(game) == {}
+    compact.process_turn(game, random.Random(0), bot)
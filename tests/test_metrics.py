@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from metrics import Registry
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    registry.counter("games_total", "Games").inc(2)
+    movement = registry.histogram("phase_seconds", "Phases", buckets=(0.1, 1.0), phase="movement")
+    movement.observe(0.05)
+    movement.observe(0.5)
+    movement.observe(5)
+    registry.gauge_callback("cache", "Cache", lambda: {(("stat", "size"),): 3})
+    assert registry.render().splitlines() == [
+        "# HELP games_total Games",
+        "# TYPE games_total counter",
+        "games_total 2",
+        "# HELP phase_seconds Phases",
+        "# TYPE phase_seconds histogram",
+        'phase_seconds_bucket{phase="movement",le="0.1"} 1',
+        'phase_seconds_bucket{phase="movement",le="1.0"} 2',
+        'phase_seconds_bucket{phase="movement",le="+Inf"} 3',
+        'phase_seconds_sum{phase="movement"} 5.55',
+        'phase_seconds_count{phase="movement"} 3',
+        "# HELP cache Cache",
+        "# TYPE cache gauge",
+        'cache{stat="size"} 3',
+    ]
+    assert registry.histogram("phase_seconds", "Phases", phase="movement") is movement
+    with pytest.raises(ValueError):
+        registry.counter("phase_seconds", "Phases")
+
+
+def test_disabled_registry_records_nothing():
+    registry = Registry(enabled=False)
+    counter = registry.counter("games_total", "Games")
+    histogram = registry.histogram("phase_seconds", "Phases")
+    counter.inc()
+    with histogram.time():
+        pass
+    assert counter.value == 0 and histogram.count == 0
+
+
+def test_metrics_api(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    pytest.importorskip("httpx")
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+    os.environ.setdefault("DB_NAME", "test")
+    from fastapi.testclient import TestClient
+    import metrics
+    import server
+
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "bot", None)
+    monkeypatch.setattr(server.games, "collection", database.flamme_rouge_games)
+    monkeypatch.setattr(server.games, "archive_collection", database.flamme_rouge_archived_games)
+    monkeypatch.setattr(server.history, "event_collection", database.flamme_rouge_events)
+    monkeypatch.setattr(server.history, "snapshot_collection", database.flamme_rouge_snapshots)
+    client = TestClient(server.app)
+    created = server.GAMES_CREATED.value
+    game_id = client.post("/api/flamme-rouge/new-game", json=["A", "B"]).json()["game_id"]
+    client.post(f"/api/flamme-rouge/game/{game_id}/process-turn")
+
+    response = client.get("/api/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert f"flamme_rouge_games_created_total {created + 1}" in text
+    assert 'flamme_rouge_phase_seconds_count{phase="movement"}' in text
+    assert 'route="/api/flamme-rouge/game/{game_id}/process-turn"' in text
+    assert 'flamme_rouge_game_cache{stat="size"}' in text
+
+    monkeypatch.setattr(metrics.registry, "enabled", False)
+    assert client.get("/api/metrics").status_code == 404
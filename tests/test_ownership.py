@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+httpx = pytest.importorskip("httpx")
+
+from ownership import GameOwnership, OwnerRouting  # noqa: E402
+
+
+def workers(collection, count=2, **kwargs):
+    return [GameOwnership(collection, f"worker-{i}", f"http://worker-{i}", ttl=10, **kwargs) for i in range(count)]
+
+
+def test_one_worker_holds_a_game_until_its_lease_goes():
+    collection = mongomock_motor.AsyncMongoMockClient()["test"]["leases"]
+    lost = []
+    first, second = workers(collection, on_lost=lost.append)
+
+    async def scenario():
+        await first.create_indexes()
+        assert await first.claim("game") is None and first.owns("game")
+        assert await second.claim("game") == "http://worker-0"
+        await first.renew({"game"})
+        assert lost == []
+
+        # Not renewed in time: the next worker takes the game and the first lets go
+        await collection.update_one({"game_id": "game"}, {"$set": {"expires_at": datetime(2000, 1, 1)}})
+        assert await second.claim("game") is None
+        await first.renew({"game"})
+        assert lost == ["game"] and not first.owns("game")
+        assert await first.claim("game") == "http://worker-1"
+
+        # Games no longer cached are not renewed, released ones are free at once
+        await second.renew(set())
+        assert not second.owns("game")
+        await second.release()
+        assert await first.claim("game") is None
+
+    asyncio.run(scenario())
+
+
+def test_requests_are_served_by_the_owner():
+    collection = mongomock_motor.AsyncMongoMockClient()["test"]["leases"]
+
+    def worker_app(name):
+        async def app(scope, receive, send):
+            await receive()
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"x-worker", name.encode())]})
+            await send({"type": "http.response.body", "body": scope["query_string"]})
+        return app
+
+    class Network(httpx.AsyncBaseTransport):
+        """Workers by address, reached in process"""
+
+        async def handle_async_request(self, request):
+            address = f"{request.url.scheme}://{request.url.host}"
+            if address not in routes:
+                raise httpx.ConnectError("unreachable", request=request)
+            return await httpx.ASGITransport(app=routes[address]).handle_async_request(request)
+
+    async def exists(game_id):
+        return game_id != "missing"
+
+    first, second = workers(collection, transport=Network(), secret="shared")
+    routes = {
+        "http://worker-0": OwnerRouting(worker_app("worker-0"), first, exists),
+        "http://worker-1": OwnerRouting(worker_app("worker-1"), second, exists),
+    }
+
+    async def scenario():
+        await first.create_indexes()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=routes["http://worker-1"]),
+                                     base_url="http://worker-1") as client:
+            await first.claim("game")
+            response = await client.get("/api/flamme-rouge/game/game", params={"viewer": "team"})
+            assert response.headers["x-worker"] == "worker-0" and response.text == "viewer=team"
+            assert (await client.get("/api/flamme-rouge/tracks")).headers["x-worker"] == "worker-1"
+            assert second.forwarded == 1
+
+            # Only the workers' secret skips the routing
+            spoofed = await client.get("/api/flamme-rouge/game/game", headers={"x-flamme-rouge-forwarded": "x"})
+            assert spoofed.headers["x-worker"] == "worker-0" and second.forwarded == 2
+            trusted = await client.get("/api/flamme-rouge/game/game", headers={"x-flamme-rouge-forwarded": "shared"})
+            assert trusted.headers["x-worker"] == "worker-1" and second.forwarded == 2
+
+            # No lease on a game that does not exist, the app answers for it
+            assert (await client.get("/api/flamme-rouge/game/missing")).headers["x-worker"] == "worker-1"
+            assert await collection.find_one({"game_id": "missing"}) is None and second.claims == 0
+
+            del routes["http://worker-0"]
+            response = await client.post("/api/flamme-rouge/game/game/process-turn")
+            assert response.status_code == 503 and response.headers["retry-after"] == "10"
+
+    asyncio.run(scenario())
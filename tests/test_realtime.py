@@ -0,0 +1,336 @@
+import asyncio
+import os
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+pytest.importorskip("httpx")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+os.environ.setdefault("DB_NAME", "test")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server.games, "collection", database.flamme_rouge_games)
+    monkeypatch.setattr(server.games, "archive_collection", database.flamme_rouge_archived_games)
+    monkeypatch.setattr(server.history, "event_collection", database.flamme_rouge_events)
+    monkeypatch.setattr(server.history, "snapshot_collection", database.flamme_rouge_snapshots)
+    monkeypatch.setattr(server.games, "log_collection", database.flamme_rouge_logs)
+    return TestClient(server.app)
+
+
+def apply_patch(doc, ops):
+    for op in ops:
+        *parents, key = op["path"].split("/")[1:]
+        target = doc
+        for part in parents:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        if op["op"] == "add" and key == "-":
+            target.append(op["value"])
+        elif isinstance(target, list):
+            target[int(key)] = op["value"]
+        else:
+            target[key] = op["value"]
+
+
+def token(created, team=0):
+    """The viewer of a human team, which only new-game tells"""
+    return created["tokens"][created["game_state"]["teams"][team]["id"]]
+
+
+def own_riders(client, created, team=0):
+    """The riders of a team with their hands, which only its own view shows"""
+    state = client.get(f"/api/flamme-rouge/game/{created['game_id']}", params={"viewer": token(created, team)}).json()
+    return state["game_state"]["teams"][team]["riders"]
+
+
+def test_subscribers_follow_the_game_through_patches(client):
+    created = client.post("/api/flamme-rouge/new-game", json=["Human", "AI"]).json()
+    game_id, viewer = created["game_id"], token(created)
+    url = f"/api/flamme-rouge/game/{game_id}"
+    with client.websocket_connect(f"{url}/ws?viewer={viewer}") as player, \
+            client.websocket_connect(f"{url}/ws") as spectator:
+        views = []
+        for ws in (player, spectator):
+            message = ws.receive_json()
+            assert message["type"] == "snapshot" and message["seq"] == 0
+            assert "rng_state" not in message["game_state"]
+            assert message["game_state"]["teams"][1]["riders"][0]["hand"] is None
+            views.append(message["game_state"])
+        assert all(rider["hand"] is None for team in views[1]["teams"] for rider in team["riders"])
+
+        for rider in views[0]["teams"][0]["riders"]:
+            client.post(f"{url}/select-card",
+                        params={"viewer": viewer, "rider_id": rider["id"], "card_id": rider["hand"][0]["id"]})
+        client.post(f"{url}/process-turn")
+
+        for ws, view in zip((player, spectator), views):
+            messages = [ws.receive_json() for _ in range(3)]
+            assert [message["seq"] for message in messages] == [1, 2, 3]
+            assert {op["path"] for op in messages[0]["ops"]} >= {
+                "/teams/0/riders/0/played_card", "/teams/0/riders/0/hand_count", "/game_log/-"}
+            assert {"/current_turn", "/teams/1/riders/0/position"} <= {op["path"] for op in messages[2]["ops"]}
+            for message in messages:
+                assert not {"/rng_state", "/teams/1/riders/0/hand", "/teams/0/sprinteur_deck"} & {
+                    op["path"] for op in message["ops"]}
+                apply_patch(view, message["ops"])
+        # Played cards stay hidden from the other teams while they choose theirs
+        assert {"op": "replace", "path": "/teams/0/riders/0/played_card", "value": None} in messages[0]["ops"]
+
+    for params, view in zip(({"viewer": viewer}, {}), views):
+        state = client.get(url, params=params).json()["game_state"]
+        assert view["game_log"][-len(state["game_log"]):] == state["game_log"]
+        view["game_log"] = state["game_log"]
+        assert view == state
+    assert server.hub.subscribers(game_id) == 0
+
+
+def test_unknown_game_is_refused(client):
+    from starlette.websockets import WebSocketDisconnect
+
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect("/api/flamme-rouge/game/missing/ws") as ws:
+            ws.receive_json()
+    assert e.value.code == 1008
+
+
+def test_bulk_turn_selects_all_or_nothing_then_resolves(client):
+    created = client.post("/api/flamme-rouge/new-game", json=["Human", "AI"]).json()
+    game_id, riders = created["game_id"], own_riders(client, created)
+    selections = [{"rider_id": r["id"], "card_id": r["hand"][0]["id"]} for r in riders]
+    url, viewer = f"/api/flamme-rouge/game/{game_id}/turn", {"viewer": token(created)}
+
+    bad = selections[:1] + [{"rider_id": riders[1]["id"], "card_id": "missing"}]
+    response = client.post(url, params=viewer, json={"selections": bad})
+    assert response.status_code == 404
+    state = client.get(f"/api/flamme-rouge/game/{game_id}").json()["game_state"]
+    assert all(r["played_card"] is None for r in state["teams"][0]["riders"])
+    assert client.post(url, params=viewer, json={"resolve": False}).status_code == 400
+
+    response = client.post(url, params=viewer, json={"selections": selections[:1], "resolve": False})
+    assert response.json()["game_state"]["current_turn"] == 1
+    response = client.post(url, params=viewer, json={"selections": selections})
+    assert response.status_code == 409
+    state = client.post(url, params=viewer, json={"selections": selections[1:]}).json()
+    assert state["game_state"]["current_turn"] == 2
+    assert f"{riders[1]['name']} played" in " ".join(state["game_state"]["game_log"])
+
+
+def test_players_select_cards_for_their_own_riders_only(client):
+    created = client.post("/api/flamme-rouge/new-game", json=["Human", "AI"]).json()
+    url = f"/api/flamme-rouge/game/{created['game_id']}"
+    teams = created["game_state"]["teams"]
+    # Only the human team gets a token, the ids in every view show no hand
+    assert list(created["tokens"]) == [teams[0]["id"]]
+    assert client.get(url, params={"viewer": teams[1]["id"]}).status_code == 404
+    assert client.get(url, params={"viewer": teams[0]["id"]}).status_code == 404
+
+    rider = own_riders(client, created)[0]
+    rival = teams[1]["riders"][0]["id"]
+    card = {"card_id": rider["hand"][0]["id"]}
+    assert client.post(f"{url}/select-card", params={"rider_id": rider["id"], **card}).status_code == 403
+    response = client.post(f"{url}/select-card", params={"viewer": token(created), "rider_id": rival, **card})
+    assert response.status_code == 403
+    response = client.post(f"{url}/turn", params={"viewer": token(created)}, json={"selections": [
+        {"rider_id": rider["id"], **card}, {"rider_id": rival, **card}]})
+    assert response.status_code == 403
+    state = client.get(url).json()["game_state"]
+    assert not any(r["card_selected"] for team in state["teams"] for r in team["riders"])
+
+
+def test_turn_refused_by_the_ai_can_be_retried(client, monkeypatch):
+    from executor import Overloaded
+
+    created = client.post("/api/flamme-rouge/new-game", json=["Human", "AI"]).json()
+    game_id, riders = created["game_id"], own_riders(client, created)
+    selections = [{"rider_id": r["id"], "card_id": r["hand"][0]["id"]} for r in riders]
+    url, viewer = f"/api/flamme-rouge/game/{game_id}/turn", {"viewer": token(created)}
+
+    async def overloaded(*args):
+        raise Overloaded("Too much work queued")
+
+    monkeypatch.setattr(server, "bot", server.MCTSBot(budget_ms=None, iterations=20))
+    with monkeypatch.context() as patch:
+        patch.setattr(server.executor, "run", overloaded)
+        response = client.post(url, params=viewer, json={"selections": selections})
+    assert response.status_code == 503
+    state = client.get(f"/api/flamme-rouge/game/{game_id}").json()["game_state"]
+    assert all(r["played_card"] is None for r in state["teams"][0]["riders"])
+
+    response = client.post(url, params=viewer, json={"selections": selections})
+    assert response.status_code == 200
+    assert response.json()["game_state"]["current_turn"] == 2
+
+
+def test_polls_revalidate_with_etags(client, monkeypatch):
+    import msgpack
+
+    created = client.post("/api/flamme-rouge/new-game", json=["Human", "AI"]).json()
+    url = f"/api/flamme-rouge/game/{created['game_id']}"
+    etag = client.get(url).headers["etag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    riders = own_riders(client, created)
+    client.post(f"{url}/turn", params={"viewer": token(created)}, json={"selections": [
+        {"rider_id": r["id"], "card_id": r["hand"][0]["id"]} for r in riders]})
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+    packed = client.get(url, headers={"Accept": "application/msgpack"})
+    assert packed.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(packed.content) == changed.json()
+
+    partial = client.get(url, params={"fields": "current_turn,current_phase"}).json()["game_state"]
+    assert partial == {"current_turn": 2, "current_phase": "card_selection"}
+    assert client.get(url, params={"fields": "teams,nope"}).status_code == 400
+
+    # Expired from the cache: projected by MongoDB, with the ETag of a loaded game
+    asyncio.run(server.games.flush())
+    clock = server.games.clock
+    monkeypatch.setattr(server.games, "clock", lambda: clock() + server.games.ttl + 1)
+    stored = client.get(url, params={"fields": "current_turn,teams"})
+    assert stored.json()["game_state"]["current_turn"] == 2
+    assert stored.json()["game_state"]["teams"] == changed.json()["game_state"]["teams"]
+    assert client.get(url, headers={"If-None-Match": stored.headers["etag"]}).status_code == 304
+
+
+def test_viewers_only_get_their_own_hands(client, monkeypatch):
+    created = client.post("/api/flamme-rouge/new-game", json=["Human", "Rival"]).json()
+    url = f"/api/flamme-rouge/game/{created['game_id']}"
+    viewer = {"viewer": token(created)}
+
+    state = client.get(url, params=viewer).json()["game_state"]
+    assert state["teams"][0]["riders"][0]["hand"] and state["teams"][1]["riders"][0]["hand"] is None
+    assert "rng_state" not in state and "sprinteur_deck" not in state["teams"][1]
+    assert all("token" not in team for team in state["teams"])
+    assert client.get(url, params={"viewer": "nobody"}).status_code == 404
+    assert client.get(url, params={**viewer, "fields": "rng_state"}).status_code == 400
+    # Without a viewer: a spectator, who sees no hand
+    assert all(r["hand"] is None for team in client.get(url).json()["game_state"]["teams"] for r in team["riders"])
+
+    rider = state["teams"][0]["riders"][0]
+    selected = client.post(f"{url}/select-card", params={
+        **viewer, "rider_id": rider["id"], "card_id": rider["hand"][0]["id"]}).json()["game_state"]
+    assert selected["teams"][0]["riders"][0]["played_card"] == rider["hand"][0]
+    # Played cards stay hidden from the others
+    spectator = client.get(url).json()["game_state"]
+    assert spectator["teams"][0]["riders"][0]["card_selected"]
+    assert spectator["teams"][0]["riders"][0]["played_card"] is None
+
+    # Expired from the cache: the same views, built by MongoDB
+    asyncio.run(server.games.flush())
+    cached = client.get(url, params=viewer).json()["game_state"]
+    assert cached == dict(selected, version=selected["version"] + 1)
+    clock = server.games.clock
+    monkeypatch.setattr(server.games, "clock", lambda: clock() + server.games.ttl + 1)
+    assert client.get(url, params=viewer).json()["game_state"] == cached
+    assert client.get(url).json()["game_state"] == dict(spectator, version=spectator["version"] + 1)
+    assert client.get(url, params={"viewer": "nobody"}).status_code == 404
+    assert client.get(url, params={"viewer": state["teams"][0]["id"]}).status_code == 404
+
+
+def test_history_replays_a_game_to_a_past_turn(client):
+    created = client.post("/api/flamme-rouge/new-game", json=["Human", "AI"]).json()
+    url = f"/api/flamme-rouge/game/{created['game_id']}"
+    viewer = {"viewer": token(created)}
+    starts = {}
+    for _ in range(3):
+        state = client.get(url, params=viewer).json()["game_state"]
+        starts[state["current_turn"]] = state
+        selections = [{"rider_id": r["id"], "card_id": r["hand"][0]["id"]} for r in state["teams"][0]["riders"]]
+        assert client.post(f"{url}/turn", params=viewer, json={"selections": selections}).status_code == 200
+    # Only written actions are replayed
+    asyncio.run(server.games.flush())
+
+    for turn in (1, 2, 3):
+        past = client.get(f"{url}/history", params={**viewer, "turn": turn}).json()["game_state"]
+        assert past["current_turn"] == turn
+        assert [[r["position"] for r in team["riders"]] for team in past["teams"]] == [
+            [r["position"] for r in team["riders"]] for team in starts[turn]["teams"]]
+        assert past["teams"][0]["riders"][0]["hand"] == starts[turn]["teams"][0]["riders"][0]["hand"]
+        assert past["teams"][1]["riders"][0]["hand"] is None
+    assert client.get(f"{url}/history", params={"turn": 9}).status_code == 404
+    assert client.get(f"{url}/history", params={"turn": 1, "version": 1}).status_code == 400
+    assert client.get(f"{url}/history").status_code == 400
+
+
+def test_log_pages_stay_whole_across_flushes(client, monkeypatch):
+    created = client.post("/api/flamme-rouge/new-game", json=["Human", "AI 1", "AI 2"]).json()
+    url, viewer = f"/api/flamme-rouge/game/{created['game_id']}", {"viewer": token(created)}
+    game = server.games.peek(created["game_id"])
+    # A short tail: a turn's lines are more than it holds, and races may end by the fourth turn
+    monkeypatch.setattr(server.compact, "LOG_TAIL", 5)
+
+    def play(turns):
+        for _ in range(turns):
+            riders = client.get(url, params=viewer).json()["game_state"]["teams"][0]["riders"]
+            selections = [{"rider_id": r["id"], "card_id": r["hand"][0]["id"]} for r in riders]
+            assert client.post(f"{url}/turn", params=viewer, json={"selections": selections}).status_code == 200
+
+    def read(since, pages):
+        entries = []
+        for _ in range(pages):
+            page = client.get(f"{url}/log", params={"since": since, "limit": 7}).json()
+            entries += page["entries"]
+            since = page["next"]
+        return entries, since
+
+    play(1)
+    assert len(game.game_log) > server.compact.LOG_TAIL + 7
+    entries, since = read(-1, 1)
+
+    # A write that fails keeps its lines in memory, until they are stored
+    update_one = server.games.collection.update_one
+
+    async def failing(*args, **kwargs):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(server.games.collection, "update_one", failing)
+    with pytest.raises(ConnectionError):
+        asyncio.run(server.games.flush())
+    more, since = read(since, 2)
+    entries += more
+    assert [entry["seq"] for entry in entries] == list(range(since + 1))
+    monkeypatch.setattr(server.games.collection, "update_one", update_one)
+
+    # Stored, the lines out of the tail leave memory: the next pages come from the collection
+    asyncio.run(server.games.flush())
+    assert len(game.game_log) == server.compact.LOG_TAIL
+    more, since = read(since, 2)
+    entries += more
+
+    # Read while the lines are being inserted: still in memory
+    play(1)
+    insert_log = server.games._insert_log
+
+    async def flush_while_reading():
+        inserting, inserted = asyncio.Event(), asyncio.Event()
+
+        async def slow_insert(log):
+            inserting.set()
+            await inserted.wait()
+            await insert_log(log)
+
+        monkeypatch.setattr(server.games, "_insert_log", slow_insert)
+        flush = asyncio.ensure_future(server.games.flush())
+        await inserting.wait()
+        during = await server.games.log_entries(game, since, limit=500)
+        inserted.set()
+        await flush
+        return during
+
+    during = asyncio.run(flush_while_reading())
+    more, since = read(since, 100)
+    assert more == during
+    entries += more
+    assert [entry["seq"] for entry in entries] == list(range(game.log_base + len(game.game_log)))
+    assert [entry["line"] for entry in entries[-len(game.game_log):]] == game.game_log
+    assert client.get(f"{url}/log", params={"since": since}).json() == {"status": "success", "entries": [],
+                                                                        "next": since}
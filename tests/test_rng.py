@@ -0,0 +1,71 @@
+import random
+
+import compact
+from engine import FlammeRougeEngine, GamePhase, RiderType, create_new_game
+from rng import GameRandom
+
+
+def test_state_round_trips_through_a_string():
+    rng = GameRandom(42)
+    rng.shuffle(list(range(10)))
+    saved = rng.dumps()
+    assert len(saved) == 32
+    draws = [rng.random(), rng.choice("abcdef"), rng.getrandbits(70), rng.randrange(7)]
+    restored = GameRandom.loads(saved)
+    assert [restored.random(), restored.choice("abcdef"), restored.getrandbits(70), restored.randrange(7)] == draws
+    assert GameRandom("game-1").random() == GameRandom("game-1").random() != GameRandom("game-2").random()
+    values = [rng.random() for _ in range(20000)]
+    assert 0.49 < sum(values) / len(values) < 0.51 and 0 <= min(values) and max(values) < 1
+
+
+def ai_game(seed):
+    game_state = create_new_game(["A", "B", "C"], rng=GameRandom(seed))
+    for team in game_state.teams:
+        for rider in team.riders:
+            rider.rider_type = RiderType.AI_BOT
+    return game_state
+
+
+def outcome(game):
+    """What the draws decide, ids aside"""
+    return list(game.position), list(game.lane), game.rng.dumps()
+
+
+def play(game, turns):
+    for _ in range(turns):
+        if game.current_phase == GamePhase.GAME_OVER:
+            break
+        compact.process_turn(game)
+
+
+def test_games_only_draw_from_their_own_generator():
+    alone = compact.from_state(ai_game(1))
+    play(alone, 30)
+
+    game, other = compact.from_state(ai_game(1)), compact.from_state(ai_game(2))
+    for _ in range(30):
+        # Other games and the global generator must not change this one
+        random.random()
+        play(other, 1)
+        play(game, 1)
+    assert outcome(game) == outcome(alone)
+    assert game.game_log == alone.game_log
+
+
+def test_stored_games_carry_on_with_the_same_draws():
+    game = compact.from_state(ai_game(3))
+    play(game, 2)
+    stored = compact.to_document(game)
+    update, _ = compact.take_update(game)
+    assert update["$set"]["rng_state"] == stored["rng_state"]
+    play(game, 3)
+
+    reloaded = compact.from_document(stored)
+    play(reloaded, 3)
+    assert compact.to_document(reloaded) == compact.to_document(game)
+
+    # The engine draws from the same generator, in the same order
+    game_state = compact.to_state(compact.from_document(stored))
+    for _ in range(3):
+        FlammeRougeEngine.process_turn(game_state)
+    assert outcome(compact.from_state(game_state)) == outcome(game)
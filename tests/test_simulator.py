@@ -0,0 +1,49 @@
+import random
+
+from engine import FlammeRougeEngine, GamePhase, RiderType, create_new_game
+from simulator import run_parallel, simulate_many, simulate_race
+
+
+def play_engine_game(team_count, seed, max_turns):
+    rng = random.Random(seed)
+    game_state = create_new_game([f"Team {i}" for i in range(team_count)], rng=rng)
+    for team in game_state.teams:
+        for rider in team.riders:
+            rider.rider_type = RiderType.AI_BOT
+    while game_state.current_phase != GamePhase.GAME_OVER and game_state.current_turn <= max_turns:
+        FlammeRougeEngine.process_turn(game_state, rng)
+    return game_state
+
+
+def test_simulator_matches_engine():
+    checked = 0
+    for seed in range(60):
+        team_count = 2 + seed % 5
+        result = simulate_race(team_count, seed=seed)
+        if not result.completed:
+            continue
+        game_state = play_engine_game(team_count, seed, result.turns)
+        riders = [r for team in game_state.teams for r in team.riders]
+        index = {r.id: i for i, r in enumerate(riders)}
+
+        assert game_state.current_phase == GamePhase.GAME_OVER
+        assert game_state.current_turn == result.turns
+        assert [index[rider_id] for rider_id in game_state.finished_riders] == result.finish_order
+        assert [r.fatigue_count for r in riders] == result.fatigue
+        checked += 1
+    assert checked > 40
+
+
+def test_simulate_many_is_deterministic():
+    first = simulate_many(200, 3, seed=7)
+    second = simulate_many(200, 3, seed=7)
+    assert first.races == 200
+    assert (first.wins, first.fatigue, first.total_turns) == (second.wins, second.fatigue, second.total_turns)
+    assert sum(first.wins) == first.completed
+
+
+def test_run_parallel_does_not_depend_on_worker_count():
+    sequential = simulate_many(600, ["A", "B", "C"], seed=11)
+    for workers, chunk_size in ((1, 2000), (2, 50), (3, 170)):
+        batch = run_parallel(600, ["A", "B", "C"], seed=11, workers=workers, chunk_size=chunk_size)
+        assert batch.totals() == sequential.totals()
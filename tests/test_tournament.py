@@ -0,0 +1,50 @@
+import pytest
+
+from tournament import INITIAL_RATING, Tournament, TournamentConfig, open_tournament
+
+
+def config(**kwargs):
+    return TournamentConfig(["a=heuristic", "b=heuristic", "mcts:5it"], **{"games": 60, **kwargs})
+
+
+def test_ratings_move_with_each_result():
+    tournament = Tournament(TournamentConfig(["a=heuristic", "b=heuristic", "c=heuristic"], teams=3))
+    tournament.record(0)
+    tournament.record(None)
+    first, _, _ = tournament._rounds[0][1]
+    assert tournament.ratings[first] == pytest.approx(INITIAL_RATING + 8)
+    assert sum(tournament.ratings) == pytest.approx(3 * INITIAL_RATING)
+    assert tournament.games == [2, 2, 2] and tournament.stalled == 1
+    assert tournament.standings()[0]["name"] == "abc"[first]
+
+
+def test_a_stopped_tournament_resumes_where_it_was(tmp_path):
+    checkpoint = tmp_path / "tournament.json"
+    stopped = open_tournament(config(), checkpoint)
+    stopped.run(chunk_size=7, checkpoint=checkpoint, checkpoint_every=7, limit=25)
+    assert open_tournament(config(), checkpoint).next_game == 25
+    resumed = open_tournament(config(), checkpoint)
+    resumed.run(chunk_size=7, checkpoint=checkpoint)
+
+    whole = Tournament(config())
+    whole.run(chunk_size=60)
+    assert resumed.export() == whole.export()
+    assert sum(row["games"] for row in whole.standings()) == 2 * 60
+    assert set(whole.track_win_rates()) == set(config().tracks)
+
+    with pytest.raises(ValueError):
+        open_tournament(config(seed=1), checkpoint)
+
+
+def test_parallel_games_are_applied_in_order():
+    sequential, parallel = Tournament(config()), Tournament(config())
+    sequential.run(chunk_size=5)
+    parallel.run(workers=2, chunk_size=5)
+    assert parallel.export() == sequential.export()
+
+
+def test_unknown_ai_is_refused():
+    with pytest.raises(ValueError):
+        TournamentConfig(["heuristic", "random"])
+    with pytest.raises(ValueError):
+        TournamentConfig(["heuristic", "x=heuristic"], teams=3)
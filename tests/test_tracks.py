@@ -0,0 +1,121 @@
+import os
+import random
+import re
+
+import pytest
+
+import compact
+from engine import FlammeRougeEngine, GameState, TerrainType, WeatherType, create_new_game, get_layout
+from tracks import TrackDefinitionError, add_track, parse_track, to_definition, track_by_name
+
+
+def peaks_definition():
+    return to_definition(track_by_name("The Peaks"))
+
+
+def test_the_peaks_matches_the_sample_track():
+    layout = track_by_name("The Peaks")
+    sample = FlammeRougeEngine.create_sample_track()
+    assert sample.id == layout.id
+    assert [(t.terrain, t.lanes) for t in sample.tiles] == [(t.terrain, t.lanes) for t in layout.tiles]
+    # Same content, same layout
+    assert parse_track(peaks_definition()) is layout
+    assert parse_track(dict(peaks_definition(), name="Other Peaks")).id != layout.id
+
+
+@pytest.mark.parametrize("change, message", [
+    (lambda d: d["segments"].pop(0), "starts with"),
+    (lambda d: d["segments"].pop(), "ends with"),
+    (lambda d: d["segments"][-1].update(length=2), "single tile"),
+    (lambda d: d["segments"][1].update(lanes=0), "segments[1].lanes"),
+    (lambda d: d["segments"][0].update(lanes=1), "the start is at least 2 lanes"),
+    (lambda d: [s.update(lanes=1) for s in d["segments"]], "the start is at least 2 lanes"),
+    (lambda d: d["segments"][2].update(terrain="lava"), "segments[2].terrain"),
+    (lambda d: d["segments"][2].update(weather="snow"), "segments[2].weather"),
+    (lambda d: d["segments"][3].update(length=True), "segments[3].length"),
+    (lambda d: d["segments"][3].update(slope=4), "unknown keys"),
+    (lambda d: d.update(name=" "), "name"),
+    (lambda d: d["segments"][1].update(length=500), "at most"),
+])
+def test_invalid_definitions_are_rejected(change, message):
+    definition = peaks_definition()
+    change(definition)
+    with pytest.raises(TrackDefinitionError, match=re.escape(message)):
+        parse_track(definition)
+
+
+def test_games_store_a_reference_to_their_track():
+    game_state = create_new_game(["A", "B"], "North Sea Cobbles", rng=random.Random(1))
+    layout = track_by_name("North Sea Cobbles")
+    doc = game_state.dict()
+    assert doc["track"] == {"id": layout.id, "name": "North Sea Cobbles", "length": layout.length}
+
+    game = compact.from_document(doc)
+    assert game.tables is layout.tables
+    assert compact.to_document(game) == doc
+    restored = GameState(**doc)
+    assert restored.track.tiles == list(layout.tiles)
+    assert restored.track.tiles[8].lanes == 1 and restored.track.tiles[8].terrain == TerrainType.COBBLESTONE
+
+    with pytest.raises(ValueError, match="Unknown track"):
+        create_new_game(["A", "B"], "Nowhere")
+
+
+def test_segment_weather_moves_riders():
+    definition = {"name": "Windy Straight", "segments": [
+        {"terrain": "start", "length": 2}, {"terrain": "normal", "length": 4},
+        {"terrain": "normal", "length": 4, "weather": "tailwind"}, {"terrain": "finish", "length": 1}]}
+    tables = add_track(parse_track(definition)).tables
+    assert tables.move(2, 4, WeatherType.NONE) == 4
+    assert tables.move(6, 4, WeatherType.NONE) == 5
+    # The tile's own weather wins over the race's
+    assert tables.move(2, 4, WeatherType.HEADWIND) == 3
+    assert tables.move(6, 4, WeatherType.HEADWIND) == 5
+
+    # Games on the track race on these tables
+    game = compact.from_state(create_new_game(["A", "B"], "Windy Straight", rng=random.Random(0)))
+    assert game.tables is tables
+
+
+def test_documents_with_embedded_tiles_are_migrated():
+    doc = create_new_game(["A", "B"], rng=random.Random(2)).dict()
+    layout = get_layout(doc["track"]["id"])
+    # Stored before tracks were references: uuid ids and all the tiles
+    doc["track"] = {"id": "b0e5c1d8-legacy", "name": "The Peaks", "length": layout.length,
+                    "tiles": [dict(tile.dict(), id=f"tile-{tile.position}") for tile in layout.tiles]}
+    game = compact.from_document(doc)
+    assert game.layout is layout
+    update, _ = compact.take_update(game)
+    assert update["$set"]["track"] == layout.reference()
+
+
+def test_tracks_api(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    pytest.importorskip("httpx")
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+    os.environ.setdefault("DB_NAME", "test")
+    from fastapi.testclient import TestClient
+    import server
+
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server.games, "collection", database.flamme_rouge_games)
+    monkeypatch.setattr(server.games, "archive_collection", database.flamme_rouge_archived_games)
+    monkeypatch.setattr(server.history, "event_collection", database.flamme_rouge_events)
+    monkeypatch.setattr(server.history, "snapshot_collection", database.flamme_rouge_snapshots)
+    client = TestClient(server.app)
+    definition = {"name": "Short Hill", "segments": [
+        {"terrain": "start", "length": 2}, {"terrain": "mountain", "length": 4, "lanes": 1},
+        {"terrain": "finish", "length": 1}]}
+    track = client.post("/api/flamme-rouge/tracks", json=definition).json()["track"]
+    assert track["length"] == 7
+    assert client.post("/api/flamme-rouge/tracks", json={"name": "Bad", "segments": []}).status_code == 400
+    assert "Short Hill" in {t["name"] for t in client.get("/api/flamme-rouge/tracks").json()["tracks"]}
+
+    response = client.get(f"/api/flamme-rouge/tracks/{track['id']}")
+    assert "immutable" in response.headers["cache-control"]
+    assert [tile["lanes"] for tile in response.json()["track"]["tiles"]] == [2, 2, 1, 1, 1, 1, 2]
+
+    created = client.post("/api/flamme-rouge/new-game", json=["A", "B"], params={"track_name": "Short Hill"})
+    assert created.json()["game_state"]["track"] == track
+    assert client.post("/api/flamme-rouge/new-game", json=["A"], params={"track_name": "Nope"}).status_code == 400
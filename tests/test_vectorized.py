@@ -0,0 +1,80 @@
+import math
+import random
+
+import numpy as np
+
+from engine import FlammeRougeEngine, GamePhase, RiderType, create_new_game
+from simulator import STALL_TURNS
+from vectorized import RaceBatch, simulate_vectorized
+
+TEAMS = 3
+ENGINE_RACES = 300
+
+
+def play_engine_race(rng):
+    """All-AI game, stopped like the simulators once nobody can move anymore"""
+    game_state = create_new_game([f"Team {i}" for i in range(TEAMS)], rng=rng)
+    riders = [r for team in game_state.teams for r in team.riders]
+    for rider in riders:
+        rider.rider_type = RiderType.AI_BOT
+    idle_turns = 0
+    while game_state.current_phase != GamePhase.GAME_OVER and idle_turns < STALL_TURNS:
+        before = [r.position.track_position for r in riders]
+        FlammeRougeEngine.process_turn(game_state, rng)
+        moved = before != [r.position.track_position for r in riders]
+        idle_turns = 0 if moved else idle_turns + 1
+    return game_state
+
+
+def engine_statistics():
+    rng = random.Random(1234)
+    wins = [0] * TEAMS
+    completed = turns = fatigue = 0
+    for _ in range(ENGINE_RACES):
+        game_state = play_engine_race(rng)
+        turns += game_state.current_turn
+        fatigue += sum(r.fatigue_count for team in game_state.teams for r in team.riders)
+        if game_state.current_phase == GamePhase.GAME_OVER:
+            completed += 1
+            winner = game_state.finished_riders[0]
+            wins[next(i for i, t in enumerate(game_state.teams) for r in t.riders if r.id == winner)] += 1
+    return {
+        "win_share": [w / completed for w in wins],
+        "completion": completed / ENGINE_RACES,
+        "mean_turns": turns / ENGINE_RACES,
+        "mean_fatigue": fatigue / ENGINE_RACES,
+    }
+
+
+def assert_close(engine_value, vector_value, spread, samples):
+    # Four standard errors of the (much smaller) engine sample
+    assert abs(engine_value - vector_value) <= 4 * spread / math.sqrt(samples), (engine_value, vector_value)
+
+
+def test_vectorized_statistics_match_engine():
+    expected = engine_statistics()
+
+    batch = RaceBatch(20000, TEAMS, rng=np.random.default_rng(99))
+    batch.run()
+    result = batch.result()
+    assert result.races == 20000
+
+    completed = round(expected["completion"] * ENGINE_RACES)
+    for team in range(TEAMS):
+        share = result.wins[team] / result.completed
+        assert_close(expected["win_share"][team], share, math.sqrt(share * (1 - share)), completed)
+
+    rate = result.completed / result.races
+    assert_close(expected["completion"], rate, math.sqrt(rate * (1 - rate)), ENGINE_RACES)
+
+    # Spreads measured on large runs: about 2 turns and 5 fatigue cards per race
+    assert_close(expected["mean_turns"], result.mean_turns, 2.0, ENGINE_RACES)
+    assert_close(expected["mean_fatigue"], sum(result.fatigue) / result.races, 5.0, ENGINE_RACES)
+
+
+def test_simulate_vectorized_is_deterministic():
+    first = simulate_vectorized(3000, TEAMS, seed=5, batch_size=1000)
+    second = simulate_vectorized(3000, TEAMS, seed=5, batch_size=1000)
+    assert first.totals() == second.totals()
+    assert first.races == 3000
+    assert sum(first.wins) == first.completed